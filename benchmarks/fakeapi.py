@@ -0,0 +1,299 @@
+"""
+Local stand-in for the RightScale 1.5 API, for benchmarks and offline tests.
+
+Serves ``/api/oauth2``, ``/api/sessions``, ``/api/health-check`` and a small
+generated account (clouds and their instances, deployments and their servers,
+server arrays, RightScripts) with the same vendor content types the real API
+uses, so :data:`rightscale.actions.COLLECTIONS` applies as usual.  Latency,
+payload size and error rate are configurable.
+
+Usage from Python::
+
+    from fakeapi import FakeRightScale
+    fake = FakeRightScale(latency=0.005, instances=200)
+    fake.start()
+    api = RightScale(refresh_token='x', api_endpoint=fake.url)
+    ...
+    fake.stop()
+
+or standalone::
+
+    python benchmarks/fakeapi.py --port 8080 --latency 0.01
+"""
+import BaseHTTPServer
+import json
+import optparse
+import random
+import SocketServer
+import threading
+import time
+import urlparse
+
+
+CONTENT_TYPE = 'application/vnd.rightscale.%s+json'
+COLLECTION_SUFFIX = ';type=collection'
+
+TOKEN_TTL = 7200
+
+# collection name -> resource type
+SINGULAR = {
+        'clouds': 'cloud',
+        'instances': 'instance',
+        'deployments': 'deployment',
+        'servers': 'server',
+        'server_arrays': 'server_array',
+        'right_scripts': 'right_script',
+        'audit_entries': 'audit_entry',
+        }
+
+
+def _links(href, **rels):
+    links = [{'rel': 'self', 'href': href}]
+    links.extend({'rel': k, 'href': v} for k, v in sorted(rels.items()))
+    return links
+
+
+class FakeAccount(object):
+    """
+    A generated account: every resource by href, and the hrefs in every
+    collection.
+
+    :param int payload: Bytes of filler added to every resource.
+    """
+    def __init__(self, clouds=3, instances=100, deployments=10, servers=10,
+                 payload=0):
+        self.resources = {}
+        self.collections = dict(
+                ('/api/' + name, []) for name in SINGULAR)
+        filler = 'x' * payload
+
+        def add(collection, kind, href, soul):
+            soul['description'] = filler
+            soul['updated_at'] = '2014/06/01 00:00:00 +0000'
+            self.resources[href] = (kind, soul)
+            self.collections.setdefault(collection, []).append(href)
+
+        for c in range(1, clouds + 1):
+            cloud = '/api/clouds/%d' % c
+            add('/api/clouds', 'cloud', cloud, {
+                    'name': 'cloud-%d' % c,
+                    'links': _links(cloud, instances=cloud + '/instances'),
+                    })
+            self.collections[cloud + '/instances'] = []
+            for i in range(instances):
+                href = '%s/instances/I%d' % (cloud, i)
+                add(cloud + '/instances', 'instance', href, {
+                        'name': 'instance-%d-%d' % (c, i),
+                        'state': 'operational',
+                        'resource_uid': 'i-%08x' % (c * 100000 + i),
+                        'links': _links(href, cloud=cloud),
+                        })
+
+        for d in range(1, deployments + 1):
+            deploy = '/api/deployments/%d' % d
+            add('/api/deployments', 'deployment', deploy, {
+                    'name': 'deployment-%d' % d,
+                    'links': _links(
+                        deploy,
+                        servers=deploy + '/servers',
+                        server_arrays=deploy + '/server_arrays'),
+                    })
+            self.collections[deploy + '/servers'] = []
+            self.collections[deploy + '/server_arrays'] = []
+            for s in range(servers):
+                n = (d - 1) * servers + s + 1
+                href = '/api/servers/%d' % n
+                instance = '/api/clouds/1/instances/I%d' % (
+                        n % max(instances, 1))
+                add(deploy + '/servers', 'server', href, {
+                        'name': 'server-%d' % n,
+                        'state': 'operational',
+                        'links': _links(
+                            href, deployment=deploy,
+                            current_instance=instance),
+                        })
+                self.collections['/api/servers'].append(href)
+
+        for r in range(1, 4):
+            href = '/api/right_scripts/%d' % r
+            add('/api/right_scripts', 'right_script', href, {
+                    'name': 'script-%d' % r,
+                    'links': _links(href),
+                    })
+
+        self.session = {'links': [
+                {'rel': name, 'href': '/api/' + name}
+                for name in sorted(SINGULAR) if name != 'instances'
+                ]}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send each response in one go; header-by-header writes plus Nagle make
+    # every keep-alive request wait on a delayed ACK
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None, content_type='application/json',
+              **headers):
+        data = json.dumps(body) if body is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k.replace('_', '-'), v)
+        if self.close_connection:
+            # like a real server, so the client doesn't reuse the socket
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _prepare(self):
+        fake = self.server.fake
+        length = int(self.headers.get('content-length') or 0)
+        if length:
+            self.rfile.read(length)
+        fake.count(self.command)
+        if fake.latency or fake.jitter:
+            time.sleep(fake.latency + random.random() * fake.jitter)
+        if fake.error_rate and random.random() < fake.error_rate:
+            self._send(503, {'error': 'injected'}, Retry_After='0')
+            return None
+        return fake
+
+    def do_POST(self):
+        fake = self._prepare()
+        if fake is None:
+            return
+        path = urlparse.urlparse(self.path).path
+        if path == '/api/oauth2':
+            fake.logins += 1
+            self._send(200, {
+                    'access_token': 'token-%d' % fake.logins,
+                    'expires_in': TOKEN_TTL,
+                    })
+        elif path == '/api/tags/by_resource':
+            self._send(200, [], CONTENT_TYPE % 'tag' + COLLECTION_SUFFIX)
+        else:
+            self._send(404, {'error': path})
+
+    def do_GET(self):
+        fake = self._prepare()
+        if fake is None:
+            return
+        url = urlparse.urlparse(self.path)
+        path = url.path.rstrip('/')
+        account = fake.account
+        if path == '/api/sessions':
+            self._send(200, account.session, CONTENT_TYPE % 'session')
+        elif path == '/api/health-check':
+            self._send(200, {'status': 'ok'})
+        elif path in account.resources:
+            kind, soul = account.resources[path]
+            self._send(200, soul, CONTENT_TYPE % kind)
+        elif path in account.collections:
+            query = urlparse.parse_qs(url.query)
+            names = [
+                    f[len('name=='):] for f in query.get('filter[]', [])
+                    if f.startswith('name==')
+                    ]
+            souls = []
+            for href in account.collections[path]:
+                soul = account.resources[href][1]
+                if all(n in soul['name'] for n in names):
+                    souls.append(soul)
+            kind = SINGULAR.get(path.rsplit('/', 1)[-1], 'resource')
+            self._send(
+                    200, souls, CONTENT_TYPE % kind + COLLECTION_SUFFIX)
+        else:
+            self._send(404, {'error': path})
+
+
+class ThreadingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class FakeRightScale(object):
+    """
+    The fake API, served from a background thread.
+
+    :param float latency: Seconds added to every response.
+
+    :param float jitter: Up to this many more seconds, at random.
+
+    :param float error_rate: Fraction of requests answered with a 503.
+
+    Other keyword arguments go to :class:`FakeAccount`.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0,
+                 error_rate=0, **account_kwargs):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.account = FakeAccount(**account_kwargs)
+        self.logins = 0
+        self.requests = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingServer((host, port), Handler)
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return 'http://%s:%d' % (host, port)
+
+    def count(self, method):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(
+                target=self.server.serve_forever,
+                kwargs={'poll_interval': 0.05},
+                )
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--latency', type='float', default=0)
+    parser.add_option('--jitter', type='float', default=0)
+    parser.add_option('--error-rate', type='float', default=0)
+    parser.add_option('--clouds', type='int', default=3)
+    parser.add_option('--instances', type='int', default=100,
+                      help='instances per cloud')
+    parser.add_option('--deployments', type='int', default=10)
+    parser.add_option('--servers', type='int', default=10,
+                      help='servers per deployment')
+    parser.add_option('--payload', type='int', default=0,
+                      help='bytes of filler per resource')
+    opts, _ = parser.parse_args()
+
+    fake = FakeRightScale(
+            opts.host, opts.port, opts.latency, opts.jitter, opts.error_rate,
+            clouds=opts.clouds, instances=opts.instances,
+            deployments=opts.deployments, servers=opts.servers,
+            payload=opts.payload)
+    print 'Serving a fake RightScale API on %s' % fake.url
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Memory and attribute-access benchmark for Resource vs CompactResource.
+
+Each mode lists N instance-like resources with ``index()`` (``compact=True``
+for the compact mode) against a canned response, drops every reference except
+the returned list and reports how many bytes are still reachable from it
+(including the response and raw body a plain Resource holds on to), plus the
+cost of a few common attribute accesses.
+
+Usage::
+
+    python benchmarks/resources.py [-n 100000]
+"""
+import gc
+import json
+import optparse
+import os
+import sys
+import timeit
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from rightscale.rightscale import ResourceCollection
+
+from http_fixtures import fake_response
+
+
+INSTANCE_TYPE = 'application/vnd.rightscale.instance+json;type=collection'
+INSTANCES_PATH = '/api/clouds/1/instances'
+ACCESS_LOOPS = 10000
+
+
+def fake_index_body(n):
+    rels = (
+            'cloud', 'deployment', 'server_template', 'multi_cloud_image',
+            'parent', 'volume_attachments', 'inputs', 'monitoring_metrics',
+            'alerts', 'datacenter',
+            )
+    souls = []
+    for i in range(n):
+        href = '/api/clouds/1/instances/INST%08d' % i
+        links = [{'rel': 'self', 'href': href}]
+        for rel in rels:
+            links.append({'rel': rel, 'href': '/api/%ss/%d' % (rel, i % 7)})
+        souls.append({
+            'name': 'instance %d' % i,
+            'state': 'operational',
+            'resource_uid': 'i-%08x' % i,
+            'created_at': '2014/06/01 00:00:00 +0000',
+            'updated_at': '2014/06/01 00:00:00 +0000',
+            'links': links,
+            })
+    return json.dumps(souls)
+
+
+class CannedClient(object):
+    """
+    Answers the next request with :attr:`response`, then forgets it so it
+    isn't counted as reachable from the resources.
+    """
+    def __init__(self, response):
+        self.response = response
+
+    def request(self, method, path, **kwargs):
+        response, self.response = self.response, None
+        return response
+
+
+def reachable_bytes(root):
+    """
+    Sums ``sys.getsizeof`` over every object reachable from :attr:`root`,
+    not counting classes, functions and modules.
+    """
+    skip = (type, types.ModuleType, types.FunctionType, types.ClassType)
+    seen = set()
+    todo = [root]
+    total = 0
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen or isinstance(obj, skip):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        todo.extend(gc.get_referents(obj))
+    return total
+
+
+def measure(mode, n):
+    client = CannedClient(
+            fake_response(200, fake_index_body(n), INSTANCE_TYPE))
+    instances = ResourceCollection.for_actions()(INSTANCES_PATH, client)
+    resources = instances.index(compact=(mode == 'compact'))
+    del instances
+    used = reachable_bytes(resources)
+
+    res = resources[n // 2]
+    timings = {}
+    for label, stmt in (
+            ('href', lambda: res.href),
+            ('soul', lambda: res.soul['name']),
+            ('links', lambda: res.links['alerts']),
+            ):
+        best = min(timeit.Timer(stmt).repeat(3, ACCESS_LOOPS))
+        timings[label] = best / ACCESS_LOOPS * 1e9
+    return used, timings
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', type='int', default=100000,
+                      help='number of resources to build')
+    opts, _ = parser.parse_args()
+
+    print '%d resources' % opts.n
+    print '%-10s %14s %10s %10s %10s' % (
+            'mode', 'bytes/resource', 'href ns', 'soul ns', 'links ns')
+    for mode in ('resource', 'compact'):
+        used, ns = measure(mode, opts.n)
+        print '%-10s %14.0f %10.0f %10.0f %10.0f' % (
+                mode,
+                float(used) / opts.n,
+                ns['href'],
+                ns['soul'],
+                ns['links'],
+                )
+
+
+if __name__ == '__main__':
+    main()
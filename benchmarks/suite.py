@@ -0,0 +1,230 @@
+"""
+Client benchmarks against the local fake API in ``fakeapi.py``.
+
+Runs each scenario (``index``, ``show``, ``find_by_name``, ``get_by_path``
+and ``login``) for a number of calls on a few threads and reports throughput
+and p50/p99 latency.  Results can be saved as a baseline and later runs
+compared against it; the comparison exits non-zero when a scenario got
+slower by more than the tolerance.
+
+Usage::
+
+    python benchmarks/suite.py [-n 200] [-c 4] [--latency 0.002]
+    python benchmarks/suite.py --save baseline.json
+    python benchmarks/suite.py --compare baseline.json [--tolerance 0.2]
+"""
+import json
+import optparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fakeapi import FakeRightScale
+
+from rightscale import commands
+from rightscale.rightscale import RightScale
+from rightscale.util import find_by_name
+
+
+def _index(api):
+    api.clouds.show(res_id=1).instances.index()
+
+
+def _show(api):
+    api.deployments.show(res_id=1)
+
+
+def _find_by_name(api):
+    find_by_name(api.deployments, 'deployment-3')
+
+
+def _get_by_path(api):
+    commands.get_by_path('deployments:deployment-3:servers')
+
+
+def _login(api):
+    api.client.login()
+
+
+SCENARIOS = (
+        ('index', _index),
+        ('show', _show),
+        ('find_by_name', _find_by_name),
+        ('get_by_path', _get_by_path),
+        ('login', _login),
+        )
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a sorted list.
+    """
+    if not values:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def run_scenario(api, func, calls, concurrency):
+    """
+    Makes :attr:`calls` calls to ``func(api)`` spread over
+    :attr:`concurrency` threads.
+
+    Returns a dict with ``ops`` (calls per second), ``p50`` and ``p99``
+    (milliseconds) and ``errors``.
+    """
+    latencies = []
+    errors = []
+    remaining = [calls]
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.time()
+            try:
+                func(api)
+            except Exception as e:
+                errors.append(e)
+                continue
+            latencies.append(time.time() - start)
+
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    return {
+            'ops': calls / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 50) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'errors': len(errors),
+            }
+
+
+def run_suite(fake, calls, concurrency, names=None, **client_kwargs):
+    api = RightScale(
+            refresh_token='bench',
+            api_endpoint=fake.url,
+            token_cache=None,
+            **client_kwargs
+            )
+    # get_by_path() goes through the commands module's api
+    saved_api, commands._api = commands._api, api
+    results = {}
+    try:
+        for name, func in SCENARIOS:
+            if names and name not in names:
+                continue
+            func(api)  # warm up: logs in, fills the session links
+            results[name] = run_scenario(api, func, calls, concurrency)
+    finally:
+        commands._api = saved_api
+        api.client.s.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of ``(scenario, metric, old, new)`` for every metric that
+    got worse by more than :attr:`tolerance` (a fraction).
+    """
+    regressions = []
+    for name, new in sorted(results.items()):
+        old = baseline.get(name)
+        if not old:
+            continue
+        if new['ops'] < old['ops'] * (1 - tolerance):
+            regressions.append((name, 'ops', old['ops'], new['ops']))
+        for metric in ('p50', 'p99'):
+            if new[metric] > old[metric] * (1 + tolerance):
+                regressions.append((name, metric, old[metric], new[metric]))
+    return regressions
+
+
+def report(results, baseline=None):
+    print '%-14s %10s %10s %10s %8s' % (
+            'scenario', 'ops/s', 'p50 ms', 'p99 ms', 'errors')
+    for name, _ in SCENARIOS:
+        if name not in results:
+            continue
+        r = results[name]
+        line = '%-14s %10.1f %10.2f %10.2f %8d' % (
+                name, r['ops'], r['p50'], r['p99'], r['errors'])
+        old = (baseline or {}).get(name)
+        if old and old['p50']:
+            line += '   p50 %+.0f%%' % ((r['p50'] / old['p50'] - 1) * 100)
+        print line
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--calls', type='int', default=200,
+                      help='calls per scenario')
+    parser.add_option('-c', '--concurrency', type='int', default=4)
+    parser.add_option('-s', '--scenario', action='append',
+                      help='only run this scenario (repeatable)')
+    parser.add_option('--latency', type='float', default=0.002,
+                      help='seconds the fake API adds to every response')
+    parser.add_option('--jitter', type='float', default=0)
+    parser.add_option('--error-rate', type='float', default=0)
+    parser.add_option('--instances', type='int', default=100,
+                      help='instances per cloud')
+    parser.add_option('--payload', type='int', default=0,
+                      help='bytes of filler per resource')
+    parser.add_option('--keepalive', action='store_true')
+    parser.add_option('--max-retries', type='int', default=0)
+    parser.add_option('--save', metavar='FILE',
+                      help='save the results as a baseline')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare against a saved baseline')
+    parser.add_option('--tolerance', type='float', default=0.2,
+                      help='allowed slowdown before failing --compare')
+    opts, _ = parser.parse_args()
+
+    fake = FakeRightScale(
+            latency=opts.latency,
+            jitter=opts.jitter,
+            error_rate=opts.error_rate,
+            instances=opts.instances,
+            payload=opts.payload,
+            ).start()
+    try:
+        results = run_suite(
+                fake, opts.calls, opts.concurrency, opts.scenario,
+                keepalive=opts.keepalive, max_retries=opts.max_retries)
+    finally:
+        fake.stop()
+
+    baseline = None
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if opts.save:
+        with open(opts.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print 'Saved baseline to %s' % opts.save
+
+    if baseline:
+        regressions = compare(results, baseline, opts.tolerance)
+        for name, metric, old, new in regressions:
+            print 'REGRESSION %s %s: %.2f -> %.2f' % (name, metric, old, new)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
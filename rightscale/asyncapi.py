@@ -0,0 +1,158 @@
+"""
+Non-blocking flavour of the object interface.
+
+Python 2 has no ``asyncio``, so "async" here means every generated action
+method (``index``, ``show``, ``launch``, ``multi_run_executable``, ...) is
+handed off to a shared pool of worker threads and immediately returns a
+:class:`multiprocessing.pool.AsyncResult`.  Call ``.get()`` on it (or use
+:func:`wait_all`) when you need the value.  Token refreshes happen on the
+worker threads too, so the caller never blocks on ``login()``.
+
+Sample usage::
+
+    from rightscale.asyncapi import AsyncRightScale, wait_all
+    api = AsyncRightScale()
+    pending = [api.clouds.show(res_id=i) for i in (1, 2, 3)]
+    clouds = wait_all(pending)
+"""
+from multiprocessing.pool import ThreadPool
+import threading
+
+from .httpclient import HTTPClient
+from .rightscale import (
+        CompactResource,
+        HEALTH_CHECK_RES_PATH,
+        get_resource_method,
+        Resource,
+        ResourceCollection,
+        RightScale,
+        )
+from .util import DEFAULT_CONCURRENCY, fan_out
+
+
+DEFAULT_MAX_IN_FLIGHT = 32
+
+
+def wait_all(results, timeout=None):
+    """
+    Blocks until every pending result is ready and returns their values in
+    order.  The first failure is re-raised.
+    """
+    return [r.get(timeout) for r in results]
+
+
+class AsyncHTTPClient(HTTPClient):
+    """
+    :class:`rightscale.httpclient.HTTPClient` that also owns the worker pool
+    used to run action methods.
+
+    :param int max_in_flight: Max number of requests running at once.
+    """
+    def __init__(self, *args, **kwargs):
+        self.max_in_flight = kwargs.pop('max_in_flight', DEFAULT_MAX_IN_FLIGHT)
+        super(AsyncHTTPClient, self).__init__(*args, **kwargs)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # spin up the threads on first use only
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.max_in_flight)
+        return self._pool
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Runs ``fn(*args, **kwargs)`` on the worker pool.
+
+        Returns a :class:`multiprocessing.pool.AsyncResult`.
+        """
+        return self.pool.apply_async(fn, args, kwargs)
+
+    def close(self):
+        """
+        Waits for outstanding requests and stops the worker threads.
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+class AsyncResource(Resource):
+    """
+    A :class:`rightscale.rightscale.Resource` whose collections have
+    non-blocking action methods.
+    """
+
+
+class AsyncCompactResource(CompactResource):
+    """
+    A :class:`rightscale.rightscale.CompactResource` whose collections have
+    non-blocking action methods.
+    """
+    __slots__ = ()
+
+
+class AsyncResourceCollection(ResourceCollection):
+    """
+    A :class:`rightscale.rightscale.ResourceCollection` whose action methods
+    return :class:`multiprocessing.pool.AsyncResult` objects instead of
+    resources.
+    """
+    resource_class = AsyncResource
+    compact_class = AsyncCompactResource
+
+    @classmethod
+    def _make_method(cls, name, template):
+        meth = get_resource_method(name, template)
+
+        def async_meth(self, **kwargs):
+            return self.client.submit(meth, self, **kwargs)
+
+        async_meth.__name__ = name
+        # the blocking version, for batch()
+        async_meth.sync = meth
+        return async_meth
+
+    def batch(self, action, items, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        """
+        Non-blocking :meth:`rightscale.rightscale.ResourceCollection.batch`.
+
+        Returns a single :class:`multiprocessing.pool.AsyncResult` whose value
+        is the list of :class:`rightscale.util.Outcome`, one per item.  Up to
+        :attr:`concurrency` of the actions run at once.
+        """
+        meth = getattr(self, action).sync
+
+        def run(item):
+            return meth(self, res_id=self._res_id(item), **kwargs)
+
+        return self.client.submit(fan_out, run, items, concurrency)
+
+
+AsyncResource.collection_class = AsyncResourceCollection
+AsyncCompactResource.collection_class = AsyncResourceCollection
+
+
+class AsyncRightScale(RightScale):
+    """
+    Non-blocking counterpart to :class:`rightscale.RightScale`.
+
+    Accepts the same arguments, plus ``max_in_flight`` to size the worker
+    pool.  Discovering the root links is still done synchronously the first
+    time an attribute is accessed.
+    """
+    client_class = AsyncHTTPClient
+    collection_class = AsyncResourceCollection
+
+    def health_check(self):
+        return self.client.submit(
+                lambda: self.client.get(HEALTH_CHECK_RES_PATH).json()
+                )
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,159 @@
+"""
+Bulk export of audit entries.
+
+RightScale only lists audit entries for a given date range and caps the
+number returned per request, so pulling a long stretch of history means
+slicing it into many small windows.  :func:`export_audit_entries` does the
+slicing, fetches windows in parallel and hands entries back in time order.
+"""
+from datetime import timedelta
+import logging
+
+from .util import DEFAULT_CONCURRENCY, fan_out, iter_fan_out
+
+
+log = logging.getLogger(__name__)
+
+AUDIT_DATE_FORMAT = '%Y/%m/%d %H:%M:%S +0000'
+
+# the most audit entries RightScale returns for one index call
+MAX_LIMIT = 1000
+
+DEFAULT_WINDOW = timedelta(hours=6)
+
+# windows are never split below this size, even if they are still full
+MIN_WINDOW = timedelta(seconds=1)
+
+
+def format_audit_date(dt):
+    """
+    Formats a (UTC) datetime the way the audit_entries API expects it.
+    """
+    return dt.strftime(AUDIT_DATE_FORMAT)
+
+
+def split_windows(start, end, window=DEFAULT_WINDOW):
+    """
+    Splits ``[start, end)`` into consecutive ``(lo, hi)`` windows no larger
+    than :attr:`window`.
+    """
+    windows = []
+    lo = start
+    while lo < end:
+        hi = min(lo + window, end)
+        windows.append((lo, hi))
+        lo = hi
+    return windows
+
+
+def _fetch_window(collection, lo, hi, limit, params):
+    query = dict(params or {})
+    query.update({
+        'start_date': format_audit_date(lo),
+        'end_date': format_audit_date(hi),
+        'limit': limit,
+        })
+    entries = collection.index(params=query)
+    if len(entries) < limit or hi - lo <= MIN_WINDOW:
+        if len(entries) >= limit:
+            log.warning(
+                    'Audit window %s - %s is still full at %d entries; '
+                    'some entries may be missing.', lo, hi, len(entries))
+        return list(entries)
+
+    # hit the server-side cap, so there's probably more.  halve and retry.
+    mid = lo + (hi - lo) / 2
+    log.debug('Splitting full audit window %s - %s at %s', lo, hi, mid)
+    return (
+            _fetch_window(collection, lo, mid, limit, params)
+            + _fetch_window(collection, mid, hi, limit, params)
+            )
+
+
+def _fetch_detail(client, entry):
+    try:
+        return client.get(entry.href + '/detail').text
+    except Exception as e:
+        log.warning('Could not fetch detail for %s: %s', entry.href, e)
+
+
+def export_audit_entries(
+        api,
+        start,
+        end,
+        window=DEFAULT_WINDOW,
+        limit=MAX_LIMIT,
+        concurrency=DEFAULT_CONCURRENCY,
+        detail=False,
+        params=None,
+        ):
+    """
+    Yields every audit entry between :attr:`start` and :attr:`end`, oldest
+    first.
+
+    Sample usage::
+
+        from datetime import datetime, timedelta
+        end = datetime.utcnow()
+        start = end - timedelta(days=30)
+        for entry in export_audit_entries(api, start, end):
+            print entry.soul['updated_at'], entry.soul['summary']
+
+    :param rightscale.RightScale api: The API object to export from.
+
+    :param datetime start: Start of the range, in UTC.
+
+    :param datetime end: End of the range, in UTC.
+
+    :param timedelta window: Initial size of the slices the range is cut
+        into.  Slices that come back with :attr:`limit` entries are halved
+        until they fit.
+
+    :param int limit: Max entries per request.
+
+    :param int concurrency: Max number of windows (or details) fetched at
+        once.
+
+    :param bool detail: Also fetch each entry's ``detail`` text and store it
+        under ``entry.soul['detail']``.
+
+    :param dict params: Extra query params for every ``index`` call, e.g.
+        ``{'filter[]': ['user_email==ops@example.com']}``.
+
+    Entries showing up on both sides of a window boundary are only yielded
+    once.
+    """
+    collection = api.audit_entries
+
+    def fetch(win):
+        return _fetch_window(collection, win[0], win[1], limit, params)
+
+    seen = set()
+    windows = split_windows(start, end, window)
+    for outcome in iter_fan_out(fetch, windows, concurrency):
+        entries = sorted(
+                outcome.get(),
+                key=lambda e: e.soul.get('updated_at', ''),
+                )
+        fresh = []
+        hrefs = set()
+        for entry in entries:
+            key = entry.href or id(entry)
+            if key in seen or key in hrefs:
+                continue
+            hrefs.add(key)
+            fresh.append(entry)
+        # dupes only happen across adjacent windows
+        seen = hrefs
+
+        if detail and fresh:
+            details = fan_out(
+                    lambda e: _fetch_detail(api.client, e),
+                    fresh,
+                    concurrency,
+                    )
+            for entry, d in zip(fresh, details):
+                entry.soul['detail'] = d.result
+
+        for entry in fresh:
+            yield entry
@@ -0,0 +1,285 @@
+"""
+Client-side caching of GET responses.
+
+Plug a :class:`ResponseCache` into :class:`rightscale.httpclient.HTTPClient`
+to avoid re-fetching the same ``index`` and ``show`` results over and over::
+
+    from rightscale.cache import ResponseCache
+    cache = ResponseCache(ttl=30, ttls={'clouds': 3600})
+    api = RightScale(cache=cache)
+
+Any POST, PUT or DELETE sent through the client drops the cached entries for
+the top-level collection it touched.
+
+:class:`SingleFlight` deduplicates identical GETs that are in flight at the
+same time; see the ``coalesce`` option of the client.
+"""
+from collections import OrderedDict
+import sys
+import threading
+import time
+import urlparse
+
+
+# same as rightscale.rightscale.DEFAULT_API_PREPATH.  not imported from there
+# so the http client can use this module without an import cycle.
+API_PREPATH = '/api'
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 30
+
+
+def _split_path(path):
+    segs = [s for s in path.split('/') if s]
+    if segs and segs[0] == API_PREPATH.strip('/'):
+        segs = segs[1:]
+    return segs
+
+
+def collection_name(path):
+    """
+    Guesses the name of the collection a resource path belongs to.
+
+    RightScale paths alternate between collection names and resource ids, so
+    this is the deepest segment in a "collection" position.  E.g. both
+    ``/api/clouds/1/instances`` and ``/api/clouds/1/instances/ABC`` give
+    ``instances``.
+    """
+    segs = _split_path(path)
+    if not segs:
+        return ''
+    return segs[(len(segs) - 1) // 2 * 2]
+
+
+def root_collection_path(path):
+    """
+    Returns the path of the top-level collection containing :attr:`path`.
+    E.g. ``/api/clouds`` for ``/api/clouds/1/instances/ABC/launch``.
+    """
+    segs = _split_path(path)
+    if not segs:
+        return API_PREPATH
+    return '/'.join((API_PREPATH, segs[0]))
+
+
+def _freeze(params):
+    if not params:
+        return ()
+    if isinstance(params, dict):
+        params = params.items()
+    if isinstance(params, basestring):
+        return params
+    frozen = []
+    for k, v in params:
+        if isinstance(v, (list, tuple)):
+            v = tuple(v)
+        frozen.append((k, v))
+    return tuple(sorted(frozen))
+
+
+def request_key(method, url, params=None):
+    """
+    Builds a hashable key for a request from its method, path (and query
+    string) and params.
+    """
+    parts = urlparse.urlsplit(url)
+    path = parts.path
+    if parts.query:
+        path += '?' + parts.query
+    return (method.lower(), path, _freeze(params))
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping that forgets the least recently used entries once it
+    holds more than :attr:`max_entries`.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def keys(self):
+        with self._lock:
+            return self._data.keys()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ResponseCache(object):
+    """
+    TTL + LRU cache for successful GET responses.
+
+    :param int max_entries: Max number of responses to hold.
+
+    :param float ttl: Default number of seconds a response stays fresh.
+
+    :param dict ttls: Per-collection overrides of :attr:`ttl`, keyed by
+        collection name (e.g. ``{'clouds': 3600, 'instances': 5}``).  See
+        :func:`collection_name`.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 ttls=None):
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self._entries = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(
+                ('hits', 'misses', 'expirations', 'invalidations'),
+                0,
+                )
+
+    def _incr(self, field, n=1):
+        with self._lock:
+            self._counts[field] += n
+
+    def stats(self):
+        """
+        Returns a dict of hit, miss, eviction, expiration and invalidation
+        counts, plus the current number of entries.
+        """
+        with self._lock:
+            stats = dict(self._counts)
+        stats['evictions'] = self._entries.evictions
+        stats['size'] = len(self._entries)
+        return stats
+
+    def key(self, method, url, params=None):
+        return request_key(method, url, params)
+
+    def get(self, key):
+        """
+        Returns the cached response for :attr:`key`, or ``None``.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self._incr('misses')
+            return None
+        expires_at, response = entry
+        if time.time() > expires_at:
+            self._entries.pop(key)
+            self._incr('expirations')
+            self._incr('misses')
+            return None
+        self._incr('hits')
+        return response
+
+    def set(self, key, response):
+        path = key[1].split('?', 1)[0]
+        ttl = self.ttls.get(collection_name(path), self.ttl)
+        if ttl <= 0:
+            return
+        self._entries.set(key, (time.time() + ttl, response))
+
+    def invalidate(self, url):
+        """
+        Drops every cached entry under the top-level collection of
+        :attr:`url`.
+        """
+        root = root_collection_path(urlparse.urlsplit(url).path)
+        prefix = root + '/'
+        dropped = 0
+        for key in self._entries.keys():
+            path = key[1].split('?', 1)[0]
+            if path == root or path.startswith(prefix):
+                if self._entries.pop(key) is not None:
+                    dropped += 1
+        if dropped:
+            self._incr('invalidations', dropped)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class _Flight(object):
+    __slots__ = ('done', 'result', 'exc_info')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Runs a function at most once at a time per key.
+
+    The first caller for a key (the leader) runs the function.  Callers with
+    the same key that arrive while it runs wait for it and get the very same
+    result, or the same exception, instead of running the function again.
+    Nothing is remembered once the leader is done.
+    """
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """
+        Returns how many calls ran the function (``leaders``) and how many
+        shared another call's outcome (``followers``).
+        """
+        with self._lock:
+            return {'leaders': self.leaders, 'followers': self.followers}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Returns ``fn(*args, **kwargs)``, or the outcome of the call with the
+        same :attr:`key` already in flight.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            # py2 Event.wait() without a timeout can't be interrupted
+            while not flight.done.wait(1e9):
+                pass
+            if flight.exc_info:
+                exc_type, exc, tb = flight.exc_info
+                raise exc_type, exc, tb
+            return flight.result
+
+        try:
+            flight.result = fn(*args, **kwargs)
+        except Exception:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
@@ -1,19 +1,44 @@
 import sys
-import time
+import threading
+import weakref
+from .paths import is_glob, PathResolver, PATH_SEPARATOR
 from .rightscale import RightScale as _RS
-from .util import find_by_name
+from .tasks import (
+        format_summaries,
+        summarize,
+        TaskSummary,
+        TaskTimeout,
+        TaskWatcher,
+        )
+from .util import (
+        DEFAULT_CONCURRENCY,
+        fan_out,
+        find_by_name,
+        HookList,
+        iter_fan_out,
+        Outcome,
+        )
 
 
 __all__ = [
     'get_api',
+    'get_task_watcher',
     'get_accounts',
     'list_instances',
+    'iter_instances',
     'run_script_on_server',
+    'run_script_on_fleet',
     'get_by_path',
+    'get_by_paths',
     ]
 
 
 _api = None
+_watcher = None
+
+# client -> PathResolver shared by get_by_paths() calls with a ttl
+_resolvers = weakref.WeakKeyDictionary()
+_resolvers_lock = threading.Lock()
 
 
 def get_api():
@@ -23,6 +48,17 @@ def get_api():
     return _api
 
 
+def get_task_watcher():
+    """
+    Returns the :class:`rightscale.tasks.TaskWatcher` shared by the commands
+    in this module.
+    """
+    global _watcher
+    if not _watcher:
+        _watcher = TaskWatcher(get_api().client)
+    return _watcher
+
+
 def get_accounts():
     """
     Returns the RightScale accounts for the given login creds.
@@ -31,10 +67,19 @@ def get_accounts():
     return api.sessions.accounts()
 
 
+def _instance_params(api, deployment_name, view):
+    filters = ['state==operational']
+    if deployment_name:
+        deploy = find_by_name(api.deployments, deployment_name)
+        filters.append('deployment_href==' + deploy.href)
+    return {'filter[]': filters, 'view': view}
+
+
 def list_instances(
         deployment_name='',
         cloud_name='EC2 us-east-1',
         view='tiny',
+        concurrency=DEFAULT_CONCURRENCY,
         ):
     """
     Returns a list of instances from your account.
@@ -43,23 +88,89 @@ def list_instances(
         specified deployment.
 
     :param str cloud_name: The friendly name for a RightScale-supported cloud.
-        E.g. ``EC2 us-east-1``, ``us-west-2``, etc...
+        E.g. ``EC2 us-east-1``, ``us-west-2``, etc...  Pass a list of names
+        to list several clouds at once, or ``None`` for every cloud.
 
     :param str view: The level of detail to request of RightScale.  Valid
         values are ``default``, ``extended``, ``full``, ``full_inputs_2_0``,
         ``tiny``.  Defaults to ``tiny``.
 
+    :param int concurrency: Max number of clouds queried at once when
+        listing more than one cloud.
+
+    When listing more than one cloud, clouds are queried concurrently and a
+    cloud that fails doesn't stop the others.  The returned list then has a
+    ``clouds`` attribute with the :class:`rightscale.util.Outcome` of each
+    cloud (see :func:`iter_instances`).
     """
+    if cloud_name is None or not isinstance(cloud_name, basestring):
+        outcomes = list(iter_instances(
+                deployment_name, cloud_name, view, concurrency))
+        instances = []
+        for outcome in outcomes:
+            if outcome.ok:
+                instances.extend(outcome.result)
+        return HookList(instances, clouds=outcomes)
+
     api = get_api()
     cloud = find_by_name(api.clouds, cloud_name)
-    filters = ['state==operational']
-    if deployment_name:
-        deploy = find_by_name(api.deployments, deployment_name)
-        filters.append('deployment_href==' + deploy.href)
-    params = {'filter[]': filters, 'view': view}
+    params = _instance_params(api, deployment_name, view)
     return cloud.instances.index(params=params)
 
 
+def iter_instances(
+        deployment_name='',
+        cloud_names=None,
+        view='tiny',
+        concurrency=DEFAULT_CONCURRENCY,
+        ):
+    """
+    Lists instances in many clouds concurrently, yielding each cloud's
+    instances as soon as they arrive.
+
+    Sample usage::
+
+        for outcome in iter_instances(view='full'):
+            cloud = outcome.item.soul['name']
+            if outcome.ok:
+                print cloud, len(outcome.result), outcome.elapsed
+            else:
+                print cloud, 'failed:', outcome.error
+
+    Takes the same arguments as :func:`list_instances`, except that
+    :attr:`cloud_names` is a list of cloud names, or ``None`` for every
+    cloud.
+
+    Yields a :class:`rightscale.util.Outcome` per cloud, in the order they
+    finish.  Its :attr:`item` is the cloud, its :attr:`result` the list of
+    instances and :attr:`elapsed` how long the listing took.
+    """
+    api = get_api()
+    clouds = api.clouds.index()
+    if cloud_names is not None:
+        wanted = set(cloud_names)
+        clouds = [c for c in clouds if c.soul.get('name') in wanted]
+        missing = wanted - set(c.soul.get('name') for c in clouds)
+        if missing:
+            raise ValueError('No such clouds: %s' % ', '.join(sorted(missing)))
+    params = _instance_params(api, deployment_name, view)
+
+    def list_cloud(cloud):
+        return cloud.instances.index(params=params)
+
+    return iter_fan_out(list_cloud, clouds, concurrency, ordered=False)
+
+
+def _executable_data(script, inputs):
+    data = {
+            'right_script_href': script.href,
+            }
+    if inputs:
+        for k, v in inputs.items():
+            data['inputs[%s]' % k] = 'text:' + v
+    return data
+
+
 def run_script_on_server(
         script_name,
         server_name,
@@ -89,28 +200,220 @@ def run_script_on_server(
 
     Defaults to printing status message to stdout, but will accept any object
     that implements ``write()`` passed in to :attr:`output`.
+
+    A failed status poll is retried; the error is raised once
+    :data:`rightscale.tasks.DEFAULT_MAX_FAILURES` polls in a row have failed.
     """
     api = get_api()
     script = find_by_name(api.right_scripts, script_name)
     server = find_by_name(api.servers, server_name)
     path = server.links['current_instance'] + '/run_executable'
 
-    data = {
-            'right_script_href': script.href,
-            }
-    if inputs:
-        for k, v in inputs.items():
-            data['inputs[%s]' % k] = 'text:' + v
+    data = _executable_data(script, inputs)
     response = api.client.post(path, data=data)
     status_path = response.headers['location']
-    for i in range(timeout_s):
-        status = api.client.get(status_path).json()
-        summary = status.get('summary', '')
-        output.write('status: %s\n' % summary)
-        if summary.startswith('completed'):
-            return
-        time.sleep(1)
-    output.write('Done waiting. Poll %s for status.\n' % status_path)
+    if timeout_s <= 0:
+        output.write('Done waiting. Poll %s for status.\n' % status_path)
+        return
+
+    def on_status(location, status):
+        output.write('status: %s\n' % status.get('summary', ''))
+
+    task = get_task_watcher().watch(
+            status_path,
+            timeout=timeout_s,
+            on_status=on_status,
+            )
+    try:
+        task.result()
+    except TaskTimeout:
+        output.write('Done waiting. Poll %s for status.\n' % status_path)
+
+
+def _cloud_of(instance_href):
+    return instance_href.split('/instances/', 1)[0]
+
+
+def _fleet_targets(api, deployment_name, server_array_name, tags,
+                   cloud_name, filters, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Works out where to send ``multi_run_executable`` calls.
+
+    Returns ``(calls, singles, names)``: a list of ``(path, filters)`` for
+    multi_run_executable, a list of instance hrefs that need a
+    ``run_executable`` each, and a dict of instance href -> name of every
+    instance targeted.
+
+    Raises :class:`ValueError` if the target has no instances to run on.
+    """
+    cloud = find_by_name(api.clouds, cloud_name) if cloud_name else None
+    params = {'filter[]': list(filters)} if filters else {}
+    calls = []
+    singles = []
+    names = {}
+    if deployment_name:
+        deploy = find_by_name(api.deployments, deployment_name)
+
+        def add(href, name):
+            if not cloud or _cloud_of(href) == cloud.href:
+                names[href] = name
+
+        for server in deploy.servers.index():
+            href = server.links.get('current_instance')
+            if href:
+                add(href, server.soul.get('name'))
+        # instances of server arrays don't show up as servers
+        arrays = fan_out(
+                lambda array: array.current_instances.index(),
+                deploy.server_arrays.index(),
+                concurrency,
+                )
+        for outcome in arrays:
+            for instance in outcome.get():
+                add(instance.href, instance.soul.get('name'))
+        what = 'deployment %s' % deployment_name
+        # one call per cloud the deployment has running instances in
+        for cloud_href in sorted(set(_cloud_of(h) for h in names)):
+            calls.append((
+                    cloud_href + '/instances/multi_run_executable',
+                    ['deployment_href==' + deploy.href] + list(filters or []),
+                    ))
+    elif server_array_name:
+        array = find_by_name(api.server_arrays, server_array_name)
+        for instance in array.current_instances.index(params=params):
+            names[instance.href] = instance.soul.get('name')
+        what = 'server array %s' % server_array_name
+        calls.append((array.href + '/multi_run_executable', filters))
+    elif tags:
+        # there's no instance filter for tags, so each one gets its own call
+        data = {'resource_type': 'instances', 'tags[]': list(tags)}
+        hrefs = []
+        for tagged in api.tags.by_tag(data=data) or []:
+            for link in tagged.soul.get('links', []):
+                if link.get('rel') != 'resource':
+                    continue
+                if cloud and _cloud_of(link['href']) != cloud.href:
+                    continue
+                hrefs.append(link['href'])
+        # tags only link to their instances, so their names need a show each
+        shows = fan_out(
+                lambda href: api.client.get(href).json(),
+                hrefs,
+                concurrency,
+                )
+        for outcome in shows:
+            name = outcome.result.get('name') if outcome.ok else None
+            names[outcome.item] = name
+            singles.append(outcome.item)
+        what = 'tags %s' % ', '.join(tags)
+    elif filters and cloud:
+        for instance in cloud.instances.index(params=params):
+            names[instance.href] = instance.soul.get('name')
+        what = 'filters %s in cloud %s' % (', '.join(filters), cloud_name)
+        calls.append((cloud.href + '/instances/multi_run_executable', filters))
+    else:
+        raise ValueError(
+                'Need a deployment, server array, tags, '
+                'or a cloud and filters')
+    if not names:
+        raise ValueError('No running instances for %s' % what)
+    return calls, singles, names
+
+
+def run_script_on_fleet(
+        script_name,
+        deployment_name=None,
+        server_array_name=None,
+        tags=None,
+        cloud_name=None,
+        filters=None,
+        inputs=None,
+        timeout_s=600,
+        concurrency=DEFAULT_CONCURRENCY,
+        output=None,
+        ):
+    """
+    Runs a RightScript on many instances at once and waits for all of them.
+
+    Sample usage::
+
+        from rightscale import run_script_on_fleet
+        rows = run_script_on_fleet(
+                'push config',
+                deployment_name='production',
+                inputs={'VERSION': '42'},
+                output=sys.stdout,
+                )
+        failed = [r for r in rows if r.state != 'completed']
+
+    Pick the instances with one of :attr:`deployment_name`,
+    :attr:`server_array_name` or :attr:`tags`, or with :attr:`filters` (e.g.
+    ``['name==web-*']``) on the instances of :attr:`cloud_name`.  A
+    :attr:`cloud_name` also narrows down deployments and tags, and
+    :attr:`filters` are applied to deployments and server arrays too.
+
+    Deployments, server arrays and filters are dispatched with one
+    ``multi_run_executable`` call per cloud.  Tags are the exception:
+    ``multi_run_executable`` selects instances with ``filter[]`` and there
+    is no filter for tags, so each tagged instance gets a ``run_executable``
+    of its own.  Up to :attr:`concurrency` of these are sent at once.  The
+    resulting tasks are all tracked by the shared
+    :class:`rightscale.tasks.TaskWatcher`.
+
+    The targeted instances are listed before anything is dispatched, which
+    gives every row its instance name.  A deployment's instances include
+    those of its server arrays.
+
+    :param int timeout_s: How long to wait for the tasks to finish.
+
+    :param output: If given, a summary table is written to it at the end.
+
+    Returns a list of :class:`rightscale.tasks.TaskSummary`, one per task.
+    Failed dispatches show up with state ``error``.  Raises
+    :class:`ValueError` if the target has no running instances.
+    """
+    api = get_api()
+    script = find_by_name(api.right_scripts, script_name)
+    calls, singles, names = _fleet_targets(
+            api, deployment_name, server_array_name, tags, cloud_name,
+            filters, concurrency)
+
+    data = _executable_data(script, inputs)
+
+    def dispatch(call):
+        path, call_filters = call
+        call_data = dict(data)
+        if call_filters:
+            call_data['filter[]'] = list(call_filters)
+        response = api.client.post(path, data=call_data)
+        # several tasks come back as a comma-separated list
+        location = response.headers.get('location') or ''
+        return [loc.strip() for loc in location.split(',') if loc.strip()]
+
+    calls += [(href + '/run_executable', None) for href in singles]
+    watcher = get_task_watcher()
+    futures = []
+    rows = []
+    for outcome in fan_out(dispatch, calls, concurrency):
+        if not outcome.ok:
+            path = outcome.item[0]
+            rows.append(TaskSummary(
+                    None, None, path, 'error', str(outcome.error)))
+            continue
+        for location in outcome.result:
+            futures.append(watcher.watch(location, timeout=timeout_s))
+
+    for future in futures:
+        try:
+            future.result()
+        except Exception:
+            pass
+        row = summarize(future)
+        rows.append(row._replace(name=names.get(row.instance)))
+
+    if output:
+        output.write(format_summaries(rows))
+    return rows
 
 
 def get_by_path(path, first=False):
@@ -142,3 +445,76 @@ def get_by_path(path, first=False):
     if index:
         return index()
     return cur_res
+
+
+def _index_or_self(res):
+    index = getattr(res, 'index', None)
+    if index:
+        return index()
+    return res
+
+
+def get_by_paths(paths, ttl=None):
+    """
+    Like :func:`get_by_path`, for many paths at once.
+
+    E.g.::
+
+        found = get_by_paths([
+            'deployments:production:servers:haproxy',
+            'deployments:production:servers:app',
+            'deployments:staging-*:servers',
+            ])
+        haproxies = found['deployments:production:servers:haproxy'].get()
+
+    Shared prefixes (``deployments:production:servers`` above) are only
+    resolved once, and independent lookups run concurrently.  Parts of a path
+    may be shell-style globs, which match every resource with a matching name.
+
+    :param float ttl: Remember resolved path prefixes across calls for this
+        many seconds.  By default nothing is remembered between calls.
+
+    Returns a dict mapping each path to a :class:`rightscale.util.Outcome`.
+    Its result is what :func:`get_by_path` would return, or a list of those
+    for paths with globs.
+    """
+    api = get_api()
+    if ttl is None:
+        resolver = PathResolver(api)
+    else:
+        with _resolvers_lock:
+            resolver = _resolvers.get(api.client)
+            if resolver is None:
+                resolver = _resolvers[api.client] = PathResolver(api)
+
+    targets = []
+    # the ttl goes with the call; the shared resolver is never changed
+    resolved = resolver.resolve_many(paths, ttl)
+    for path, outcome in resolved.items():
+        if outcome.ok:
+            targets.extend((path, node) for node in outcome.result)
+
+    # the final index() calls of every path share one pool
+    by_path = {}
+    for value in fan_out(
+            lambda target: _index_or_self(target[1]),
+            targets,
+            resolver.concurrency,
+            ):
+        by_path.setdefault(value.item[0], []).append(value)
+
+    found = {}
+    for path, outcome in resolved.items():
+        values = by_path.get(path, [])
+        errors = [o for o in values if not o.ok]
+        if not outcome.ok:
+            found[path] = Outcome(path, exc_info=outcome.exc_info)
+        elif errors:
+            found[path] = Outcome(path, exc_info=errors[0].exc_info)
+        elif any(is_glob(p) for p in path.split(PATH_SEPARATOR)):
+            found[path] = Outcome(path, [o.result for o in values])
+        elif values:
+            found[path] = Outcome(path, values[0].result)
+        else:
+            found[path] = Outcome(path, None)
+    return found
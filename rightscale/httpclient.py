@@ -1,12 +1,47 @@
 from functools import partial
 import logging
+import random
+import threading
 import time
 import requests
 
+from .cache import DEFAULT_MAX_ENTRIES, LRUCache, request_key, SingleFlight
+from .pool import DEFAULT_POOL_SIZE, PoolingAdapter
+from .ratelimit import parse_retry_after
+from .transport import RecordingAdapter
+
 
 log = logging.getLogger(__name__)
 DEFAULT_ROOT_RES_PATH = '/'
 
+_UNPARSED = object()
+
+# treat tokens as expired this many seconds before RightScale says they are
+TOKEN_EXPIRY_SLACK = 60
+
+# by default, the background renewer logs in again this many seconds before
+# the token is due to be refreshed on the request path.
+DEFAULT_RENEW_MARGIN = 60
+
+# seconds to wait before retrying a failed background renewal
+RENEW_RETRY_DELAY = 5
+
+# the background renewer never logs in more often than this, even when tokens
+# expire within the renew margin
+MIN_RENEW_INTERVAL = 5
+
+# responses that mean "slow down and try again"
+RETRY_STATUS_CODES = (429, 503)
+
+# only these are retried, since RightScale may have acted on anything else
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30
+
+# GETs passing any other request options are never coalesced
+COALESCED_KWARGS = frozenset(['params'])
+
 
 class HTTPResponse(object):
     """
@@ -14,18 +49,71 @@ class HTTPResponse(object):
 
     Parses ``Content-Type`` header and makes it available as a list of fields
     in the :attr:`content_type` member.
+
+    The JSON body is only parsed once; every call to :meth:`json` returns the
+    same object.  Responses handed out more than once (from the response
+    cache, a 304 or a coalesced GET) are handed out as a :meth:`copy`, so
+    changes one caller makes to the parsed body don't show up for the others.
     """
     def __init__(self, raw_response):
         self.raw_response = raw_response
+        self._json = _UNPARSED
 
         content_type = raw_response.headers.get('content-type', '')
         ct_fields = [f.strip() for f in content_type.split(';')]
         self.content_type = ct_fields
 
+    def json(self, **kwargs):
+        if kwargs:
+            return self.raw_response.json(**kwargs)
+        if self._json is _UNPARSED:
+            self._json = self.raw_response.json()
+        return self._json
+
+    def copy(self):
+        """
+        Returns a new wrapper around the same raw response, with a body of its
+        own that is parsed afresh on first use.
+        """
+        return HTTPResponse(self.raw_response)
+
     def __getattr__(self, name):
         return getattr(self.raw_response, name)
 
 
+class RequestEvent(object):
+    """
+    What request hooks get to see of one HTTP request (one attempt, when
+    retrying).
+
+    Pre-request hooks may change :attr:`kwargs`, which are passed on to
+    :meth:`requests.Session.request`.  Post-request hooks also get
+    :attr:`elapsed` and either :attr:`response` or :attr:`error`.
+    """
+    def __init__(self, method, url, attempt, kwargs):
+        self.method = method
+        self.url = url
+        self.attempt = attempt
+        self.kwargs = kwargs
+        self.login = False
+        self.started = None
+        self.elapsed = None
+        self.response = None
+        self.error = None
+
+    @property
+    def retry(self):
+        return self.attempt > 0
+
+
+def _run_hooks(hooks, event):
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception:
+            log.exception('Request hook %r failed', hook)
+
+
 class HTTPClient(object):
 
     """
@@ -36,6 +124,77 @@ class HTTPClient(object):
     :param dict extra_headers: When specified, these key-value pairs are added
         to the default HTTP headers passed in with each request.
 
+    :param bool keepalive: Reuse connections from a pool instead of closing
+        them after every request.  Defaults to ``False``.
+
+    :param int pool_size: Max number of pooled connections per host when
+        :attr:`keepalive` is on.
+
+    :param float pool_max_age: When :attr:`keepalive` is on, pooled
+        connections left idle for more than this many seconds are re-opened
+        rather than reused.  ``None`` means connections live until the server
+        drops them.
+
+    :param rightscale.cache.ResponseCache cache: When specified, successful
+        GET responses are served from and stored in this cache, and other
+        requests invalidate the affected entries.
+
+    :param bool conditional: Remember the ``ETag`` and ``Last-Modified``
+        validators of GET responses and send follow-up GETs for the same URL
+        as conditional requests.  A ``304 Not Modified`` reply returns the
+        previous response (and its already-parsed body) instead.
+
+    :param int max_validators: Max number of URLs to remember validators for
+        when :attr:`conditional` is on.
+
+    :param bool auto_renew: Start a background thread that renews the OAuth
+        token :attr:`renew_margin` seconds before it expires, so requests
+        never have to wait for a login.  See :meth:`start_renewer`.
+
+    :param float renew_margin: How early the background renewer logs in.
+
+    :param rightscale.tokencache.TokenCache token_cache: When specified,
+        access tokens are shared through this on-disk cache so that other
+        clients and processes with the same credentials can skip logging in.
+
+    :param rightscale.ratelimit.RateLimiter rate_limiter: When specified,
+        every request waits for this limiter first, and its rate is adjusted
+        based on how often RightScale throttles us.  Share one limiter between
+        clients to stay under a common limit.
+
+    :param int max_retries: How many times to retry an idempotent request
+        that got a 429 or 503, with jittered exponential backoff.  A
+        ``Retry-After`` header sets the minimum wait.
+
+    :param float backoff_base: Upper bound of the first backoff, in seconds.
+        It doubles with every retry up to :attr:`backoff_max`.
+
+    :param requests.adapters.BaseAdapter transport: Adapter to send every
+        request through, e.g. a :class:`rightscale.transport.RecordingAdapter`
+        or :class:`rightscale.transport.ReplayAdapter`.  A recording adapter
+        without an adapter of its own records through the one the client
+        would have used otherwise.
+
+    :param rightscale.metrics.Metrics metrics: When specified, every request
+        is recorded in it.  See :meth:`rightscale.metrics.Metrics.attach`.
+
+    :param bool coalesce: Deduplicate identical GETs in flight at the same
+        time: while one thread waits for a response, other threads asking for
+        the same URL and params wait for that same response instead of
+        sending their own request.  Each gets its own
+        :meth:`HTTPResponse.copy` of the one response.  GETs with
+        options other than ``params`` (e.g. extra headers, ``stream``) always
+        go out on their own.  This works the same for
+        :class:`rightscale.asyncapi.AsyncRightScale`, whose action methods
+        run on worker threads.  See :attr:`flights` for counts.
+
+    Functions in :attr:`pre_request_hooks` and :attr:`post_request_hooks` are
+    called with a :class:`RequestEvent` before and after every HTTP request,
+    retries and logins included.  With no hooks, requests go straight out.
+
+    Logins are single-flight: when many threads find the token expired at the
+    same time, only one of them calls :meth:`login` and the rest wait for it.
+
     """
 
     def __init__(
@@ -44,15 +203,48 @@ class HTTPClient(object):
             extra_headers=None,
             oauth_path=None,
             refresh_token=None,
+            keepalive=False,
+            pool_size=DEFAULT_POOL_SIZE,
+            pool_max_age=None,
+            cache=None,
+            conditional=False,
+            max_validators=DEFAULT_MAX_ENTRIES,
+            auto_renew=False,
+            renew_margin=DEFAULT_RENEW_MARGIN,
+            token_cache=None,
+            rate_limiter=None,
+            max_retries=0,
+            backoff_base=DEFAULT_BACKOFF_BASE,
+            backoff_max=DEFAULT_BACKOFF_MAX,
+            transport=None,
+            metrics=None,
+            coalesce=False,
             ):
         self.endpoint = endpoint
 
         s = requests.session()
-
-        # Disable keepalives. They're unsafe in threaded apps that potentially
-        # re-use very old connection objects from the urllib3 connection pool.
         s.headers['Accept'] = 'application/json'
-        s.headers['Connection'] = 'close'
+
+        self.pool_stats = None
+        adapter = None
+        if keepalive:
+            # Pooled connections get aged out so threaded apps don't end up
+            # re-using very old connection objects.
+            adapter = PoolingAdapter(pool_size, pool_max_age)
+            self.pool_stats = adapter.stats
+        if transport is not None:
+            if isinstance(transport, RecordingAdapter) and (
+                    transport.adapter is None):
+                transport.adapter = adapter
+            adapter = transport
+        if adapter is not None:
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+        if not keepalive:
+            # Disable keepalives. They're unsafe in threaded apps that
+            # potentially re-use very old connection objects from the urllib3
+            # connection pool.
+            s.headers['Connection'] = 'close'
         if extra_headers:
             s.headers.update(extra_headers)
         self.s = s
@@ -64,15 +256,110 @@ class HTTPClient(object):
         self.post = partial(self.request, 'post')
         self.put = partial(self.request, 'put')
 
+        self.pre_request_hooks = []
+        self.post_request_hooks = []
+        if metrics is not None:
+            metrics.attach(self)
+
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.cache = cache
+        self.flights = SingleFlight() if coalesce else None
+        self.validators = LRUCache(max_validators) if conditional else None
+
         # keep track of when our auth token expires
         self.oauth_path = oauth_path
         self.refresh_token = refresh_token
+        self.token_cache = token_cache
         self.auth_expires_at = None
-
-    def login(self):
+        self._login_lock = threading.Lock()
+        self._renewer = None
+        self._stop_renewer = threading.Event()
+        if auto_renew:
+            self.start_renewer(renew_margin)
+
+    def _token_expired(self, margin=0):
+        expires_at = self.auth_expires_at
+        return expires_at is None or time.time() + margin > expires_at
+
+    def _ensure_login(self, margin=0):
+        with self._login_lock:
+            # whoever held the lock before us may have just logged in
+            if self._token_expired(margin):
+                self.login(margin)
+
+    def start_renewer(self, margin=DEFAULT_RENEW_MARGIN):
+        """
+        Starts a daemon thread that keeps the OAuth token fresh by logging in
+        :attr:`margin` seconds before it would otherwise expire, but no more
+        often than every :data:`MIN_RENEW_INTERVAL` seconds.
+        """
+        if self._renewer is not None and self._renewer.is_alive():
+            return
+        self._stop_renewer.clear()
+        t = threading.Thread(target=self._renew_forever, args=(margin,))
+        t.daemon = True
+        t.start()
+        self._renewer = t
+
+    def stop_renewer(self):
+        """
+        Stops the background renewer started by :meth:`start_renewer`.
+        """
+        self._stop_renewer.set()
+        renewer, self._renewer = self._renewer, None
+        if renewer is not None:
+            renewer.join()
+
+    def _renew_forever(self, margin):
+        renewed_at = None
+        while not self._stop_renewer.is_set():
+            expires_at = self.auth_expires_at
+            if expires_at is not None:
+                now = time.time()
+                wait = expires_at - margin - now
+                if renewed_at is not None:
+                    # a token that lives no longer than the margin would
+                    # otherwise be renewed back to back
+                    wait = max(wait, renewed_at + MIN_RENEW_INTERVAL - now)
+                if wait > 0:
+                    self._stop_renewer.wait(wait)
+                    continue
+            try:
+                self._ensure_login(margin)
+                renewed_at = time.time()
+            except Exception:
+                log.exception('Background token renewal failed')
+                self._stop_renewer.wait(RENEW_RETRY_DELAY)
+
+    def login(self, min_ttl=0):
         """
         Gets and stores an OAUTH token from Rightscale.
+
+        If the client has a :attr:`token_cache`, a token cached by another
+        client (or process) is used instead as long as it stays valid for at
+        least :attr:`min_ttl` more seconds.
         """
+        cache = self.token_cache
+        if cache is None:
+            self._use_token(*self._fetch_token())
+            return
+
+        key = cache.key(self.endpoint, self.refresh_token)
+        with cache.lock():
+            cached = cache.get(key, TOKEN_EXPIRY_SLACK + min_ttl)
+            if cached:
+                log.debug('Using cached auth token')
+                token, expires_at = cached
+            else:
+                token, expires_at = self._fetch_token()
+                cache.put(key, token, expires_at)
+        self._use_token(token, expires_at)
+
+    def _fetch_token(self):
         log.debug('Logging into RightScale...')
         login_data = {
             'grant_type': 'refresh_token',
@@ -81,15 +368,19 @@ class HTTPClient(object):
         response = self._request('post', self.oauth_path, data=login_data)
 
         raw_token = response.json()
-        auth_token = "Bearer %s" % raw_token['access_token']
+        log.debug('Auth Token expires in %s(s)' % raw_token['expires_in'])
+        expires_at = time.time() + int(raw_token['expires_in'])
+        return raw_token['access_token'], expires_at
+
+    def _use_token(self, access_token, expires_at):
+        auth_token = "Bearer %s" % access_token
         self.s.headers['Authorization'] = auth_token
 
         # Generate an expiration time for our token of 60-seconds before the
         # standard time returned by RightScale. This will be used in the
         # self.client property to validate that our token is still usable on
         # every API call.
-        log.debug('Auth Token expires in %s(s)' % raw_token['expires_in'])
-        self.auth_expires_at = time.time() + int(raw_token['expires_in']) - 60
+        self.auth_expires_at = expires_at - TOKEN_EXPIRY_SLACK
 
     def request(self, method, path='/', url=None, ignore_codes=[], **kwargs):
         """
@@ -117,11 +408,79 @@ class HTTPClient(object):
 
         Returns a :class:`requests.Response` object.
         """
+        if kwargs.get('stream'):
+            return self._authed_request(
+                    method, path, url, ignore_codes, **kwargs)
+
+        if method.lower() == 'get':
+            flights = self.flights
+            if flights is not None and COALESCED_KWARGS.issuperset(kwargs):
+                key = request_key(
+                        'get', url if url else path, kwargs.get('params'))
+                # every caller gets a body of its own to change
+                return flights.do(
+                        key + (tuple(ignore_codes),),
+                        self._get, path, url, ignore_codes, **kwargs).copy()
+            return self._get(path, url, ignore_codes, **kwargs)
+
+        response = self._authed_request(
+                method, path, url, ignore_codes, **kwargs)
+        if self.cache is not None and method.lower() != 'head':
+            self.cache.invalidate(url if url else path)
+        return response
+
+    def _get(self, path, url, ignore_codes, **kwargs):
+        cache = self.cache
+        if cache is None and self.validators is None:
+            return self._authed_request(
+                    'get', path, url, ignore_codes, **kwargs)
+
+        key = request_key('get', url if url else path, kwargs.get('params'))
+        if cache is not None:
+            response = cache.get(key)
+            if response is not None:
+                return response.copy()
+
+        if self.validators is not None:
+            response = self._conditional_get(
+                    key, path, url, ignore_codes, **kwargs)
+        else:
+            response = self._authed_request(
+                    'get', path, url, ignore_codes, **kwargs)
+
+        if cache is not None and response.status_code == 200:
+            cache.set(key, response)
+        return response
+
+    def _conditional_get(self, key, path, url, ignore_codes, **kwargs):
+        stored = self.validators.get(key)
+        if stored is not None:
+            etag, last_modified, previous = stored
+            headers = dict(kwargs.get('headers') or {})
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+            kwargs['headers'] = headers
+
+        response = self._authed_request(
+                'get', path, url, ignore_codes, **kwargs)
+        if response.status_code == 304 and stored is not None:
+            return previous.copy()
+
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if response.status_code == 200 and (etag or last_modified):
+            self.validators.set(key, (etag, last_modified, response))
+        return response
+
+    def _authed_request(self, method, path='/', url=None, ignore_codes=[],
+                        **kwargs):
         # On every call, check if we're both logged in, and if the token is
         # expiring. If it is, we'll re-login with the information passed into
         # us at instantiation.
-        if time.time() > self.auth_expires_at:
-            self.login()
+        if self._token_expired():
+            self._ensure_login()
 
         # Now make the actual API call
         return self._request(method, path, url, ignore_codes, **kwargs)
@@ -151,7 +510,61 @@ class HTTPClient(object):
         Returns a :class:`requests.Response` object.
         """
         _url = url if url else (self.endpoint + path)
-        r = self.s.request(method, _url, **kwargs)
+        limiter = self.rate_limiter
+        retries = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            r = self._send(method, _url, retries, kwargs)
+            if r.status_code not in RETRY_STATUS_CODES:
+                if limiter is not None:
+                    limiter.on_success()
+                break
+
+            retry_after = parse_retry_after(r.headers.get('retry-after'))
+            if limiter is not None and r.status_code == 429:
+                # the limiter itself holds everyone back for retry_after
+                limiter.on_throttle(retry_after)
+                retry_after = None
+            if (retries >= self.max_retries
+                    or method.upper() not in IDEMPOTENT_METHODS):
+                break
+
+            retries += 1
+            delay = self._backoff(retries)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            log.debug('Got %s for %s %s, retry %d in %.2fs' % (
+                r.status_code, method, _url, retries, delay))
+            r.close()
+            time.sleep(delay)
+
         if not r.ok and r.status_code not in ignore_codes:
             r.raise_for_status()
         return HTTPResponse(r)
+
+    def _send(self, method, url, attempt, kwargs):
+        pre_hooks = self.pre_request_hooks
+        post_hooks = self.post_request_hooks
+        if not (pre_hooks or post_hooks):
+            return self.s.request(method, url, **kwargs)
+
+        event = RequestEvent(method, url, attempt, kwargs)
+        event.login = bool(self.oauth_path) and (
+                url == self.endpoint + self.oauth_path)
+        _run_hooks(pre_hooks, event)
+        event.started = time.time()
+        try:
+            event.response = self.s.request(method, url, **kwargs)
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.elapsed = time.time() - event.started
+            _run_hooks(post_hooks, event)
+        return event.response
+
+    def _backoff(self, retries):
+        # "full jitter": anywhere between zero and the exponential cap
+        cap = min(self.backoff_max, self.backoff_base * 2 ** (retries - 1))
+        return random.uniform(0, cap)
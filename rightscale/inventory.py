@@ -0,0 +1,508 @@
+"""
+Offline snapshot of an account.
+
+:func:`crawl` walks the API from the session resource down through the
+collections named in :data:`DEFAULT_CRAWL` and saves every resource it finds
+(soul, links and tags) to a SQLite file.  Reports can then query the
+:class:`Inventory` without touching the API::
+
+    from rightscale.inventory import crawl, Inventory
+    crawl(api, 'inventory.db')
+
+    inv = Inventory('inventory.db')
+    for server in inv.find(type='server', parent=deploy_href):
+        print server['name'], server['state']
+
+:func:`sync` then keeps the snapshot up to date by re-fetching only what the
+audit trail says has changed since the last crawl or sync.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from .audit import AUDIT_DATE_FORMAT, export_audit_entries, format_audit_date
+from .util import DEFAULT_CONCURRENCY, iter_fan_out
+
+
+log = logging.getLogger(__name__)
+
+# resource type -> the collections to list under each resource of that type.
+# links for these come from the API itself or from actions.COLLECTIONS.
+DEFAULT_CRAWL = {
+        'session': ('clouds', 'deployments'),
+        'cloud': ('instances',),
+        'deployment': ('servers', 'server_arrays'),
+        }
+
+CONTENT_TYPE_PREFIX = 'application/vnd.rightscale.'
+CONTENT_TYPE_SUFFIX = '+json'
+
+# the most hrefs sent in one tags/by_resource call
+TAG_CHUNK_SIZE = 100
+
+# resource type -> rel of the link to the resource it was crawled under, or
+# None for those listed straight from the session.  sync() only adds new
+# resources of these types, since they are the ones DEFAULT_CRAWL collects.
+PARENT_RELS = {
+        'cloud': None,
+        'deployment': None,
+        'instance': 'cloud',
+        'server': 'deployment',
+        'server_array': 'deployment',
+        }
+
+# audit entries can show up a little after their updated_at, so every sync
+# looks this far back past the cursor
+SYNC_OVERLAP = timedelta(minutes=2)
+
+META_CRAWLED_AT = 'crawled_at'
+META_SYNC_CURSOR = 'sync_cursor'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS resources (
+    href TEXT PRIMARY KEY,
+    type TEXT,
+    name TEXT,
+    parent TEXT,
+    soul TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS resources_type ON resources (type);
+CREATE INDEX IF NOT EXISTS resources_name ON resources (name);
+CREATE INDEX IF NOT EXISTS resources_parent ON resources (parent);
+
+CREATE TABLE IF NOT EXISTS links (
+    href TEXT,
+    rel TEXT,
+    target TEXT
+);
+CREATE INDEX IF NOT EXISTS links_href ON links (href);
+CREATE INDEX IF NOT EXISTS links_target ON links (target);
+
+CREATE TABLE IF NOT EXISTS tags (
+    href TEXT,
+    tag TEXT
+);
+CREATE INDEX IF NOT EXISTS tags_href ON tags (href);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def resource_type(content_type):
+    """
+    ``application/vnd.rightscale.server_array+json`` -> ``server_array``
+    """
+    if (content_type.startswith(CONTENT_TYPE_PREFIX)
+            and content_type.endswith(CONTENT_TYPE_SUFFIX)):
+        return content_type[
+                len(CONTENT_TYPE_PREFIX):-len(CONTENT_TYPE_SUFFIX)]
+    return content_type
+
+
+class Inventory(object):
+    """
+    A SQLite file holding resources, their links and tags.
+
+    :param str path: Location of the database.  Created if missing.
+
+    Resources come back as their souls (dicts, including ``links``).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def put(self, href, type, soul, parent=None):
+        """
+        Adds or replaces a resource.  Call :meth:`commit` afterwards.
+        """
+        self.db.execute(
+                'INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)',
+                (href, type, soul.get('name'), parent, json.dumps(soul),
+                    time.time()),
+                )
+        self.db.execute('DELETE FROM links WHERE href = ?', (href,))
+        self.db.executemany(
+                'INSERT INTO links VALUES (?, ?, ?)',
+                [(href, l['rel'], l['href']) for l in soul.get('links', [])],
+                )
+
+    def delete(self, href):
+        """
+        Drops a resource, its links, its tags and everything under it.
+        """
+        children = [c for c, in self.db.execute(
+                'SELECT href FROM resources WHERE parent = ?', (href,))]
+        for child in children:
+            self.delete(child)
+        for table in ('resources', 'links', 'tags'):
+            self.db.execute('DELETE FROM %s WHERE href = ?' % table, (href,))
+
+    def set_tags(self, href, tags):
+        self.db.execute('DELETE FROM tags WHERE href = ?', (href,))
+        self.db.executemany(
+                'INSERT INTO tags VALUES (?, ?)',
+                [(href, tag) for tag in tags],
+                )
+
+    def commit(self):
+        self.db.commit()
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute(
+                'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        self.db.execute(
+                'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                (key, json.dumps(value)),
+                )
+
+    def get(self, href):
+        """
+        Returns the soul of the resource at :attr:`href`, or ``None``.
+        """
+        row = self.db.execute(
+                'SELECT soul FROM resources WHERE href = ?', (href,)
+                ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def parent(self, href):
+        """
+        Returns the href of the resource :attr:`href` was crawled under, or
+        ``None``.
+        """
+        row = self.db.execute(
+                'SELECT parent FROM resources WHERE href = ?', (href,)
+                ).fetchone()
+        return row[0] if row else None
+
+    def find(self, type=None, name=None, parent=None, tag=None):
+        """
+        Returns the souls of every resource matching all of the given
+        criteria.  :attr:`name` may contain SQL ``LIKE`` wildcards (``%``).
+        """
+        where = []
+        args = []
+        if type is not None:
+            where.append('type = ?')
+            args.append(type)
+        if name is not None:
+            where.append('name LIKE ?' if '%' in name else 'name = ?')
+            args.append(name)
+        if parent is not None:
+            where.append('parent = ?')
+            args.append(parent)
+        if tag is not None:
+            where.append('href IN (SELECT href FROM tags WHERE tag = ?)')
+            args.append(tag)
+        sql = 'SELECT soul FROM resources'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY href'
+        return [json.loads(s) for s, in self.db.execute(sql, args)]
+
+    def children(self, href):
+        return self.find(parent=href)
+
+    def linked_to(self, target, rel=None):
+        """
+        Returns the hrefs of resources with a link to :attr:`target`, e.g.
+        every instance of a server template.
+        """
+        sql = 'SELECT href FROM links WHERE target = ?'
+        args = [target]
+        if rel is not None:
+            sql += ' AND rel = ?'
+            args.append(rel)
+        return [h for h, in self.db.execute(sql, args)]
+
+    def tags(self, href):
+        return [t for t, in self.db.execute(
+                'SELECT tag FROM tags WHERE href = ? ORDER BY tag', (href,))]
+
+    def count(self, type=None):
+        if type is None:
+            row = self.db.execute('SELECT COUNT(*) FROM resources')
+        else:
+            row = self.db.execute(
+                    'SELECT COUNT(*) FROM resources WHERE type = ?', (type,))
+        return row.fetchone()[0]
+
+
+def _list(job):
+    parent, rel, _ = job
+    return getattr(parent, rel).index()
+
+
+def _fetch_tags(api, hrefs):
+    data = {'resource_hrefs[]': hrefs}
+    found = api.tags.by_resource(data=data) or []
+    tags = dict((h, []) for h in hrefs)
+    for entry in found:
+        names = [t['name'] for t in entry.soul.get('tags', [])]
+        for link in entry.soul.get('links', []):
+            if link.get('rel') == 'resource' and link['href'] in tags:
+                tags[link['href']].extend(names)
+    return tags
+
+
+def _store_tags(api, inv, hrefs, concurrency):
+    """
+    Fetches and stores the tags of :attr:`hrefs`.  Returns the outcomes of
+    the calls that failed.
+    """
+    hrefs = sorted(hrefs)
+    chunks = [
+            hrefs[i:i + TAG_CHUNK_SIZE]
+            for i in range(0, len(hrefs), TAG_CHUNK_SIZE)
+            ]
+    errors = []
+    fetch = lambda chunk: _fetch_tags(api, chunk)
+    for outcome in iter_fan_out(fetch, chunks, concurrency, ordered=False):
+        if not outcome.ok:
+            log.warning('Could not fetch tags: %s', outcome.error)
+            errors.append(outcome)
+            continue
+        for href, resource_tags in outcome.result.items():
+            inv.set_tags(href, resource_tags)
+    return errors
+
+
+def _walk(inv, api, collections, tags, concurrency):
+    errors = []
+    seen = set()
+    frontier = [(api, 'session', None)]
+    while frontier:
+        jobs = []
+        for res, res_type, href in frontier:
+            links = res.links
+            for rel in collections.get(res_type, ()):
+                if rel in links:
+                    jobs.append((res, rel, href))
+        frontier = []
+        for outcome in iter_fan_out(_list, jobs, concurrency, ordered=False):
+            _, rel, parent = outcome.item
+            if not outcome.ok:
+                log.warning('Could not list %s of %s: %s',
+                            rel, parent or 'the session', outcome.error)
+                errors.append(outcome)
+                continue
+            for child in outcome.result:
+                href = child.href
+                if not href or href in seen:
+                    continue
+                seen.add(href)
+                child_type = resource_type(child.content_type)
+                inv.put(href, child_type, child.soul, parent)
+                frontier.append((child, child_type, href))
+        inv.commit()
+
+    if tags:
+        errors.extend(_store_tags(api, inv, seen, concurrency))
+
+    return errors
+
+
+def crawl(
+        api,
+        path,
+        collections=DEFAULT_CRAWL,
+        tags=True,
+        concurrency=DEFAULT_CONCURRENCY,
+        ):
+    """
+    Takes a fresh snapshot of the account behind :attr:`api`.
+
+    :param rightscale.RightScale api: Where to start.
+
+    :param str path: The SQLite file to write.  It is replaced only once the
+        crawl is complete.
+
+    :param dict collections: Maps a resource type to the names of the
+        collections to list under each resource of that type.
+
+    :param bool tags: Also fetch the tags of every resource found.
+
+    :param int concurrency: Max number of requests in flight.
+
+    Collections that can't be listed are logged and skipped; their
+    :class:`rightscale.util.Outcome` objects are kept in the
+    ``crawl_errors`` attribute of the returned :class:`Inventory`.
+    """
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    inv = Inventory(tmp_path)
+    started = time.time()
+    try:
+        errors = _walk(inv, api, collections, tags, concurrency)
+        inv.set_meta(META_CRAWLED_AT, started)
+        inv.commit()
+    except:
+        inv.close()
+        os.remove(tmp_path)
+        raise
+    inv.close()
+    os.rename(tmp_path, path)
+
+    inv = Inventory(path)
+    inv.crawl_errors = errors
+    return inv
+
+
+SyncStats = namedtuple('SyncStats', 'changed updated deleted errors')
+
+
+def parse_audit_date(value):
+    """
+    Inverse of :func:`rightscale.audit.format_audit_date`.
+    """
+    return datetime.strptime(value, AUDIT_DATE_FORMAT)
+
+
+def _show(api, href):
+    try:
+        response = api.client.get(href)
+    except Exception as e:
+        response = getattr(e, 'response', None)
+        if response is not None and response.status_code == 404:
+            return None
+        raise
+    return resource_type(response.content_type[0]), response.json()
+
+
+def _sync_cursor(inv):
+    cursor = inv.get_meta(META_SYNC_CURSOR)
+    if cursor:
+        return parse_audit_date(cursor)
+    crawled_at = inv.get_meta(META_CRAWLED_AT)
+    if crawled_at is None:
+        raise ValueError('%s has never been crawled' % inv.path)
+    return datetime.utcfromtimestamp(crawled_at)
+
+
+def _refetch(api, inv, hrefs, concurrency, stats):
+    """
+    Re-fetches :attr:`hrefs` and stores what changed.  Returns the souls that
+    were written.
+    """
+    written = {}
+    fetch = lambda href: _show(api, href)
+    for outcome in iter_fan_out(fetch, hrefs, concurrency, ordered=False):
+        href = outcome.item
+        if not outcome.ok:
+            log.warning('Could not fetch %s: %s', href, outcome.error)
+            stats['errors'].append(outcome)
+            continue
+        if outcome.result is None:
+            if inv.get(href) is not None:
+                inv.delete(href)
+                stats['deleted'] += 1
+            continue
+        res_type, soul = outcome.result
+        old = inv.get(href)
+        if old is not None and old.get('updated_at') and (
+                old.get('updated_at') == soul.get('updated_at')):
+            continue
+        links = dict((l['rel'], l['href']) for l in soul.get('links', []))
+        if res_type in PARENT_RELS:
+            rel = PARENT_RELS[res_type]
+            parent = links.get(rel) if rel else None
+        elif old is not None:
+            # crawled with other collections; it stays where it was found
+            parent = inv.parent(href)
+        else:
+            # e.g. a server template: not something crawl() collects
+            continue
+        inv.put(href, res_type, soul, parent)
+        stats['updated'] += 1
+        written[href] = links
+    return written
+
+
+def sync(api, inv, concurrency=DEFAULT_CONCURRENCY, tags=True):
+    """
+    Brings an :class:`Inventory` made by :func:`crawl` up to date.
+
+    Reads the audit entries since the last crawl or sync, then re-fetches
+    only the resources they mention.  Servers that got a new current
+    instance also have the instance fetched.  Resources that are gone are
+    deleted along with everything under them.  Resources whose
+    ``updated_at`` hasn't moved are not rewritten.  New resources are only
+    added if they are of a type :data:`DEFAULT_CRAWL` collects (see
+    :data:`PARENT_RELS`); audit entries about anything else are ignored.
+
+    The newest audit entry seen becomes the cursor for the next sync, so
+    each run costs time proportional to the amount of change rather than the
+    size of the account.
+
+    :param rightscale.RightScale api: Where to fetch from.
+
+    :param Inventory inv: The snapshot to update.
+
+    :param int concurrency: Max number of requests in flight.
+
+    :param bool tags: Also re-fetch the tags of changed resources.
+
+    Returns a :class:`SyncStats` with the number of hrefs mentioned in the
+    audit trail, and the number of resources updated and deleted.
+    Fetches that failed are in its ``errors`` list.  If there were any, the
+    cursor is not moved so the next sync tries again.
+    """
+    start = _sync_cursor(inv) - SYNC_OVERLAP
+    end = datetime.utcnow()
+
+    changed = set()
+    newest = None
+    entries = export_audit_entries(
+            api, start, end, concurrency=concurrency)
+    for entry in entries:
+        for link in entry.soul.get('links', []):
+            if link.get('rel') == 'auditee':
+                changed.add(link['href'])
+        updated_at = entry.soul.get('updated_at')
+        if updated_at and (newest is None or updated_at > newest):
+            newest = updated_at
+
+    stats = {'updated': 0, 'deleted': 0, 'errors': []}
+    written = _refetch(api, inv, sorted(changed), concurrency, stats)
+
+    # a server's new instance isn't audited under the instance's own href
+    instances = set(
+            links['current_instance'] for links in written.values()
+            if links.get('current_instance')
+            and links['current_instance'] not in changed
+            )
+    written.update(
+            _refetch(api, inv, sorted(instances), concurrency, stats))
+
+    if tags:
+        stats['errors'].extend(_store_tags(api, inv, written, concurrency))
+
+    if not stats['errors']:
+        if newest:
+            cursor = min(parse_audit_date(newest), end)
+        else:
+            cursor = end
+        inv.set_meta(META_SYNC_CURSOR, format_audit_date(cursor))
+    inv.commit()
+    return SyncStats(
+            len(changed), stats['updated'], stats['deleted'], stats['errors'])
@@ -0,0 +1,245 @@
+"""
+Request metrics for :class:`rightscale.httpclient.HTTPClient`.
+
+A :class:`Metrics` object hooked up to one or more clients keeps latency
+histograms, status code counts, bytes in and out and retry counts for every
+endpoint, plus a count of logins::
+
+    from rightscale.metrics import Metrics
+    metrics = Metrics()
+    api = RightScale(metrics=metrics)
+    ...
+    print metrics.prometheus()
+
+Endpoints are reduced to templates like ``/api/clouds/:id/instances`` so the
+number of distinct labels stays small however many resources are touched.
+"""
+import re
+import threading
+import urlparse
+
+
+DEFAULT_BUCKETS = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_PREFIX = 'rightscale_'
+
+# collection and action names are lowercase words (oauth2, health-check,
+# multi_run_executable); everything else in a path (numbers, instance ids like
+# 1A2B3C, task ids like ae-123) is a resource id
+_NAME_RE = re.compile(r'^[a-z][a-z_]*(-[a-z_]+)*[0-9]*$')
+
+
+def path_template(url):
+    """
+    Turns a URL or path into an endpoint template by replacing resource ids
+    with ``:id`` and dropping the host and query string.  E.g.
+    ``https://my.rightscale.com/api/clouds/1/instances/ABC?view=full`` gives
+    ``/api/clouds/:id/instances/:id``.
+    """
+    path = urlparse.urlsplit(url).path
+    return '/'.join(
+            seg if not seg or _NAME_RE.match(seg) else ':id'
+            for seg in path.split('/')
+            )
+
+
+def _bytes_out(event):
+    request = getattr(event.response, 'request', None)
+    body = getattr(request, 'body', None)
+    if isinstance(body, basestring):
+        return len(body)
+    return 0
+
+
+def _bytes_in(event):
+    response = event.response
+    if response is None:
+        return 0
+    if event.kwargs.get('stream'):
+        # don't read a streamed body just to measure it
+        return int(response.headers.get('content-length') or 0)
+    return len(response.content or '')
+
+
+class _EndpointStats(object):
+    __slots__ = (
+            'buckets', 'count', 'sum', 'statuses', 'bytes_in', 'bytes_out',
+            'retries')
+
+    def __init__(self, n_buckets):
+        self.buckets = [0] * n_buckets
+        self.count = 0
+        self.sum = 0.0
+        self.statuses = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join(
+            '%s="%s"' % (k, _escape(v)) for k, v in sorted(labels.items()))
+
+
+class Metrics(object):
+    """
+    Thread-safe request metrics, fed by :class:`HTTPClient` request hooks.
+
+    :param tuple buckets: Upper bounds, in seconds, of the latency histogram
+        buckets.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.logins = 0
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        """
+        Starts recording every request :attr:`client` makes.
+        """
+        client.post_request_hooks.append(self.observe)
+
+    def detach(self, client):
+        client.post_request_hooks.remove(self.observe)
+
+    def observe(self, event):
+        """
+        Post-request hook: records one
+        :class:`rightscale.httpclient.RequestEvent`.
+        """
+        key = (event.method.upper(), path_template(event.url))
+        if event.response is not None:
+            status = event.response.status_code
+        else:
+            status = 'error'
+        bytes_out = _bytes_out(event)
+        bytes_in = _bytes_in(event)
+        elapsed = event.elapsed
+
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = _EndpointStats(
+                        len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    stats.buckets[i] += 1
+                    break
+            stats.count += 1
+            stats.sum += elapsed
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            if event.retry:
+                stats.retries += 1
+            if event.login:
+                self.logins += 1
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self.logins = 0
+
+    def snapshot(self):
+        """
+        Returns the current metrics as plain dicts::
+
+            {
+                'logins': 1,
+                'endpoints': {
+                    ('GET', '/api/clouds/:id/instances'): {
+                        'count': 12,
+                        'sum': 3.4,
+                        'buckets': {0.005: 0, 0.01: 1, ...},
+                        'statuses': {200: 11, 503: 1},
+                        'bytes_in': 123456,
+                        'bytes_out': 0,
+                        'retries': 1,
+                    },
+                },
+            }
+
+        Histogram buckets are cumulative, like Prometheus ones.
+        """
+        with self._lock:
+            endpoints = {}
+            for key, stats in self._endpoints.items():
+                cumulative = {}
+                total = 0
+                for bound, n in zip(self.buckets, stats.buckets):
+                    total += n
+                    cumulative[bound] = total
+                endpoints[key] = {
+                        'count': stats.count,
+                        'sum': stats.sum,
+                        'buckets': cumulative,
+                        'statuses': dict(stats.statuses),
+                        'bytes_in': stats.bytes_in,
+                        'bytes_out': stats.bytes_out,
+                        'retries': stats.retries,
+                        }
+            return {'logins': self.logins, 'endpoints': endpoints}
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        snap = self.snapshot()
+        endpoints = sorted(snap['endpoints'].items())
+        p = METRIC_PREFIX
+        lines = []
+
+        def header(name, kind, doc):
+            lines.append('# HELP %s%s %s' % (p, name, doc))
+            lines.append('# TYPE %s%s %s' % (p, name, kind))
+
+        header('request_duration_seconds', 'histogram',
+               'Time spent on RightScale API requests.')
+        for (method, endpoint), stats in endpoints:
+            for bound in self.buckets:
+                lines.append('%srequest_duration_seconds_bucket%s %d' % (
+                        p,
+                        _labels(method=method, endpoint=endpoint,
+                                le=repr(bound)),
+                        stats['buckets'][bound]))
+            labels = _labels(method=method, endpoint=endpoint)
+            lines.append('%srequest_duration_seconds_bucket%s %d' % (
+                    p,
+                    _labels(method=method, endpoint=endpoint, le='+Inf'),
+                    stats['count']))
+            lines.append('%srequest_duration_seconds_sum%s %r' % (
+                    p, labels, stats['sum']))
+            lines.append('%srequest_duration_seconds_count%s %d' % (
+                    p, labels, stats['count']))
+
+        header('requests_total', 'counter',
+               'RightScale API requests by response status.')
+        for (method, endpoint), stats in endpoints:
+            for status, n in sorted(stats['statuses'].items()):
+                lines.append('%srequests_total%s %d' % (
+                        p,
+                        _labels(method=method, endpoint=endpoint,
+                                status=status),
+                        n))
+
+        for name, field, doc in (
+                ('request_bytes_total', 'bytes_out', 'Request body bytes.'),
+                ('response_bytes_total', 'bytes_in', 'Response body bytes.'),
+                ('retries_total', 'retries', 'Retried requests.'),
+                ):
+            header(name, 'counter', doc)
+            for (method, endpoint), stats in endpoints:
+                lines.append('%s%s%s %d' % (
+                        p, name,
+                        _labels(method=method, endpoint=endpoint),
+                        stats[field]))
+
+        header('logins_total', 'counter', 'OAuth logins.')
+        lines.append('%slogins_total %d' % (p, snap['logins']))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,175 @@
+"""
+Resolution of colon-separated resource paths, many at a time.
+
+Paths look like the ones accepted by :func:`rightscale.commands.get_by_path`,
+e.g. ``deployments:production:servers:haproxy``.  Each part is either a link
+to follow or the name of a resource to find in the current collection.  Name
+parts may also be shell-style globs (``deployments:prod-*:servers``), in which
+case every matching resource is followed.
+
+:class:`PathResolver` resolves each distinct path prefix only once, looks up
+independent branches concurrently and remembers the hops it has made.
+"""
+import fnmatch
+import threading
+import time
+
+from .util import DEFAULT_CONCURRENCY, fan_out, find_by_name, Outcome
+
+
+GLOB_CHARS = '*?['
+
+PATH_SEPARATOR = ':'
+
+
+def is_glob(part):
+    return any(c in part for c in GLOB_CHARS)
+
+
+def _glob_prefix(pattern):
+    """
+    The literal part of a glob before the first wildcard.
+    """
+    for i, c in enumerate(pattern):
+        if c in GLOB_CHARS:
+            return pattern[:i]
+    return pattern
+
+
+def step(node, part):
+    """
+    Takes one step along a path from :attr:`node`.
+
+    Returns a list of the nodes reached, which is empty if there's no match
+    and may have several entries for globs.
+    """
+    if is_glob(part):
+        prefix = _glob_prefix(part)
+        if prefix:
+            found = find_by_name(node, prefix, exact=False) or []
+        else:
+            found = node.index()
+        return [
+                res for res in found
+                if fnmatch.fnmatchcase(res.soul.get('name', ''), part)
+                ]
+
+    res = getattr(node, part, None)
+    if not res:
+        # probably the name of the res to find
+        res = find_by_name(node, part)
+    if not res:
+        return []
+    return [res]
+
+
+# stands for "the resolver's own ttl" in resolve_many()
+_DEFAULT_TTL = object()
+
+
+class PathResolver(object):
+    """
+    Resolves colon-separated paths, caching every intermediate hop.
+
+    :param rightscale.RightScale api: Where all paths start.
+
+    :param float ttl: How many seconds a resolved hop stays cached.  ``None``
+        keeps hops for the lifetime of the resolver.
+
+    :param int concurrency: Max number of lookups in flight.
+    """
+    def __init__(self, api, ttl=None, concurrency=DEFAULT_CONCURRENCY):
+        self.api = api
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self._hops = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._hops.clear()
+
+    def prune(self, ttl):
+        """
+        Forgets every hop resolved more than :attr:`ttl` seconds ago.
+        """
+        cutoff = time.time() - ttl
+        with self._lock:
+            for prefix, (resolved_at, _) in self._hops.items():
+                if resolved_at < cutoff:
+                    del self._hops[prefix]
+
+    def _cached(self, prefix, ttl):
+        with self._lock:
+            entry = self._hops.get(prefix)
+        if entry is None:
+            return None
+        resolved_at, outcome = entry
+        if ttl is not None and time.time() - resolved_at > ttl:
+            return None
+        return outcome
+
+    def _store(self, prefix, outcome):
+        with self._lock:
+            self._hops[prefix] = (time.time(), outcome)
+
+    def _hop(self, parents, part):
+        if len(parents) == 1:
+            return step(parents[0], part)
+        # e.g. every deployment matched by a glob
+        nodes = []
+        outcomes = fan_out(lambda p: step(p, part), parents, self.concurrency)
+        for outcome in outcomes:
+            nodes.extend(outcome.get())
+        return nodes
+
+    def resolve_many(self, paths, ttl=_DEFAULT_TTL):
+        """
+        Resolves every path in :attr:`paths`.
+
+        :param float ttl: Only use cached hops resolved less than this many
+            seconds ago.  Defaults to the resolver's :attr:`ttl`.
+
+        Returns a dict mapping each path to a :class:`rightscale.util.Outcome`
+        whose result is the list of nodes the path leads to.  A failed lookup
+        only fails the paths that go through it, and is not cached.  Cached
+        hops older than :attr:`ttl` are dropped.
+        """
+        if ttl is _DEFAULT_TTL:
+            ttl = self.ttl
+        if ttl is not None:
+            self.prune(ttl)
+        split = dict((p, tuple(p.split(PATH_SEPARATOR))) for p in paths)
+        depth = max([len(parts) for parts in split.values()] or [0])
+        resolved = {(): Outcome((), [self.api])}
+
+        def hop(prefix):
+            return self._hop(resolved[prefix[:-1]].result, prefix[-1])
+
+        for level in range(1, depth + 1):
+            todo = []
+            prefixes = set(
+                    parts[:level] for parts in split.values()
+                    if len(parts) >= level
+                    )
+            for prefix in prefixes:
+                parent = resolved[prefix[:-1]]
+                cached = self._cached(prefix, ttl)
+                if cached is not None:
+                    resolved[prefix] = cached
+                elif not parent.ok:
+                    # pass the parent's error down
+                    resolved[prefix] = parent
+                else:
+                    todo.append(prefix)
+            for outcome in fan_out(hop, todo, self.concurrency):
+                resolved[outcome.item] = outcome
+                if outcome.ok:
+                    self._store(outcome.item, outcome)
+        return dict((p, resolved[parts]) for p, parts in split.items())
+
+    def resolve(self, path):
+        """
+        Resolves a single path and returns the list of nodes it leads to.
+        """
+        return self.resolve_many([path])[path].get()
@@ -0,0 +1,121 @@
+"""
+Keep-alive connection pooling for :class:`rightscale.httpclient.HTTPClient`.
+
+The default client disables keepalives because long-lived urllib3 pools can
+hand out sockets the server closed ages ago.  The adapter in here puts a cap on
+how long a pooled connection may sit idle and keeps track of how often the
+pool actually saves us a TCP/TLS handshake.
+"""
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import (
+        HTTPConnectionPool,
+        HTTPSConnectionPool,
+        )
+
+
+DEFAULT_POOL_SIZE = 10
+
+
+class PoolStats(object):
+    """
+    Thread-safe counters for pooled connection checkouts.
+
+    ``hits`` are checkouts that reused a live socket, ``misses`` had to open a
+    new one.  Misses are further broken down into ``stale`` (urllib3 found the
+    socket dropped by the peer) and ``expired`` (idle for longer than the max
+    age).
+    """
+    FIELDS = ('hits', 'misses', 'stale', 'expired')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, *fields):
+        with self._lock:
+            for field in fields:
+                self._counts[field] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class _AgingPoolMixin(object):
+    """
+    Wraps connection checkout to enforce :attr:`max_age` and count pool hits.
+
+    Connections are stamped with the time they go back into the pool, so
+    :attr:`max_age` limits how long one sat idle, not how long it has been
+    in use.
+    """
+    max_age = None
+    stats = None
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._rs_idle_since = time.time()
+        super(_AgingPoolMixin, self)._put_conn(conn)
+
+    def _get_conn(self, timeout=None):
+        conn = super(_AgingPoolMixin, self)._get_conn(timeout)
+        idle_since = getattr(conn, '_rs_idle_since', None)
+
+        if getattr(conn, 'sock', None) is None:
+            # either brand new, or urllib3 noticed the peer hung up and reset
+            # it.  either way it's going to connect from scratch.
+            if idle_since is None:
+                self.stats.incr('misses')
+            else:
+                self.stats.incr('misses', 'stale')
+            return conn
+
+        if (self.max_age is not None
+                and time.time() - idle_since > self.max_age):
+            conn.close()
+            self.stats.incr('misses', 'expired')
+            return conn
+
+        self.stats.incr('hits')
+        return conn
+
+
+class PoolingAdapter(HTTPAdapter):
+    """
+    :class:`requests.adapters.HTTPAdapter` that keeps connections alive.
+
+    :param int pool_size: Max number of connections to keep per host.
+
+    :param float max_age: Seconds a pooled connection may sit idle before it
+        is closed and re-opened instead of being reused.  ``None`` means no
+        limit.
+
+    :param PoolStats stats: Where to count pool hits and misses.  A new one is
+        created if not given.
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, max_age=None, stats=None,
+                 **kwargs):
+        self.max_age = max_age
+        self.stats = stats or PoolStats()
+        kwargs.setdefault('pool_connections', pool_size)
+        kwargs.setdefault('pool_maxsize', pool_size)
+        super(PoolingAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PoolingAdapter, self).init_poolmanager(*args, **kwargs)
+        attrs = {'max_age': self.max_age, 'stats': self.stats}
+        self.poolmanager.pool_classes_by_scheme = {
+                'http': type(
+                    'AgingHTTPConnectionPool',
+                    (_AgingPoolMixin, HTTPConnectionPool),
+                    attrs,
+                    ),
+                'https': type(
+                    'AgingHTTPSConnectionPool',
+                    (_AgingPoolMixin, HTTPSConnectionPool),
+                    attrs,
+                    ),
+                }
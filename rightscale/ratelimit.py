@@ -0,0 +1,131 @@
+"""
+Client-side throttling.
+
+A :class:`RateLimiter` shared by everything that talks to RightScale (threads,
+the async client's workers, batch fan-outs) keeps the request rate just under
+what the API will put up with.  It starts at a configured rate, creeps up
+while requests succeed and backs off sharply whenever RightScale answers
+``429 Too Many Requests`` (AIMD), honouring any ``Retry-After`` it sends::
+
+    from rightscale.ratelimit import RateLimiter
+    api = RightScale(rate_limiter=RateLimiter(rate=10), max_retries=5)
+"""
+from email.utils import mktime_tz, parsedate_tz
+import threading
+import time
+
+
+DEFAULT_RATE = 10.0
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_RATE = 100.0
+
+
+def parse_retry_after(value):
+    """
+    Parses a ``Retry-After`` header value (either seconds or an HTTP date)
+    into a number of seconds from now.  Returns ``None`` if missing or
+    unparseable.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - time.time())
+
+
+class RateLimiter(object):
+    """
+    Thread-safe token bucket with additive-increase/multiplicative-decrease
+    rate control.
+
+    :param float rate: Initial number of requests allowed per second.
+
+    :param float burst: Max number of requests that may go out back-to-back
+        after an idle period.  Defaults to :attr:`rate`.
+
+    :param float min_rate: The rate never drops below this.
+
+    :param float max_rate: The rate never grows above this.
+
+    :param float increase: Requests/second added to the rate after each
+        successful request, spread out so the rate grows by about this much
+        per second of traffic.
+
+    :param float decrease: Factor the rate is multiplied by when throttled.
+    """
+    def __init__(
+            self,
+            rate=DEFAULT_RATE,
+            burst=None,
+            min_rate=DEFAULT_MIN_RATE,
+            max_rate=DEFAULT_MAX_RATE,
+            increase=1.0,
+            decrease=0.5,
+            ):
+        self.rate = float(rate)
+        # below one token the bucket could never hold enough for a request
+        self.burst = max(1.0, float(burst or rate))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.throttled = 0
+        self._tokens = self.burst
+        self._last = time.time()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._last
+        self._last = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent.
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        """
+        Call after a request went through unthrottled.
+        """
+        with self._lock:
+            # dividing by the rate makes growth ~increase per second
+            self.rate = min(
+                    self.max_rate,
+                    self.rate + self.increase / self.rate,
+                    )
+
+    def on_throttle(self, retry_after=None):
+        """
+        Call after RightScale throttled a request.
+
+        :param float retry_after: Seconds RightScale asked us to wait, if any.
+            Nothing is let through until then.
+        """
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0)
+            if retry_after:
+                self._blocked_until = max(
+                        self._blocked_until,
+                        time.time() + retry_after,
+                        )
@@ -4,9 +4,18 @@ Python-Rightscale
 A stupid wrapper around rightscale's HTTP API
 """
 import types
+from . import tracing
 from .actions import RS_DEFAULT_ACTIONS, COLLECTIONS
 from .httpclient import HTTPClient
-from .util import get_rc_creds, HookList
+from .tokencache import TokenCache
+from .util import (
+        DEFAULT_CONCURRENCY,
+        fan_out,
+        get_rc_creds,
+        get_rc_token_cache_path,
+        HookList,
+        iter_json_array,
+        )
 
 
 # magic strings from the 1.5 api
@@ -26,13 +35,27 @@ HEALTH_CHECK_RES_PATH = '/'.join((DEFAULT_API_PREPATH, 'health-check'))
 
 COLLECTION_TYPE = 'type=collection'
 
+# bytes to read at a time when streaming a collection with iter_index()
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 def get_resource_method(name, template):
     """
     Creates a function that is suitable as a method for ResourceCollection.
     """
     def rsr_meth(self, **kwargs):
+        tracer = tracing.active
+        if tracer is None:
+            return call(self, kwargs)
+        with tracer.action(self, name, kwargs.get('res_id')):
+            return call(self, kwargs)
+
+    def call(self, kwargs):
         http_method = template['http_method']
+        resource_class = self.resource_class
+        compact = kwargs.pop('compact', False)
+        if compact:
+            resource_class = self.compact_class
         extra_path = template.get('extra_path')
         if extra_path:
             fills = {'res_id': kwargs.pop('res_id', '')}
@@ -58,19 +81,122 @@ def get_resource_method(name, template):
             return
 
         if COLLECTION_TYPE in response.content_type:
-            ret = HookList(
-                    [Resource(r, path, response, self.client) for r in obj],
-                    response=response
-                    )
+            resources = resource_class.from_list(
+                    obj, path, response, self.client)
+            # the response holds the raw body and its parsed json, which is
+            # what compact results are meant to let go of
+            ret = HookList(resources, response=None if compact else response)
         else:
-            ret = Resource(obj, path, response, self.client)
+            ret = resource_class(obj, path, response, self.client)
         return ret
 
     rsr_meth.__name__ = name
     return rsr_meth
 
 
-class Resource(object):
+class BaseResource(object):
+    """
+    Behaviour shared by :class:`Resource` and :class:`CompactResource`.
+
+    Subclasses provide :attr:`soul`, :attr:`path`, :attr:`client`,
+    :attr:`content_type`, :attr:`links`, :attr:`collection_actions` and
+    :meth:`_load`.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.soul)
+
+    def __str__(self):
+        return str(self.soul)
+
+    def __cmp__(self, other):
+        return cmp(self.soul, other.soul)
+
+    @classmethod
+    def from_list(cls, souls, path='', response=None, client=None):
+        """
+        Builds one resource per soul in :attr:`souls`, e.g. from the body of
+        an ``index`` response.
+        """
+        return [cls(soul, path, response, client) for soul in souls]
+
+    def _link_index(self):
+        # rel -> href straight from the soul.  callers must not modify it.
+        rel_hrefs = self.soul.get('links', [])
+        return dict((raw['rel'], raw['href']) for raw in rel_hrefs)
+
+    def _get_rel_hrefs(self):
+        return dict(self._link_index())
+
+    @property
+    def href(self):
+        return self._link_index().get('self', '')
+
+    @property
+    def id(self):
+        """
+        The resource id, i.e. the last part of the ``self`` href.
+        """
+        href = self.href
+        if not href:
+            return ''
+        return href.rsplit('/', 1)[-1]
+
+    def _build_links(self):
+        _links = self._get_rel_hrefs()
+        collection_actions = COLLECTIONS.get(self.content_type, {})
+        for name, action in collection_actions.iteritems():
+            if action is None and name in _links:
+                del _links[name]
+                continue
+            if name not in _links:
+                _links[unicode(name)] = unicode(
+                        '%s/%s' % (self.path, name)
+                        )
+        return _links
+
+    def __dir__(self):
+        return self.links.keys()
+
+    def refresh(self):
+        """
+        Re-fetches this resource from its ``self`` href and replaces its soul.
+
+        Cheap when the client was created with ``conditional=True`` and the
+        resource has not changed: RightScale answers ``304 Not Modified`` and
+        the previously downloaded body is reused.
+
+        Returns the resource itself.
+        """
+        href = self.href
+        if not href:
+            raise ValueError('%s has no self href to refresh from' % self)
+        tracer = tracing.active
+        if tracer is None:
+            response = self.client.get(href)
+        else:
+            with tracer.refresh(self):
+                response = self.client.get(href)
+        self._load(response.json(), response)
+        return self
+
+    def __getattr__(self, name):
+        path = self.links.get(name)
+        if not path:
+            raise AttributeError('%s object has no attribute %s' % (
+                self.__class__.__name__,
+                name,
+                ))
+        tpl = self.collection_actions.get(name)
+        collection = self.collection_class.for_actions(tpl)(path, self.client)
+        if tracing.active is not None:
+            # lets the tracer tell which resource and rel this came from
+            collection.origin = (self, name)
+        return collection
+
+
+class Resource(BaseResource):
     """
     A single resource.
 
@@ -94,14 +220,21 @@ class Resource(object):
         self.client = client
         self._links = None
 
-    def __repr__(self):
-        return '%s(%s)' % (self.__class__.__name__, self.soul)
-
-    def __str__(self):
-        return str(self.soul)
+    @property
+    def soul(self):
+        return self._soul
+
+    @soul.setter
+    def soul(self, soul):
+        # links are parsed from the soul once and cached until it's replaced
+        self._soul = soul
+        self._rel_hrefs = None
+        self._links = None
 
-    def __cmp__(self, other):
-        return cmp(self.soul, other.soul)
+    def _link_index(self):
+        if self._rel_hrefs is None:
+            self._rel_hrefs = super(Resource, self)._link_index()
+        return self._rel_hrefs
 
     @property
     def content_type(self):
@@ -109,69 +242,238 @@ class Resource(object):
             return self.response.content_type[0]
         return ''
 
-    def _get_rel_hrefs(self):
-        rel_hrefs = self.soul.get('links', [])
-        return dict((raw['rel'], raw['href']) for raw in rel_hrefs)
+    @property
+    def links(self):
+        # only initialize once, not if empty
+        if self._links is None:
+            self.collection_actions = COLLECTIONS.get(self.content_type, {})
+            self._links = self._build_links()
+        return self._links
+
+    def _load(self, soul, response):
+        self.response = response
+        self.soul = soul
+        self.collection_actions = {}
+        self._links = None
+
+
+_interned = {}
+
+
+def _intern(s):
+    # for the handful of rel names and content types that every resource
+    # repeats.  plain intern() doesn't accept unicode.
+    return _interned.setdefault(s, s)
+
+
+class CompactResource(BaseResource):
+    """
+    Memory-lean alternative to :class:`Resource`.
+
+    Behaves the same for navigation, but has no ``__dict__``, keeps only the
+    content type of the response it came from (not the response itself, and
+    therefore not the raw body), and stores its links as a tuple of
+    ``(rel, href)`` pairs instead of inside :attr:`soul`.  Strings shared by
+    many resources from the same response are stored once.
+
+    Get these by passing ``compact=True`` to an action method, e.g.
+    ``api.clouds.index(compact=True)``.
+
+    :attr:`links` is rebuilt on every access, so changes to it don't stick.
+    """
+    __slots__ = ('_soul', 'path', 'client', 'content_type', 'link_pairs')
+
+    def __init__(self, soul=None, path='', response=None, client=None,
+                 _strings=None):
+        self.path = path
+        self.client = client
+        self._set_soul(soul, response, {} if _strings is None else _strings)
+
+    @classmethod
+    def from_list(cls, souls, path='', response=None, client=None):
+        strings = {}
+        return [cls(s, path, response, client, strings) for s in souls]
+
+    def _set_soul(self, soul, response, strings):
+        soul = dict(soul or {})
+        pairs = []
+        for raw in soul.pop('links', ()):
+            href = strings.setdefault(raw['href'], raw['href'])
+            pairs.append((_intern(raw['rel']), href))
+        self._soul = soul
+        self.link_pairs = tuple(pairs)
+        content_type = ''
+        if response is not None:
+            content_type = response.content_type[0]
+        self.content_type = _intern(content_type)
+
+    @property
+    def soul(self):
+        return self._soul
+
+    def _link_index(self):
+        return dict(self.link_pairs)
+
+    # _link_index() already builds a fresh dict every time
+    _get_rel_hrefs = _link_index
 
     @property
     def href(self):
-        return self._get_rel_hrefs().get('self', '')
+        for rel, href in self.link_pairs:
+            if rel == 'self':
+                return href
+        return ''
+
+    @property
+    def collection_actions(self):
+        return COLLECTIONS.get(self.content_type, {})
 
     @property
     def links(self):
-        # only initialize once, not if empty
-        if self._links is None:
-            _links = self._get_rel_hrefs()
-
-            collection_actions = COLLECTIONS.get(self.content_type, {})
-            self.collection_actions = collection_actions
-            for name, action in collection_actions.iteritems():
-                if action is None and name in _links:
-                    del _links[name]
-                    continue
-                if name not in _links:
-                    _links[unicode(name)] = unicode(
-                            '%s/%s' % (self.path, name)
-                            )
-
-            self._links = _links
-        return self._links
+        return self._build_links()
 
-    def __dir__(self):
-        return self.links.keys()
+    def _load(self, soul, response):
+        self._set_soul(soul, response, {})
 
-    def __getattr__(self, name):
-        path = self.links.get(name)
-        if not path:
-            raise AttributeError('%s object has no attribute %s' % (
-                self.__class__.__name__,
-                name,
-                ))
-        actions = RS_DEFAULT_ACTIONS.copy()
-        tpl = self.collection_actions.get(name)
-        if tpl:
-            actions.update(tpl)
-        return ResourceCollection(path, self.client, actions)
+
+# (collection class, id of action overrides) -> (overrides, subclass)
+_collection_classes = {}
 
 
 class ResourceCollection(object):
-    def __init__(self, path, client, actions):
+    """
+    A collection of resources, e.g. ``/api/clouds``.
+
+    Action methods (``index``, ``show``, ...) come from an action table.  Use
+    :meth:`for_actions` to get a class with the methods for a given table
+    already defined on it.  Passing :attr:`actions` to the constructor instead
+    binds them onto just this instance.
+    """
+    resource_class = Resource
+
+    def __init__(self, path, client, actions=None):
         self.path = path
         self.client = client
+        if actions is None:
+            return
         for name, template in actions.items():
             if not template:
                 continue
-            method = get_resource_method(name, template)
+            method = self._make_method(name, template)
             setattr(self, name, types.MethodType(method, self, self.__class__))
 
+    @classmethod
+    def _make_method(cls, name, template):
+        return get_resource_method(name, template)
+
+    @classmethod
+    def for_actions(cls, overrides=None):
+        """
+        Returns a subclass with a method for every action in
+        ``RS_DEFAULT_ACTIONS`` updated with :attr:`overrides` (one of the
+        tables from :mod:`rightscale.actions`).
+
+        Subclasses are built once per table and cached, so getting a
+        collection from a resource is just a lookup plus an instantiation.
+        """
+        key = (cls, id(overrides))
+        entry = _collection_classes.get(key)
+        if entry is None or entry[0] is not overrides:
+            actions = RS_DEFAULT_ACTIONS.copy()
+            if overrides:
+                actions.update(overrides)
+            methods = {}
+            for name, template in actions.items():
+                if template:
+                    methods[name] = cls._make_method(name, template)
+            # keeping a reference to overrides keeps its id from being reused
+            entry = (overrides, type(cls.__name__, (cls,), methods))
+            _collection_classes[key] = entry
+        return entry[1]
+
+    def iter_index(self, chunk_size=STREAM_CHUNK_SIZE, compact=False,
+                   **kwargs):
+        """
+        Lazily lists this collection.
+
+        Like ``index()``, but the response body is streamed and parsed one
+        element at a time, so memory use stays flat even for huge collections
+        (e.g. tens of thousands of instances or audit entries).
+
+        Sample usage::
+
+            params = {'view': 'full'}
+            for instance in cloud.instances.iter_index(params=params):
+                print instance.soul['name']
+
+        :param int chunk_size: Number of bytes to read from the socket at a
+            time.
+
+        :param bool compact: Yield :class:`CompactResource` objects instead.
+
+        :param kwargs: Any other kwargs to pass to :meth:`HTTPClient.request`.
+
+        Yields resources.
+        """
+        resource_class = self.compact_class if compact else self.resource_class
+        response = self.client.request('get', self.path, stream=True, **kwargs)
+        try:
+            for obj in iter_json_array(response.iter_content(chunk_size)):
+                yield resource_class(obj, self.path, response, self.client)
+        finally:
+            response.close()
+
+    def _res_id(self, item):
+        if not isinstance(item, basestring) or not item.startswith('/'):
+            return item
+        prefix = self.path + '/'
+        if not item.startswith(prefix):
+            raise ValueError('%s is not in collection %s' % (item, self.path))
+        return item[len(prefix):]
+
+    def batch(self, action, items, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        """
+        Runs the same action for many resources in this collection using a
+        pool of threads.
+
+        Sample usage::
+
+            outcomes = api.clouds.batch('show', [1, 2, 3])
+            clouds = [o.result for o in outcomes if o.ok]
+
+        :param str action: Name of an action method, e.g. ``show``.
+
+        :param items: Resource ids, or hrefs of resources in this collection.
+
+        :param int concurrency: Max number of requests in flight.
+
+        :param kwargs: Passed along to every action call.
+
+        Returns a list of :class:`rightscale.util.Outcome` in the same order as
+        :attr:`items`.  A failure for one item (e.g. a 404) is recorded in its
+        outcome instead of aborting the batch.
+        """
+        meth = getattr(self, action)
+
+        def run(item):
+            return meth(res_id=self._res_id(item), **kwargs)
+
+        return fan_out(run, items, concurrency)
+
+
+BaseResource.collection_class = ResourceCollection
+ResourceCollection.compact_class = CompactResource
+
 
 class RightScale(Resource):
+    client_class = HTTPClient
 
     def __init__(
             self,
             path=DEFAULT_API_PREPATH,
             refresh_token=None,
             api_endpoint=None,
+            **client_kwargs
             ):
         """
         Creates and configures the API object.
@@ -181,6 +483,8 @@ class RightScale(Resource):
             requests.
         :param str path: The path portion of the URL.
             E.g. ``/api``.
+        :param client_kwargs: Extra options for the underlying
+            :class:`rightscale.httpclient.HTTPClient`, e.g. ``keepalive=True``.
         """
         super(RightScale, self).__init__({}, path)
         self.auth_token = None
@@ -200,11 +504,17 @@ class RightScale(Resource):
         if not refresh_token:
             raise ValueError("Can't login. Need refresh token!")
 
-        self.client = HTTPClient(
+        if 'token_cache' not in client_kwargs:
+            token_cache_path = get_rc_token_cache_path()
+            if token_cache_path:
+                client_kwargs['token_cache'] = TokenCache(token_cache_path)
+
+        self.client = self.client_class(
                 api_endpoint,
                 {'X-API-Version': '1.5'},
                 OAUTH2_RES_PATH,
                 refresh_token,
+                **client_kwargs
                 )
 
     def health_check(self):
@@ -0,0 +1,376 @@
+"""
+Tracking many running tasks at once.
+
+Launching a RightScript (``run_executable``, ``multi_run_executable``, ...)
+returns the href of a task in the ``location`` header.  A :class:`TaskWatcher`
+polls any number of those from a single scheduler thread: each task is polled
+quickly at first and less often the longer it runs, until it finishes or hits
+its deadline::
+
+    from rightscale.tasks import TaskWatcher
+    watcher = TaskWatcher(api.client)
+    futures = [watcher.watch(loc, timeout=600) for loc in locations]
+    for f in futures:
+        print f.result()['summary']
+"""
+from collections import namedtuple
+import heapq
+import itertools
+import logging
+import re
+import sys
+import threading
+import time
+
+from .util import DEFAULT_CONCURRENCY, iter_fan_out
+
+
+log = logging.getLogger(__name__)
+
+# task summaries start with one of these once the task is over
+DONE_STATES = ('completed', 'failed', 'aborted', 'canceled')
+
+# /api/clouds/1/instances/ABC/live/tasks/ae-123 -> /api/clouds/1/instances/ABC
+INSTANCE_TASK_RE = re.compile(r'^(.*/instances/[^/]+)/live/tasks/')
+
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MAX_INTERVAL = 30.0
+DEFAULT_BACKOFF = 1.5
+
+# a task is given up on after this many polls in a row have failed
+DEFAULT_MAX_FAILURES = 3
+
+
+class TaskTimeout(Exception):
+    """
+    Raised by :meth:`TaskFuture.result` for a task that was still running at
+    its deadline.
+    """
+    def __init__(self, location, status=None):
+        super(TaskTimeout, self).__init__(location)
+        self.location = location
+        self.status = status
+
+
+class WatcherClosed(Exception):
+    """
+    Raised by :meth:`TaskFuture.result` for a task that was still being
+    watched when its :class:`TaskWatcher` was closed.
+    """
+    def __init__(self, location):
+        super(WatcherClosed, self).__init__(location)
+        self.location = location
+
+
+def is_done(status):
+    """
+    Whether a task's status says it is over, successfully or not.
+    """
+    summary = status.get('summary', '')
+    return any(summary.startswith(s) for s in DONE_STATES)
+
+
+def succeeded(status):
+    return status.get('summary', '').startswith('completed')
+
+
+def instance_of_task(location):
+    """
+    Returns the href of the instance a task runs on, or ``None`` if
+    :attr:`location` doesn't look like an instance task.
+    """
+    match = INSTANCE_TASK_RE.match(location)
+    if match:
+        return match.group(1)
+
+
+class TaskSummary(namedtuple(
+        'TaskSummary', 'instance name task state summary')):
+    """
+    One row of :func:`summarize`.
+
+    :attr:`state` is the first word of the task summary (``completed``,
+    ``failed``, ...), or ``timeout`` or ``error`` if the task's outcome is
+    unknown.
+    """
+    __slots__ = ()
+
+
+def summarize(future, name=None):
+    """
+    Builds a :class:`TaskSummary` for a finished :class:`TaskFuture`.
+    """
+    instance = instance_of_task(future.location)
+    try:
+        status = future.result(0)
+    except TaskTimeout as e:
+        last = (e.status or {}).get('summary', '')
+        return TaskSummary(instance, name, future.location, 'timeout', last)
+    except Exception as e:
+        return TaskSummary(instance, name, future.location, 'error', str(e))
+    summary = status.get('summary', '')
+    state = summary.split(':', 1)[0].strip()
+    return TaskSummary(instance, name, future.location, state, summary)
+
+
+def format_summaries(rows):
+    """
+    Lays out :class:`TaskSummary` rows as a plain-text table.
+    """
+    headers = ('INSTANCE', 'NAME', 'STATE', 'SUMMARY')
+    table = [headers] + [
+            (r.instance or r.task or '', r.name or '', r.state, r.summary)
+            for r in rows
+            ]
+    widths = [max(len(row[i]) for row in table) for i in range(3)]
+    lines = []
+    for row in table:
+        cells = [c.ljust(w) for c, w in zip(row, widths)] + [row[3]]
+        lines.append('  '.join(cells).rstrip())
+    return '\n'.join(lines) + '\n'
+
+
+class TaskFuture(object):
+    """
+    Eventual outcome of one watched task.
+
+    :attr:`status` always holds the last status seen, even before the task
+    is done.
+    """
+    def __init__(self, location):
+        self.location = location
+        self.status = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._exc_info = None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.location)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Blocks until the task is done and returns its final status.
+
+        Re-raises whatever stopped the task from being watched, e.g.
+        :class:`TaskTimeout`.
+        """
+        # py2 Event.wait() without a timeout can't be interrupted
+        if not self._done.wait(timeout if timeout is not None else 1e9):
+            raise RuntimeError('Still waiting for %s' % self.location)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self.status
+
+    def add_done_callback(self, fn):
+        """
+        Calls ``fn(future)`` once the task is done, straight away if it
+        already is.
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, exc_info=None):
+        with self._lock:
+            self._exc_info = exc_info
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                log.exception('Callback for %s failed', self.location)
+
+
+class _Watch(object):
+    """
+    Scheduling state for one task.
+    """
+    def __init__(self, future, deadline, interval, on_status):
+        self.future = future
+        self.deadline = deadline
+        self.interval = interval
+        self.on_status = on_status
+        self.failures = 0
+
+
+class TaskWatcher(object):
+    """
+    Polls many tasks from one background thread.
+
+    :param rightscale.httpclient.HTTPClient client: Client to poll with.
+
+    :param float min_interval: Seconds between the first few polls of a task.
+
+    :param float max_interval: The interval between polls never grows above
+        this.
+
+    :param float backoff: Factor the interval grows by after each poll of a
+        task that is still running.
+
+    :param int concurrency: Max number of status requests in flight.
+
+    :param int max_failures: A task whose status could not be fetched this
+        many times in a row is given up on, and its future re-raises the last
+        error.
+    """
+    def __init__(
+            self,
+            client,
+            min_interval=DEFAULT_MIN_INTERVAL,
+            max_interval=DEFAULT_MAX_INTERVAL,
+            backoff=DEFAULT_BACKOFF,
+            concurrency=DEFAULT_CONCURRENCY,
+            max_failures=DEFAULT_MAX_FAILURES,
+            ):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.concurrency = concurrency
+        self.max_failures = max_failures
+        self.polls = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def watch(self, location, timeout=None, on_status=None):
+        """
+        Starts watching the task at :attr:`location`.
+
+        :param float timeout: Seconds after which the task is given up on
+            with a :class:`TaskTimeout`.  ``None`` waits forever.
+
+        :param on_status: Called as ``on_status(location, status)`` with
+            every status polled, from the watcher's thread.
+
+        Returns a :class:`TaskFuture`.
+        """
+        now = time.time()
+        deadline = now + timeout if timeout is not None else None
+        future = TaskFuture(location)
+        watch = _Watch(future, deadline, self.min_interval, on_status)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('TaskWatcher is closed')
+            self._push(now, watch)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def close(self):
+        """
+        Stops polling.  Futures of tasks still being watched fail with
+        :class:`WatcherClosed`.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        with self._cond:
+            queue, self._queue = self._queue, []
+        for _, _, watch in queue:
+            try:
+                raise WatcherClosed(watch.future.location)
+            except WatcherClosed:
+                watch.future._finish(sys.exc_info())
+
+    def _push(self, when, watch):
+        heapq.heappush(self._queue, (when, next(self._seq), watch))
+
+    def _due(self):
+        # waits for and pops every watch whose poll time has come
+        with self._cond:
+            while not self._closed:
+                now = time.time()
+                if self._queue and self._queue[0][0] <= now:
+                    due = []
+                    while self._queue and self._queue[0][0] <= now:
+                        due.append(heapq.heappop(self._queue)[2])
+                    return due
+                wait = self._queue[0][0] - now if self._queue else None
+                self._cond.wait(wait)
+            return None
+
+    def _poll(self, watch):
+        return self.client.get(watch.future.location).json()
+
+    def _run(self):
+        while True:
+            due = self._due()
+            if due is None:
+                return
+            self.polls += len(due)
+            outcomes = iter_fan_out(
+                    self._poll, due, self.concurrency, ordered=False)
+            for outcome in outcomes:
+                try:
+                    self._handle(outcome)
+                except Exception:
+                    # e.g. a status that isn't a dict.  don't let one task
+                    # take the thread, and everyone waiting on it, down.
+                    log.exception(
+                            'Could not handle %s', outcome.item.future)
+                    outcome.item.future._finish(sys.exc_info())
+
+    def _handle(self, outcome):
+        watch = outcome.item
+        future = watch.future
+        if outcome.ok:
+            watch.failures = 0
+            future.status = outcome.result
+            if watch.on_status:
+                try:
+                    watch.on_status(future.location, future.status)
+                except Exception:
+                    log.exception('on_status for %s failed', future.location)
+            if is_done(future.status):
+                future._finish()
+                return
+        else:
+            watch.failures += 1
+            if watch.failures >= self.max_failures:
+                future._finish(outcome.exc_info)
+                return
+            # keep going; the next poll may well work
+            log.warning(
+                    'Could not poll %s: %s', future.location, outcome.error)
+
+        now = time.time()
+        if watch.deadline is not None and now >= watch.deadline:
+            try:
+                raise TaskTimeout(future.location, future.status)
+            except TaskTimeout:
+                future._finish(sys.exc_info())
+            return
+
+        when = now + watch.interval
+        if watch.deadline is not None:
+            # one last look right at the deadline
+            when = min(when, watch.deadline)
+        watch.interval = min(
+                self.max_interval,
+                watch.interval * self.backoff,
+                )
+        with self._cond:
+            self._push(when, watch)
+
+
+def wait_tasks(futures, timeout=None):
+    """
+    Blocks until every :class:`TaskFuture` is done and returns their final
+    statuses in order.  The first failure is re-raised.
+    """
+    return [f.result(timeout) for f in futures]
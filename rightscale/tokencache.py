@@ -0,0 +1,117 @@
+"""
+On-disk cache of OAuth access tokens.
+
+Short-lived scripts each create a new :class:`rightscale.RightScale` and have
+to log in before their first real request.  Sharing a :class:`TokenCache`
+lets them reuse an access token that another process already got::
+
+    from rightscale.tokencache import TokenCache
+    api = RightScale(token_cache=TokenCache())
+
+or add ``token_cache = ~/.rightscale_tokens`` to the ``OAuth`` section of
+``~/.rightscalerc``.
+
+The cache file only ever holds access tokens, keyed by a hash of the API
+endpoint and refresh token, and is readable by its owner only.
+"""
+from contextlib import contextmanager
+import hashlib
+import json
+import logging
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # no flock on this platform.  concurrent logins are merely wasteful.
+    fcntl = None
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_CACHE_PATH = os.path.join('~', '.rightscale_tokens')
+
+FILE_MODE = 0600
+
+
+class TokenCache(object):
+    """
+    Access tokens stored in a JSON file shared between processes.
+
+    :param str path: Location of the cache file.  A ``.lock`` file is created
+        next to it.
+    """
+    def __init__(self, path=DEFAULT_TOKEN_CACHE_PATH):
+        self.path = os.path.expanduser(path)
+        self.lock_path = self.path + '.lock'
+
+    @staticmethod
+    def key(endpoint, refresh_token):
+        return hashlib.sha256(
+                '%s\0%s' % (endpoint, refresh_token)
+                ).hexdigest()
+
+    @contextmanager
+    def lock(self):
+        """
+        Holds an exclusive lock on the cache across processes.
+
+        If the lock file can't be opened (e.g. its directory doesn't exist),
+        this doesn't lock anything; reads and writes of the cache then fail
+        quietly too, so callers carry on as if there were no cache.
+        """
+        try:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, FILE_MODE)
+        except (IOError, OSError) as e:
+            log.warning('Could not lock token cache %s: %s', self.lock_path, e)
+            fd = None
+        try:
+            if fd is not None and fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, tokens):
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, FILE_MODE)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tokens, f)
+        os.rename(tmp, self.path)
+
+    def get(self, key, min_ttl=0):
+        """
+        Returns ``(access_token, expires_at)`` for :attr:`key` if the token is
+        good for at least :attr:`min_ttl` more seconds, else ``None``.
+        """
+        entry = self._read().get(key)
+        if not entry:
+            return None
+        if entry['expires_at'] - time.time() <= min_ttl:
+            return None
+        return entry['access_token'], entry['expires_at']
+
+    def put(self, key, access_token, expires_at):
+        """
+        Stores a token, dropping any entries that have already expired.
+        Call this while holding :meth:`lock`.
+        """
+        now = time.time()
+        tokens = dict(
+                (k, v) for k, v in self._read().items()
+                if v.get('expires_at', 0) > now
+                )
+        tokens[key] = {'access_token': access_token, 'expires_at': expires_at}
+        try:
+            self._write(tokens)
+        except (IOError, OSError) as e:
+            log.warning('Could not write token cache %s: %s', self.path, e)
@@ -0,0 +1,342 @@
+"""
+Traversal tracing.
+
+Following links one resource at a time is easy to write and easy to get
+wrong: ``for s in api.servers.index(): s.alerts.index()`` makes one request
+per server.  A :class:`Tracer` records every action call (``index``,
+``show``, ``refresh``, ...) together with the resource and link rel it was
+reached through, and every HTTP request made underneath it, as a tree of
+spans::
+
+    from rightscale.tracing import Tracer
+    with Tracer(api) as tracer:
+        for server in api.servers.index():
+            server.alerts.index()
+    tracer.save('trace.json', format='chrome')
+
+When the same action is run through the same rel for many different items of
+one collection, a :class:`NPlusOneWarning` is issued once, suggesting a way
+to make fewer requests.  :attr:`Tracer.findings` lists them all.
+
+Chrome traces open in ``chrome://tracing`` or https://ui.perfetto.dev as
+flame graphs.
+"""
+from collections import namedtuple
+import json
+import threading
+import time
+import warnings
+
+from .metrics import path_template
+
+
+DEFAULT_THRESHOLD = 5
+
+# the tracer currently recording, if any.  checked on every action call, so
+# it's a plain module global.
+active = None
+
+
+class NPlusOneWarning(UserWarning):
+    """
+    Issued when a traversal makes one request per item of a collection.
+    """
+
+
+Finding = namedtuple(
+        'Finding', 'collection rel action count suggestion')
+
+
+def _suggestion(collection, rel, action):
+    if action == 'refresh':
+        return ('list %s once with index() instead of refreshing each of '
+                'its resources' % collection)
+    if rel is None:
+        return ('get them in one index() of %s with a filter[] (or '
+                'view=extended), or at least run them concurrently with '
+                "%s.batch('%s', ids)" % (collection, collection, action))
+    return ('list %s once from its own collection with a filter[] on the '
+            "parent, use a view that embeds it, or at least run the calls "
+            'concurrently with rightscale.util.fan_out()' % rel)
+
+
+def _collection_of(href):
+    # /api/clouds/1 -> /api/clouds
+    return href.rsplit('/', 1)[0]
+
+
+class Span(object):
+    """
+    One timed step of a traversal.
+
+    :attr:`kind` is ``action`` for an action method call and ``http`` for an
+    HTTP request.  :attr:`attrs` holds the details: for actions the
+    ``collection`` path, ``action``, ``rel`` and ``parent`` href, for
+    requests the ``method``, ``url``, ``status`` and ``attempt``.
+    """
+    __slots__ = (
+            'name', 'kind', 'attrs', 'start', 'end', 'thread', 'children')
+
+    def __init__(self, name, kind, attrs):
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs
+        self.start = time.time()
+        self.end = None
+        self.thread = threading.current_thread().ident
+        self.children = []
+
+    @property
+    def duration(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def to_dict(self, origin=0):
+        return {
+                'name': self.name,
+                'kind': self.kind,
+                'attrs': self.attrs,
+                'start': round(self.start - origin, 6),
+                'duration': round(self.duration or 0, 6),
+                'thread': self.thread,
+                'children': [c.to_dict(origin) for c in self.children],
+                }
+
+
+class _Action(object):
+    """
+    Context manager that times one action span on its tracer.
+    """
+    def __init__(self, tracer, span, key, item):
+        self.tracer = tracer
+        self.span = span
+        self.key = key
+        self.item = item
+
+    def __enter__(self):
+        self.tracer._push(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.span.attrs['error'] = repr(exc)
+        self.tracer._pop(self.span)
+        self.tracer._count(self.key, self.item)
+
+
+class Tracer(object):
+    """
+    Records traversals made through :attr:`api` while active, i.e. inside a
+    ``with`` block or between :meth:`start` and :meth:`stop`.
+
+    :param api: A :class:`rightscale.RightScale` instance or an
+        :class:`rightscale.httpclient.HTTPClient`.
+
+    :param int threshold: Number of distinct items the same action has to be
+        run for, under the same collection and rel, before it is reported as
+        an N+1 pattern.
+
+    Spans made on other threads (e.g. by ``batch()``) become roots of their
+    own, tagged with their thread id.
+    """
+    def __init__(self, api, threshold=DEFAULT_THRESHOLD):
+        self.client = getattr(api, 'client', api)
+        self.threshold = threshold
+        self.roots = []
+        self.findings = []
+        self.started = None
+        self._items = {}
+        self._reported = set()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        global active
+        if active is not None and active is not self:
+            raise RuntimeError('Another tracer is already active')
+        self.started = time.time()
+        self.client.pre_request_hooks.append(self._before_request)
+        self.client.post_request_hooks.append(self._after_request)
+        active = self
+        return self
+
+    def stop(self):
+        global active
+        if active is self:
+            active = None
+        self.client.pre_request_hooks.remove(self._before_request)
+        self.client.post_request_hooks.remove(self._after_request)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, span):
+        stack = self._stack()
+        if stack:
+            stack[-1].children.append(span)
+        else:
+            with self._lock:
+                self.roots.append(span)
+        stack.append(span)
+
+    def _pop(self, span):
+        span.end = time.time()
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+
+    def action(self, collection, name, res_id=None):
+        """
+        Returns a context manager timing the action :attr:`name` run on
+        :attr:`collection` (a :class:`ResourceCollection`).
+        """
+        resource, rel = getattr(collection, 'origin', None) or (None, None)
+        parent = None
+        key = item = None
+        if resource is not None:
+            parent = resource.href or resource.path
+        if res_id is not None:
+            key = (collection.path, None, name)
+            item = res_id
+        elif resource is not None and resource.href:
+            key = (_collection_of(resource.href), rel, name)
+            item = resource.href
+        span = Span(
+                '%s %s' % (name, path_template(collection.path)),
+                'action',
+                {
+                    'collection': collection.path,
+                    'action': name,
+                    'rel': rel,
+                    'parent': parent,
+                    })
+        return _Action(self, span, key, item)
+
+    def refresh(self, resource):
+        """
+        Returns a context manager timing ``resource.refresh()``.
+        """
+        span = Span(
+                'refresh %s' % path_template(resource.href),
+                'action',
+                {
+                    'collection': _collection_of(resource.href),
+                    'action': 'refresh',
+                    'rel': 'self',
+                    'parent': resource.href,
+                    })
+        key = (_collection_of(resource.href), 'self', 'refresh')
+        return _Action(self, span, key, resource.href)
+
+    def _count(self, key, item):
+        if key is None:
+            return
+        with self._lock:
+            items = self._items.setdefault(key, set())
+            items.add(item)
+            if len(items) < self.threshold or key in self._reported:
+                return
+            self._reported.add(key)
+            collection, rel, action = key
+            finding = Finding(
+                    collection, rel, action, len(items),
+                    _suggestion(collection, rel, action))
+            self.findings.append(finding)
+        warnings.warn(self._message(finding), NPlusOneWarning, stacklevel=4)
+
+    def _message(self, finding):
+        if finding.rel in (None, 'self'):
+            what = '%s() on items of %s' % (
+                    finding.action, finding.collection)
+        else:
+            what = '%s() on %s of items of %s' % (
+                    finding.action, finding.rel, finding.collection)
+        return '%s made one request per item (%d so far): %s' % (
+                what, finding.count, finding.suggestion)
+
+    def _before_request(self, event):
+        span = Span(
+                '%s %s' % (event.method.upper(), path_template(event.url)),
+                'http',
+                {
+                    'method': event.method.upper(),
+                    'url': event.url,
+                    'attempt': event.attempt,
+                    'login': event.login,
+                    })
+        event.span = span
+        self._push(span)
+
+    def _after_request(self, event):
+        span = getattr(event, 'span', None)
+        if span is None:
+            return
+        if event.response is not None:
+            span.attrs['status'] = event.response.status_code
+        else:
+            span.attrs['error'] = repr(event.error)
+        self._pop(span)
+
+    def spans(self):
+        """
+        Yields every recorded span, depth first.
+        """
+        stack = list(reversed(self.roots))
+        while stack:
+            span = stack.pop()
+            yield span
+            stack.extend(reversed(span.children))
+
+    def to_json(self):
+        """
+        Returns the trace as a JSON-friendly dict: the span tree (with start
+        times relative to :meth:`start`) and the findings.
+        """
+        origin = self.started or 0
+        return {
+                'spans': [s.to_dict(origin) for s in self.roots],
+                'findings': [f._asdict() for f in self.findings],
+                }
+
+    def to_chrome(self):
+        """
+        Returns the trace in the Chrome trace event format.
+        """
+        origin = self.started or 0
+        events = []
+        for span in self.spans():
+            events.append({
+                    'name': span.name,
+                    'cat': span.kind,
+                    'ph': 'X',
+                    'ts': int((span.start - origin) * 1e6),
+                    'dur': int((span.duration or 0) * 1e6),
+                    'pid': 1,
+                    'tid': span.thread,
+                    'args': span.attrs,
+                    })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path, format='json'):
+        """
+        Writes the trace to :attr:`path` as ``json`` (see :meth:`to_json`) or
+        ``chrome`` (see :meth:`to_chrome`).
+        """
+        if format == 'json':
+            data = self.to_json()
+        elif format == 'chrome':
+            data = self.to_chrome()
+        else:
+            raise ValueError('Unknown trace format %r' % format)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1)
@@ -0,0 +1,283 @@
+"""
+Record and replay of HTTP traffic.
+
+Both classes here are ``requests`` transport adapters that slot in under
+:meth:`rightscale.httpclient.HTTPClient._request`, so everything above them
+(logins, retries, caching, parsing, resource building) runs as usual.
+
+Record a real workload::
+
+    from rightscale.transport import RecordingAdapter
+    api = RightScale(transport=RecordingAdapter('trace.jsonl.gz'))
+    list_instances(cloud_name=None)
+
+and replay it later, offline, as fast as possible or at recorded speed::
+
+    from rightscale.transport import ReplayAdapter
+    api = RightScale(transport=ReplayAdapter('trace.jsonl.gz', speed=1.0))
+
+Traces are JSON lines, gzipped if the file name ends in ``.gz``.  They never
+contain the ``Authorization`` header, cookies, the refresh token or access
+tokens.
+"""
+from collections import deque
+from datetime import timedelta
+import base64
+import gzip
+import json
+import threading
+import time
+import urllib
+import urlparse
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import RequestException
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+REDACTED = 'REDACTED'
+
+# never written to a trace
+REDACTED_HEADERS = ('authorization', 'cookie')
+DROPPED_HEADERS = ('set-cookie',)
+SECRET_FIELDS = ('refresh_token', 'access_token')
+
+
+class ReplayMiss(RequestException):
+    """
+    Raised when a replayed client makes a request the trace has no answer
+    for.
+    """
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def normalize_url(url):
+    """
+    Reduces a URL to its path and sorted query string, so a trace replays
+    against any endpoint and regardless of parameter order.
+    """
+    parts = urlparse.urlsplit(url)
+    query = urlparse.parse_qsl(parts.query, keep_blank_values=True)
+    if not query:
+        return parts.path
+    return parts.path + '?' + urllib.urlencode(sorted(query))
+
+
+def _redact_headers(headers):
+    return dict(
+            (k, REDACTED if k.lower() in REDACTED_HEADERS else v)
+            for k, v in headers.items()
+            if k.lower() not in DROPPED_HEADERS
+            )
+
+
+def _redact_form(body):
+    fields = urlparse.parse_qsl(body, keep_blank_values=True)
+    if not any(k in SECRET_FIELDS for k, _ in fields):
+        return body
+    return urllib.urlencode([
+            (k, REDACTED if k in SECRET_FIELDS else v) for k, v in fields])
+
+
+def _redact_json(body):
+    if not any(f in body for f in SECRET_FIELDS):
+        return body
+    try:
+        obj = json.loads(body)
+    except ValueError:
+        return body
+    if not isinstance(obj, dict):
+        return body
+    for field in SECRET_FIELDS:
+        if field in obj:
+            obj[field] = REDACTED
+    return json.dumps(obj)
+
+
+def _encode_body(body):
+    """
+    Returns ``(text, is_base64)`` for storing :attr:`body` in JSON.
+    """
+    if body is None:
+        return None, False
+    if isinstance(body, unicode):
+        return body, False
+    try:
+        return body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        return base64.b64encode(body), True
+
+
+def _decode_body(text, is_base64):
+    if text is None:
+        return ''
+    if is_base64:
+        return base64.b64decode(text)
+    return text.encode('utf-8')
+
+
+class RecordingAdapter(BaseAdapter):
+    """
+    Sends requests through another adapter and appends each exchange to a
+    trace file.
+
+    :param str path: Where to write the trace.  Appended to if it exists.
+
+    :param requests.adapters.BaseAdapter adapter: The adapter that actually
+        talks to the network.  :class:`rightscale.httpclient.HTTPClient` fills
+        this in with the one it would have used anyway.
+    """
+    def __init__(self, path, adapter=None):
+        super(RecordingAdapter, self).__init__()
+        self.path = path
+        self.adapter = adapter
+        self.started = time.time()
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = _open(path, 'ab')
+
+    def send(self, request, **kwargs):
+        adapter = self.adapter
+        if adapter is None:
+            with self._lock:
+                if self.adapter is None:
+                    self.adapter = HTTPAdapter()
+                adapter = self.adapter
+        sent_at = time.time()
+        response = adapter.send(request, **kwargs)
+        # read streamed bodies now; iter_content replays them from memory
+        content = response.content
+        elapsed = time.time() - sent_at
+        self.record(request, response, content, sent_at, elapsed)
+        return response
+
+    def record(self, request, response, content, sent_at, elapsed):
+        req_body = request.body
+        if isinstance(req_body, basestring):
+            req_body = _redact_form(req_body)
+        else:
+            req_body = None
+        resp_body, is_base64 = _encode_body(content)
+        if resp_body is not None and not is_base64:
+            resp_body = _redact_json(resp_body)
+        entry = {
+                't': round(sent_at - self.started, 6),
+                'elapsed': round(elapsed, 6),
+                'method': request.method,
+                'url': normalize_url(request.url),
+                'request_headers': _redact_headers(request.headers),
+                'request_body': _encode_body(req_body)[0],
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': _redact_headers(response.headers),
+                'body': resp_body,
+                'base64': is_base64,
+                }
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        if self.adapter is not None:
+            self.adapter.close()
+
+
+def load_trace(path):
+    """
+    Returns the entries of a trace file as a list of dicts.
+    """
+    with _open(path, 'rb') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Answers requests from a trace instead of the network.
+
+    Requests are matched on method and normalized URL.  Repeated requests
+    for the same URL get the recorded responses in recorded order.
+
+    :param str path: The trace to replay.
+
+    :param float speed: ``None`` answers immediately.  Otherwise the trace
+        is replayed on its recorded timeline, scaled by :attr:`speed` so
+        ``1.0`` is recorded speed and ``2.0`` twice as fast: no response is
+        given before its request's recorded offset from the first request
+        has passed since the first replayed request, and each one then takes
+        its recorded latency.  Requests made later than that (e.g. once
+        :attr:`cycle` starts over) only get the latency.
+
+    :param bool cycle: Once every recorded response for a request has been
+        served, start over from the first one instead of raising
+        :class:`ReplayMiss`.  Handy for running a short trace as a long load
+        test.
+    """
+    def __init__(self, path, speed=None, cycle=True):
+        super(ReplayAdapter, self).__init__()
+        self.path = path
+        self.speed = speed
+        self.cycle = cycle
+        self.served = 0
+        self.started = None
+        self._lock = threading.Lock()
+        self._entries = {}
+        trace = load_trace(path)
+        for entry in trace:
+            key = (entry['method'].upper(), entry['url'])
+            self._entries.setdefault(key, []).append(entry)
+        # offsets are from when the recorder was created, not the first request
+        self._first_t = min([e['t'] for e in trace] or [0])
+        self._queues = dict(
+                (k, deque(v)) for k, v in self._entries.items())
+
+    def _next(self, method, url):
+        key = (method.upper(), normalize_url(url))
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue and self.cycle and key in self._entries:
+                queue = self._queues[key] = deque(self._entries[key])
+            if not queue:
+                raise ReplayMiss('No recorded response for %s %s' % key)
+            self.served += 1
+            return queue.popleft()
+
+    def _delay(self, entry):
+        now = time.time()
+        with self._lock:
+            if self.started is None:
+                self.started = now
+        offset = (entry['t'] - self._first_t) / self.speed
+        wait = max(self.started + offset - now, 0)
+        return wait + entry['elapsed'] / self.speed
+
+    def send(self, request, **kwargs):
+        entry = self._next(request.method, request.url)
+        if self.speed:
+            time.sleep(self._delay(entry))
+
+        response = Response()
+        response.status_code = entry['status']
+        response.reason = entry.get('reason')
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = _decode_body(entry['body'], entry['base64'])
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(seconds=entry['elapsed'])
+        return response
+
+    def close(self):
+        pass
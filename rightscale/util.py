@@ -1,10 +1,37 @@
+import bisect
+import json
 import os.path
+import sys
+import threading
+import time
+import weakref
 import ConfigParser
+import Queue
 
 CFG_USER_RC = '.rightscalerc'
 CFG_SECTION_OAUTH = 'OAuth'
 CFG_OPTION_ENDPOINT = 'api_endpoint'
 CFG_OPTION_REF_TOKEN = 'refresh_token'
+CFG_OPTION_TOKEN_CACHE = 'token_cache'
+
+DEFAULT_CONCURRENCY = 8
+
+_JSON_WHITESPACE = ' \t\n\r'
+
+# what may follow a complete number or literal inside an array
+_JSON_VALUE_END = _JSON_WHITESPACE + ',]'
+
+# find_by_names() does one filtered index call per name up to this many names,
+# and lists the whole collection once for more than that.
+MAX_NAME_FILTERS = 10
+
+# shortest common name prefix worth filtering on instead of one call per name
+MIN_FILTER_PREFIX = 3
+
+# client -> {collection path: (built at, NameIndex)}.  weak, so an index goes
+# away with its client and is never handed to another one.
+_name_indexes = weakref.WeakKeyDictionary()
+_name_indexes_lock = threading.Lock()
 
 _config = None
 
@@ -20,6 +47,216 @@ class HookDict(dict):
     pass
 
 
+class Outcome(object):
+    """
+    Result of running one item through :func:`fan_out`.
+
+    Exactly one of :attr:`result` or :attr:`error` is meaningful, depending on
+    :attr:`ok`.  :attr:`exc_info` keeps the traceback around for re-raising.
+    :attr:`elapsed` is how many seconds the call took, when known.
+    """
+    def __init__(self, item, result=None, exc_info=None, elapsed=None):
+        self.item = item
+        self.result = result
+        self.exc_info = exc_info
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        if self.ok:
+            return '%s(%r, result=%r)' % (
+                    self.__class__.__name__, self.item, self.result)
+        return '%s(%r, error=%r)' % (
+                self.__class__.__name__, self.item, self.error)
+
+    @property
+    def ok(self):
+        return self.exc_info is None
+
+    @property
+    def error(self):
+        if self.exc_info:
+            return self.exc_info[1]
+
+    def get(self):
+        """
+        Returns the result or re-raises the error.
+        """
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+def _run_one(func, item):
+    start = time.time()
+    try:
+        result = func(item)
+    except Exception:
+        return Outcome(
+                item,
+                exc_info=sys.exc_info(),
+                elapsed=time.time() - start,
+                )
+    return Outcome(item, result, elapsed=time.time() - start)
+
+
+def iter_fan_out(func, items, concurrency=DEFAULT_CONCURRENCY, ordered=True):
+    """
+    Calls ``func(item)`` for every item on a pool of at most
+    :attr:`concurrency` threads and yields :class:`Outcome` objects.
+
+    :param bool ordered: Yield outcomes in the same order as :attr:`items`.
+        Otherwise they are yielded as soon as each one finishes.
+
+    An exception raised for one item is captured in its outcome and does not
+    stop the others.
+    """
+    items = list(items)
+    if len(items) < 2 or concurrency < 2:
+        for item in items:
+            yield _run_one(func, item)
+        return
+
+    # plain threads rather than a ThreadPool, which takes ~0.1s to shut down
+    todo = Queue.Queue()
+    for pair in enumerate(items):
+        todo.put(pair)
+    done = Queue.Queue()
+    stop = threading.Event()
+
+    def work():
+        while not stop.is_set():
+            try:
+                i, item = todo.get_nowait()
+            except Queue.Empty:
+                return
+            done.put((i, _run_one(func, item)))
+
+    for _ in range(min(concurrency, len(items))):
+        t = threading.Thread(target=work)
+        t.daemon = True
+        t.start()
+
+    try:
+        finished = {}
+        next_i = 0
+        for _ in items:
+            i, outcome = done.get()
+            if not ordered:
+                yield outcome
+                continue
+            finished[i] = outcome
+            while next_i in finished:
+                yield finished.pop(next_i)
+                next_i += 1
+    finally:
+        # if the caller stops early, don't start on anything else
+        stop.set()
+
+
+def fan_out(func, items, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Same as :func:`iter_fan_out`, but returns the list of outcomes in the
+    order of :attr:`items`.
+    """
+    return list(iter_fan_out(func, items, concurrency))
+
+
+def index_by_href(resources):
+    """
+    Returns a dict mapping each resource's ``self`` href to the resource.
+    Resources without an href are left out.
+    """
+    index = {}
+    for res in resources:
+        href = res.href
+        if href:
+            index[href] = res
+    return index
+
+
+def _read_more(chunks, tail):
+    """
+    Returns :attr:`tail` plus enough chunks to at least double it, so that an
+    element split into many small chunks isn't parsed again for every one of
+    them.  Returns ``None`` if :attr:`chunks` is already exhausted.
+    """
+    parts = [tail]
+    size = len(tail)
+    while size < 2 * len(tail):
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        parts.append(chunk)
+        size += len(chunk)
+    if len(parts) == 1:
+        return None
+    return ''.join(parts)
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally parses a JSON array and yields its elements one at a time.
+
+    :param chunks: Iterable of strings that together make up the JSON text,
+        e.g. :meth:`requests.Response.iter_content`.
+
+    Only the element currently being parsed (plus up to as much again, while
+    it is split across chunks) is held in memory, no matter how long the
+    array is.  Raises ``ValueError`` if the text is not a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    expect = '['
+    while True:
+        while pos < len(buf) and buf[pos] in _JSON_WHITESPACE:
+            pos += 1
+        if pos >= len(buf):
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('Unexpected end of JSON array')
+            buf, pos = chunk, 0
+            continue
+
+        c = buf[pos]
+        if expect == '[':
+            if c != '[':
+                raise ValueError('Expected a JSON array')
+            pos += 1
+            expect = 'first'
+        elif expect == 'sep':
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError('Expected , or ] at %r' % buf[pos:pos + 20])
+            pos += 1
+            expect = 'value'
+        elif c == ']' and expect == 'first':
+            return
+        else:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # most likely the element continues in the next chunks
+                more = _read_more(chunks, buf[pos:])
+                if more is None:
+                    raise
+                buf, pos = more, 0
+                continue
+            if (not isinstance(obj, (dict, list, basestring))
+                    and (end == len(buf) or buf[end] not in _JSON_VALUE_END)):
+                # a number cut off mid-way, e.g. '1.' of '1.5', decodes
+                # fine.  only trust it once we see what comes after it.
+                more = _read_more(chunks, buf[pos:])
+                if more is not None:
+                    buf, pos = more, 0
+                    continue
+            pos = end
+            expect = 'sep'
+            yield obj
+
+
 def get_config():
     global _config
     if not _config:
@@ -30,6 +267,7 @@ def get_config():
         _config.add_section(CFG_SECTION_OAUTH)
         _config.set(CFG_SECTION_OAUTH, CFG_OPTION_ENDPOINT, '')
         _config.set(CFG_SECTION_OAUTH, CFG_OPTION_REF_TOKEN, '')
+        _config.set(CFG_SECTION_OAUTH, CFG_OPTION_TOKEN_CACHE, '')
 
         home = os.path.expanduser('~')
         rc_file = os.path.join(home, CFG_USER_RC)
@@ -54,6 +292,19 @@ def get_rc_creds():
         return ('', '')
 
 
+def get_rc_token_cache_path():
+    """
+    Reads the optional token cache location from ~/.rightscalerc.
+
+    Returns an empty string if it isn't set.
+    """
+    config = get_config()
+    try:
+        return config.get(CFG_SECTION_OAUTH, CFG_OPTION_TOKEN_CACHE)
+    except:
+        return ''
+
+
 def find_by_name(collection, name, exact=True):
     """
     Searches collection by resource name.
@@ -81,3 +332,149 @@ def find_by_name(collection, name, exact=True):
     for f in found:
         if f.soul['name'] == name:
             return f
+
+
+class NameIndex(object):
+    """
+    Resources indexed by their ``name``.
+
+    Exact lookups are a dict lookup, prefix lookups a binary search over the
+    sorted names.
+    """
+    def __init__(self, resources):
+        self._by_name = {}
+        for res in resources:
+            name = res.soul.get('name')
+            if name is not None:
+                self._by_name.setdefault(name, []).append(res)
+        self._names = sorted(self._by_name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def get(self, name):
+        """
+        Returns the first resource named exactly :attr:`name`, or ``None``.
+        """
+        found = self._by_name.get(name)
+        if found:
+            return found[0]
+
+    def all(self, name):
+        """
+        Returns every resource named exactly :attr:`name`.
+        """
+        return list(self._by_name.get(name, ()))
+
+    def prefix(self, prefix):
+        """
+        Returns every resource whose name starts with :attr:`prefix`, sorted
+        by name.
+        """
+        found = []
+        i = bisect.bisect_left(self._names, prefix)
+        while i < len(self._names) and self._names[i].startswith(prefix):
+            found.extend(self._by_name[self._names[i]])
+            i += 1
+        return found
+
+    def containing(self, substring):
+        """
+        Returns every resource whose name contains :attr:`substring`, like a
+        RightScale ``name==`` filter does.  This one is a linear scan.
+        """
+        found = []
+        for name in self._names:
+            if substring in name:
+                found.extend(self._by_name[name])
+        return found
+
+
+def get_name_index(collection, ttl=None):
+    """
+    Lists the whole collection and returns a :class:`NameIndex` over it.
+
+    :param float ttl: If given, reuse an index of the same collection built
+        less than this many seconds ago.
+    """
+    client = collection.client
+    path = collection.path
+    if ttl:
+        with _name_indexes_lock:
+            cached = _name_indexes.get(client, {}).get(path)
+        if cached and time.time() - cached[0] < ttl:
+            return cached[1]
+
+    index = NameIndex(collection.index())
+    if ttl:
+        with _name_indexes_lock:
+            indexes = _name_indexes.setdefault(client, {})
+            indexes[path] = (time.time(), index)
+    return index
+
+
+def find_by_names(
+        collection,
+        names,
+        exact=True,
+        ttl=None,
+        concurrency=DEFAULT_CONCURRENCY,
+        ):
+    """
+    Bulk version of :func:`find_by_name`.
+
+    Uses as few ``index`` calls as it can: a single ``name==`` filter when
+    all the names share a long enough prefix, otherwise concurrent filtered
+    calls for a handful of names, or else a single unfiltered listing of the
+    whole collection.
+
+    :param rightscale.ResourceCollection collection: The collection in which to
+        look for :attr:`names`.
+
+    :param list names: The names to look for.
+
+    :param bool exact: Same as for :func:`find_by_name`.
+
+    :param float ttl: Cache the full listing of the collection for this many
+        seconds and answer later calls from it.  See :func:`get_name_index`.
+
+    :param int concurrency: Max number of filtered calls in flight.
+
+    Returns a dict keyed by name.  Values are a resource or ``None`` when
+    :attr:`exact`, otherwise lists of every resource whose name contains the
+    key.
+    """
+    names = list(set(names))
+    if not names:
+        return {}
+
+    if ttl or len(names) > MAX_NAME_FILTERS:
+        index = get_name_index(collection, ttl)
+    else:
+        prefix = os.path.commonprefix(names)
+        if len(prefix) >= MIN_FILTER_PREFIX:
+            filters = [prefix]
+        else:
+            filters = names
+
+        def search(name):
+            return collection.index(params={'filter[]': ['name==%s' % name]})
+
+        found = []
+        hrefs = set()
+        for outcome in fan_out(search, filters, concurrency):
+            for res in outcome.get():
+                # with name== being a substring match, one resource can come
+                # back for several names, e.g. 'xab' for both 'ab' and 'xab'
+                if res.href and res.href in hrefs:
+                    continue
+                hrefs.add(res.href)
+                found.append(res)
+        index = NameIndex(found)
+
+    if exact:
+        return dict((name, index.get(name)) for name in names)
+    return dict((name, index.containing(name)) for name in names)
@@ -0,0 +1,78 @@
+"""
+Canned responses and clients that never touch the network.
+"""
+import json
+
+import mock
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from rightscale.httpclient import HTTPClient, HTTPResponse
+
+
+__all__ = [
+    'raw_response',
+    'fake_response',
+    'fake_client',
+    'fake_session_client',
+    ]
+
+
+def raw_response(status=200, body=None, content_type=None, **headers):
+    """
+    Builds a :class:`requests.Response` as the session would return it.
+
+    :attr:`body` is JSON-encoded unless it already is a string; ``None``
+    gives an empty body.  Headers with dashes in their names can be passed as
+    ``**{'Retry-After': '2'}``.
+    """
+    raw = Response()
+    raw.status_code = status
+    if content_type:
+        headers['Content-Type'] = content_type
+    raw.headers = CaseInsensitiveDict(headers)
+    if body is None:
+        body = ''
+    elif not isinstance(body, basestring):
+        body = json.dumps(body)
+    raw._content = body
+    # there's no socket behind it, so closing it has nothing to release
+    raw._content_consumed = True
+    return raw
+
+
+def fake_response(*args, **kwargs):
+    """
+    Like :func:`raw_response`, wrapped in an :class:`HTTPResponse`.
+    """
+    return HTTPResponse(raw_response(*args, **kwargs))
+
+
+def fake_client(responses=None, **kwargs):
+    """
+    Returns an :class:`HTTPClient` that is already logged in and whose
+    ``_request`` is a mock.
+
+    :param responses: What ``_request`` returns: a list of responses (or
+        exceptions) handed out in turn, or a function called in its place.
+
+    Any other kwargs go to :class:`HTTPClient`.
+    """
+    client = HTTPClient('http://nowhere', **kwargs)
+    client.auth_expires_at = float('inf')
+    client._request = mock.MagicMock(side_effect=responses)
+    return client
+
+
+def fake_session_client(*responses, **kwargs):
+    """
+    Returns an :class:`HTTPClient` whose session answers every request with
+    the next of :attr:`responses` (see :func:`raw_response`), so retries,
+    rate limiting, logins and hooks all still run.
+
+    Any kwargs go to :class:`HTTPClient`.
+    """
+    endpoint = kwargs.pop('endpoint', 'http://nowhere')
+    client = HTTPClient(endpoint, **kwargs)
+    client.s.request = mock.MagicMock(side_effect=list(responses))
+    return client
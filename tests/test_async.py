@@ -0,0 +1,112 @@
+import mock
+
+from rightscale.actions import RS_DEFAULT_ACTIONS
+from rightscale.asyncapi import (
+        AsyncCompactResource,
+        AsyncHTTPClient,
+        AsyncResource,
+        AsyncResourceCollection,
+        wait_all,
+        )
+
+
+def _fake_response(body, content_type):
+    response = mock.MagicMock()
+    response.headers = {}
+    response.json.return_value = body
+    response.content_type = [content_type]
+    return response
+
+
+def test_actions_return_pending_results():
+    """
+    Async action methods should return results that resolve to resources.
+    """
+    client = AsyncHTTPClient(max_in_flight=2)
+    client.request = mock.MagicMock(return_value=_fake_response(
+            {'name': 'cloud'},
+            'application/vnd.rightscale.cloud+json',
+            ))
+    col = AsyncResourceCollection('/api/clouds', client, RS_DEFAULT_ACTIONS)
+    try:
+        pending = [col.show(res_id=i) for i in range(5)]
+        res = wait_all(pending)
+    finally:
+        client.close()
+    assert 5 == len(res)
+    assert all(isinstance(r, AsyncResource) for r in res)
+    assert {'name': 'cloud'} == res[0].soul
+    client.request.assert_any_call('get', '/api/clouds/3')
+
+
+def test_async_navigation_stays_async():
+    """
+    Collections reached from async resources should also be async.
+    """
+    res = AsyncResource()
+    res._links = {'instances': '/api/clouds/1/instances'}
+    assert isinstance(res.instances, AsyncResourceCollection)
+
+
+def test_errors_surface_on_get():
+    """
+    Failures inside the worker should be raised when the result is fetched.
+    """
+    client = AsyncHTTPClient(max_in_flight=1)
+    client.request = mock.MagicMock(side_effect=ValueError('nope'))
+    col = AsyncResourceCollection('/api/clouds', client, RS_DEFAULT_ACTIONS)
+    try:
+        pending = col.index()
+        try:
+            pending.get()
+        except ValueError:
+            pass
+        else:
+            assert False, 'expected ValueError'
+    finally:
+        client.close()
+
+
+def test_batch_outcomes():
+    """
+    batch() should give one pending list of outcomes, with errors in them.
+    """
+    client = AsyncHTTPClient(max_in_flight=2)
+
+    def request(method, path, **kwargs):
+        if path.endswith('/2'):
+            raise ValueError('nope')
+        return _fake_response(
+                {'name': path}, 'application/vnd.rightscale.cloud+json')
+
+    client.request = mock.MagicMock(side_effect=request)
+    col = AsyncResourceCollection('/api/clouds', client, RS_DEFAULT_ACTIONS)
+    try:
+        outcomes = col.batch('show', [1, 2, '/api/clouds/3']).get(5)
+    finally:
+        client.close()
+    assert [True, False, True] == [o.ok for o in outcomes]
+    assert isinstance(outcomes[0].result, AsyncResource)
+    assert {'name': '/api/clouds/3'} == outcomes[2].result.soul
+    assert isinstance(outcomes[1].error, ValueError)
+
+
+def test_compact_navigation_stays_async():
+    """
+    Compact resources from async collections should navigate asynchronously
+    too.
+    """
+    client = AsyncHTTPClient(max_in_flight=1)
+    response = _fake_response(
+            [{'links': [{'rel': 'instances', 'href': '/api/clouds/1/i'}]}],
+            'application/vnd.rightscale.cloud+json',
+            )
+    response.content_type.append('type=collection')
+    client.request = mock.MagicMock(return_value=response)
+    col = AsyncResourceCollection('/api/clouds', client, RS_DEFAULT_ACTIONS)
+    try:
+        [cloud] = col.index(compact=True).get(5)
+    finally:
+        client.close()
+    assert isinstance(cloud, AsyncCompactResource)
+    assert isinstance(cloud.instances, AsyncResourceCollection)
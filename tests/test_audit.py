@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+import mock
+
+from rightscale.audit import (
+        AUDIT_DATE_FORMAT,
+        export_audit_entries,
+        split_windows,
+        )
+from rightscale.rightscale import Resource
+
+
+START = datetime(2014, 6, 1)
+
+# strptime lazily imports a module, which isn't thread-safe in python 2
+datetime.strptime('2014', '%Y')
+
+
+def _entry(n):
+    ts = START + timedelta(minutes=n)
+    return Resource({
+        'updated_at': ts.strftime(AUDIT_DATE_FORMAT),
+        'links': [{'rel': 'self', 'href': '/api/audit_entries/%d' % n}],
+        })
+
+
+def _fake_api(minutes):
+    """
+    API whose audit_entries.index() returns one entry per listed minute,
+    inclusive of both ends of the requested range.
+    """
+    def index(params):
+        lo = datetime.strptime(params['start_date'], AUDIT_DATE_FORMAT)
+        hi = datetime.strptime(params['end_date'], AUDIT_DATE_FORMAT)
+        found = [
+                _entry(m) for m in minutes
+                if lo <= START + timedelta(minutes=m) <= hi
+                ]
+        return found[:params['limit']]
+
+    api = mock.MagicMock()
+    api.audit_entries.index.side_effect = index
+    return api
+
+
+def test_split_windows():
+    end = START + timedelta(hours=5)
+    windows = split_windows(START, end, timedelta(hours=2))
+    assert 3 == len(windows)
+    assert START == windows[0][0]
+    assert end == windows[-1][1]
+    assert timedelta(hours=1) == windows[-1][1] - windows[-1][0]
+
+
+def test_export_in_order_without_dupes():
+    """
+    Entries on window boundaries should only be exported once, in order.
+    """
+    minutes = range(0, 240, 30)
+    api = _fake_api(minutes)
+    got = list(export_audit_entries(
+            api, START, START + timedelta(hours=4), window=timedelta(hours=1)))
+    assert [_entry(m).href for m in minutes] == [e.href for e in got]
+
+
+def test_full_windows_are_split():
+    """
+    A window returning the max number of entries should be subdivided.
+    """
+    minutes = range(0, 60, 5)
+    api = _fake_api(minutes)
+    got = list(export_audit_entries(
+            api, START, START + timedelta(hours=1),
+            window=timedelta(hours=1), limit=4))
+    assert len(minutes) == len(got)
+    assert api.audit_entries.index.call_count > 1
+
+
+def test_export_details():
+    """
+    detail=True should attach each entry's detail text.
+    """
+    api = _fake_api([1, 2])
+    api.client.get.return_value.text = 'the details'
+    got = list(export_audit_entries(
+            api, START, START + timedelta(hours=1), detail=True))
+    assert ['the details'] * 2 == [e.soul['detail'] for e in got]
+    api.client.get.assert_any_call('/api/audit_entries/1/detail')
@@ -0,0 +1,56 @@
+import mock
+from nose.tools import raises
+from requests import HTTPError
+
+from rightscale.actions import RS_DEFAULT_ACTIONS
+from rightscale.rightscale import ResourceCollection
+from rightscale.util import fan_out
+
+
+def test_fan_out_keeps_order_and_errors():
+    """
+    fan_out() should return outcomes in item order, capturing failures.
+    """
+    def half(n):
+        if n == 3:
+            raise ValueError(n)
+        return n / 2.0
+
+    outcomes = fan_out(half, range(6), concurrency=3)
+    assert range(6) == [o.item for o in outcomes]
+    assert [0, 0.5, 1, None, 2, 2.5] == [o.result for o in outcomes]
+    assert not outcomes[3].ok
+    assert isinstance(outcomes[3].error, ValueError)
+
+
+@raises(ValueError)
+def test_outcome_reraises():
+    """
+    Outcome.get() should re-raise the captured error.
+    """
+    fan_out(int, ['nope'])[0].get()
+
+
+def test_batch_accepts_ids_and_hrefs():
+    """
+    ResourceCollection.batch() should resolve hrefs and survive 404s.
+    """
+    client = mock.MagicMock()
+
+    def fake_request(method, path, **kwargs):
+        if path.endswith('/404'):
+            raise HTTPError('404 Client Error')
+        response = mock.MagicMock()
+        response.headers = {}
+        response.json.return_value = {'path': path}
+        response.content_type = ['application/vnd.rightscale.cloud+json']
+        return response
+
+    client.request.side_effect = fake_request
+    col = ResourceCollection('/api/clouds', client, RS_DEFAULT_ACTIONS)
+    outcomes = col.batch('show', [1, '/api/clouds/2', 404, '/api/bogus/3'])
+
+    assert {'path': '/api/clouds/1'} == outcomes[0].result.soul
+    assert {'path': '/api/clouds/2'} == outcomes[1].result.soul
+    assert isinstance(outcomes[2].error, HTTPError)
+    assert isinstance(outcomes[3].error, ValueError)
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import mock
+
+from rightscale import commands
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from fakeapi import FakeRightScale
+import suite
+
+
+def test_suite_runs_against_fake_api():
+    """
+    Every scenario should run cleanly against the fake API.
+    """
+    fake = FakeRightScale(clouds=1, instances=5, deployments=4).start()
+    previous = mock.sentinel.api
+    try:
+        # run_suite points get_by_path at the fake, and back afterwards
+        with mock.patch.object(commands, '_api', previous):
+            results = suite.run_suite(fake, 5, 2, keepalive=True)
+            assert previous is commands._api
+    finally:
+        fake.stop()
+    assert set(name for name, _ in suite.SCENARIOS) == set(results)
+    for r in results.values():
+        assert 0 == r['errors']
+        assert r['ops'] > 0
+    assert fake.logins > 5
+
+
+def test_compare_flags_regressions():
+    baseline = {'show': {'ops': 100.0, 'p50': 10.0, 'p99': 20.0}}
+    same = {'show': {'ops': 95.0, 'p50': 11.0, 'p99': 21.0}}
+    slow = {'show': {'ops': 50.0, 'p50': 10.0, 'p99': 20.0}}
+    assert [] == suite.compare(same, baseline, 0.2)
+    assert [('show', 'ops', 100.0, 50.0)] == suite.compare(slow, baseline, 0.2)
@@ -0,0 +1,82 @@
+from rightscale.cache import collection_name, LRUCache, ResponseCache
+
+from http_fixtures import fake_client, fake_response
+
+
+def _client(cache):
+    return fake_client(lambda *a, **k: fake_response(body={}), cache=cache)
+
+
+def test_collection_name():
+    assert 'clouds' == collection_name('/api/clouds')
+    assert 'clouds' == collection_name('/api/clouds/1')
+    assert 'instances' == collection_name('/api/clouds/1/instances')
+    assert 'instances' == collection_name('/api/clouds/1/instances/ABC')
+
+
+def test_lru_evicts_oldest():
+    lru = LRUCache(2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+    assert ['a', 'c'] == lru.keys()
+    assert 1 == lru.evictions
+
+
+def test_get_served_from_cache():
+    """
+    Repeated GETs with the same params should only hit the wire once.
+    """
+    cache = ResponseCache()
+    client = _client(cache)
+    params = {'filter[]': ['name==foo']}
+    first = client.get('/api/clouds', params=params)
+    second = client.get('/api/clouds', params={'filter[]': ['name==foo']})
+    client.get('/api/clouds', params={'filter[]': ['name==bar']})
+    assert second.raw_response is first.raw_response
+    assert 2 == client._request.call_count
+    stats = cache.stats()
+    assert 1 == stats['hits']
+    assert 2 == stats['misses']
+
+
+def test_per_collection_ttl():
+    """
+    Collections with a zero TTL should never be cached.
+    """
+    cache = ResponseCache(ttls={'instances': 0})
+    client = _client(cache)
+    client.get('/api/clouds/1/instances')
+    client.get('/api/clouds/1/instances')
+    assert 2 == client._request.call_count
+
+
+def test_writes_invalidate():
+    """
+    A POST under a collection should drop cached reads for that collection.
+    """
+    cache = ResponseCache()
+    client = _client(cache)
+    client.get('/api/deployments')
+    client.get('/api/deployments/1')
+    client.get('/api/clouds')
+    client.post('/api/deployments/1/lock')
+    assert 1 == cache.stats()['size']
+    assert 2 == cache.stats()['invalidations']
+    client.get('/api/deployments')
+    assert 5 == client._request.call_count
+
+
+def test_cached_body_not_shared():
+    """
+    Changing a parsed body should not change what later cache hits get.
+    """
+    client = _client(ResponseCache())
+    client._request.side_effect = None
+    client._request.return_value = fake_response(
+            body={'name': 'x', 'links': []})
+    client.get('/api/clouds/1').json()['name'] = 'changed'
+    client.get('/api/clouds/1').json()['links'].append('junk')
+    assert {'name': 'x', 'links': []} == client.get('/api/clouds/1').json()
+    assert 1 == client._request.call_count
@@ -0,0 +1,139 @@
+import threading
+import time
+
+import mock
+from requests import HTTPError
+
+from rightscale.asyncapi import AsyncRightScale, wait_all
+from rightscale.cache import SingleFlight
+from rightscale.httpclient import HTTPClient
+
+from http_fixtures import fake_client, fake_response
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+
+class BlockingRequest(object):
+    """
+    Stands in for HTTPClient._request, holding every call until released.
+    """
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+        self.release = threading.Event()
+
+    def __call__(self, method, path, url, ignore_codes, **kwargs):
+        self.calls.append((method, path, kwargs))
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return fake_response(body={'name': 'web', 'links': []})
+
+
+def _client(request, **kwargs):
+    return fake_client(request, coalesce=True, **kwargs)
+
+
+def _in_threads(n, fn):
+    results = [None] * n
+
+    def run(i):
+        try:
+            results[i] = fn()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def test_identical_gets_coalesced():
+    """
+    Concurrent GETs for the same URL and params should share one request.
+    """
+    request = BlockingRequest()
+    client = _client(request)
+    params = {'filter[]': ['name==web']}
+    threads, results = _in_threads(
+            5, lambda: client.get('/api/clouds', params=params))
+    _wait_for(lambda: client.flights.followers == 4)
+    request.release.set()
+    for t in threads:
+        t.join()
+
+    assert 1 == len(request.calls)
+    assert all(r.raw_response is results[0].raw_response for r in results)
+
+    # each caller can change its body without the others seeing it
+    results[0].json()['name'] = 'changed'
+    assert all('web' == r.json()['name'] for r in results[1:])
+    assert {'leaders': 1, 'followers': 4} == client.flights.stats()
+
+    # nothing is remembered afterwards
+    client.get('/api/clouds', params=params)
+    assert 2 == len(request.calls)
+
+
+def test_errors_shared():
+    request = BlockingRequest(error=HTTPError('503'))
+    client = _client(request)
+    threads, results = _in_threads(3, lambda: client.get('/api/clouds'))
+    _wait_for(lambda: client.flights.followers == 2)
+    request.release.set()
+    for t in threads:
+        t.join()
+    assert 1 == len(request.calls)
+    assert all(isinstance(r, HTTPError) for r in results)
+
+
+def test_different_requests_not_coalesced():
+    """
+    Other params, other methods and extra options should go out on their own.
+    """
+    request = BlockingRequest()
+    request.release.set()
+    client = _client(request)
+    flights = client.flights = mock.MagicMock(wraps=SingleFlight())
+    client.get('/api/clouds', params={'view': 'full'})
+    client.get('/api/clouds', params={'view': 'default'})
+    client.get('/api/clouds', headers={'X-Foo': '1'})
+    client.get('/api/clouds', stream=True)
+    client.post('/api/clouds')
+    assert 5 == len(request.calls)
+    keys = [c[0][0] for c in flights.do.call_args_list]
+    assert 2 == len(keys)
+    assert keys[0] != keys[1]
+
+
+def test_disabled_by_default():
+    client = HTTPClient('http://nowhere')
+    assert client.flights is None
+
+
+def test_async_coalesced():
+    """
+    Action methods of the async API run on worker threads, and should be
+    coalesced as well.
+    """
+    api = AsyncRightScale(
+            refresh_token='x', api_endpoint='http://nowhere',
+            token_cache=None, coalesce=True)
+    request = BlockingRequest()
+    api.client.auth_expires_at = float('inf')
+    api.client._request = request
+    api.soul = {'links': [{'rel': 'clouds', 'href': '/api/clouds'}]}
+    try:
+        pending = [api.clouds.show(res_id=1) for _ in range(4)]
+        _wait_for(lambda: api.client.flights.followers == 3)
+        request.release.set()
+        wait_all(pending)
+    finally:
+        api.close()
+    assert 1 == len(request.calls)
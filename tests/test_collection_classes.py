@@ -0,0 +1,49 @@
+from rightscale.actions import INSTANCE_ACTIONS
+from rightscale.asyncapi import AsyncResource, AsyncResourceCollection
+from rightscale.rightscale import Resource, ResourceCollection
+
+
+def test_classes_are_cached_per_table():
+    """
+    for_actions() should build one class per action table.
+    """
+    a = ResourceCollection.for_actions(INSTANCE_ACTIONS)
+    b = ResourceCollection.for_actions(INSTANCE_ACTIONS)
+    c = ResourceCollection.for_actions(None)
+    assert a is b
+    assert a is not c
+    assert issubclass(a, ResourceCollection)
+
+
+def test_methods_defined_on_class():
+    """
+    Actions should be real methods; disabled actions should be missing.
+    """
+    cls = ResourceCollection.for_actions(INSTANCE_ACTIONS)
+    assert 'multi_run_executable' == cls.multi_run_executable.__name__
+    assert hasattr(cls, 'index')
+    assert not hasattr(cls, 'create')
+
+
+def test_resource_attr_uses_cached_class():
+    """
+    Getting the same collection twice should give instances of one class.
+    """
+    res = Resource()
+    res._links = {'instances': '/api/clouds/1/instances'}
+    res.collection_actions = {'instances': INSTANCE_ACTIONS}
+    first = res.instances
+    assert '/api/clouds/1/instances' == first.path
+    assert type(first) is type(res.instances)
+    assert hasattr(first, 'launch')
+
+
+def test_async_classes_are_separate():
+    """
+    The async collection should get its own cached classes.
+    """
+    res = AsyncResource()
+    res._links = {'instances': '/api/clouds/1/instances'}
+    assert isinstance(res.instances, AsyncResourceCollection)
+    assert AsyncResourceCollection.for_actions(None) is not \
+        ResourceCollection.for_actions(None)
@@ -0,0 +1,77 @@
+import gc
+import json
+
+import mock
+
+from rightscale.rightscale import CompactResource, ResourceCollection
+
+from http_fixtures import fake_response
+
+CLOUD_TYPE = 'application/vnd.rightscale.cloud+json'
+
+
+def _response(body, content_type=CLOUD_TYPE):
+    return fake_response(200, body, content_type)
+
+
+def _soul(n):
+    return {
+            'name': 'cloud %d' % n,
+            'links': [
+                {'rel': 'self', 'href': '/api/clouds/%d' % n},
+                {'rel': 'owner', 'href': '/api/accounts/1'},
+                ],
+            }
+
+
+def test_compact_has_no_dict_or_response():
+    """
+    Compact resources should not carry a __dict__ or the response.
+    """
+    res = CompactResource(_soul(1), '/api/clouds', _response([]))
+    assert not hasattr(res, '__dict__')
+    assert CLOUD_TYPE == res.content_type
+    assert {'name': 'cloud 1'} == res.soul
+    assert '/api/clouds/1' == res.href
+
+
+def test_compact_navigation():
+    """
+    Compact resources should expose the same collections as regular ones.
+    """
+    res = CompactResource(_soul(1), '/api/clouds/1', _response([]))
+    assert '/api/clouds/1/instances' == res.links['instances']
+    assert isinstance(res.instances, ResourceCollection)
+    assert hasattr(res.instances, 'multi_run_executable')
+
+
+def test_compact_from_list_shares_strings():
+    """
+    Hrefs repeated across a response should only be stored once.
+    """
+    souls = json.loads(json.dumps([_soul(1), _soul(2)]))
+    a, b = CompactResource.from_list(souls, '/api/clouds')
+    assert dict(a.link_pairs)['owner'] is dict(b.link_pairs)['owner']
+    assert a.link_pairs[0][0] is b.link_pairs[0][0]
+
+
+def test_compact_index_drops_response():
+    """
+    index(compact=True) should not keep the response, or its body, around.
+    """
+    client = mock.Mock()
+    response = _response(
+            [_soul(1), _soul(2)], CLOUD_TYPE + ';type=collection')
+    client.request.return_value = response
+    col = ResourceCollection.for_actions()('/api/clouds', client)
+
+    clouds = col.index(compact=True)
+    assert clouds.response is None
+    assert all(isinstance(c, CompactResource) for c in clouds)
+    assert ['/api/clouds/1', '/api/clouds/2'] == [c.href for c in clouds]
+    body = response.raw_response._content
+    for obj in gc.get_referents(clouds, *clouds):
+        assert obj is not response
+        assert obj is not body
+
+    assert col.index().response is response
@@ -0,0 +1,62 @@
+from rightscale.rightscale import Resource
+
+from http_fixtures import fake_client, fake_response
+
+
+def _client(*responses):
+    return fake_client(responses, conditional=True)
+
+
+def test_json_parsed_once():
+    """
+    HTTPResponse.json() should return the same parsed object every time.
+    """
+    r = fake_response(200, {'a': 1})
+    assert r.json() is r.json()
+
+
+def test_sends_validators_and_reuses_body():
+    """
+    A 304 should give back a copy of the previous response.
+    """
+    client = _client(
+            fake_response(200, {'name': 'x'}, ETag='"v1"'),
+            fake_response(304),
+            )
+    first = client.get('/api/clouds/1')
+    body = first.json()
+    second = client.get('/api/clouds/1')
+
+    headers = client._request.call_args[1]['headers']
+    assert '"v1"' == headers['If-None-Match']
+    assert second.raw_response is first.raw_response
+    assert body == second.json()
+    body['name'] = 'changed'
+    assert 'x' == second.json()['name']
+
+
+def test_no_validators_no_conditional():
+    """
+    Responses without validators should not turn into conditional requests.
+    """
+    client = _client(fake_response(200, {}), fake_response(200, {}))
+    client.get('/api/clouds/1')
+    client.get('/api/clouds/1')
+    assert 'headers' not in client._request.call_args[1]
+
+
+def test_refresh_unchanged_resource():
+    """
+    Resource.refresh() should keep the same soul on a 304.
+    """
+    soul = {'links': [{'rel': 'self', 'href': '/api/clouds/1'}]}
+    client = _client(
+            fake_response(200, soul, **{'Last-Modified': 'yesterday'}),
+            fake_response(304),
+            )
+    res = Resource(client.get('/api/clouds/1').json(), client=client)
+    before = res.soul
+    res.refresh()
+    assert before == res.soul
+    headers = client._request.call_args[1]['headers']
+    assert 'yesterday' == headers['If-Modified-Since']
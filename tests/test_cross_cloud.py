@@ -0,0 +1,78 @@
+import time
+
+import mock
+from nose.tools import raises
+
+from rightscale import commands
+
+
+def _cloud(name, instances=None, delay=0, error=None):
+    cloud = mock.MagicMock()
+    cloud.soul = {'name': name}
+
+    def index(params=None):
+        time.sleep(delay)
+        if error:
+            raise error
+        return instances
+
+    cloud.instances.index.side_effect = index
+    return cloud
+
+
+def _api(*clouds):
+    api = mock.MagicMock()
+    api.clouds.index.return_value = list(clouds)
+    return api
+
+
+def test_streams_in_completion_order():
+    """
+    Fast clouds should come out before slow ones, with timings.
+    """
+    api = _api(
+            _cloud('slow', ['s1'], delay=0.2),
+            _cloud('fast', ['f1', 'f2']),
+            )
+    with mock.patch.object(commands, 'get_api', return_value=api):
+        outcomes = list(commands.iter_instances())
+    assert ['fast', 'slow'] == [o.item.soul['name'] for o in outcomes]
+    assert ['f1', 'f2'] == outcomes[0].result
+    assert outcomes[1].elapsed >= 0.2
+
+
+def test_failures_do_not_block_others():
+    """
+    list_instances across clouds should merge what worked and report the
+    rest.
+    """
+    api = _api(
+            _cloud('a', ['a1']),
+            _cloud('b', error=IOError('down')),
+            _cloud('c', ['c1', 'c2']),
+            )
+    with mock.patch.object(commands, 'get_api', return_value=api):
+        instances = commands.list_instances(cloud_name=None, view='full')
+    assert ['a1', 'c1', 'c2'] == sorted(instances)
+    failed = [o for o in instances.clouds if not o.ok]
+    assert ['b'] == [o.item.soul['name'] for o in failed]
+    params = api.clouds.index.return_value[0].instances.index.call_args[1]
+    assert 'full' == params['params']['view']
+    assert ['state==operational'] == params['params']['filter[]']
+
+
+def test_subset_of_clouds():
+    """
+    Only the named clouds should be listed.
+    """
+    a, b = _cloud('a', ['a1']), _cloud('b', ['b1'])
+    with mock.patch.object(commands, 'get_api', return_value=_api(a, b)):
+        instances = commands.list_instances(cloud_name=['b'])
+    assert ['b1'] == list(instances)
+    assert not a.instances.index.called
+
+
+@raises(ValueError)
+def test_unknown_cloud():
+    with mock.patch.object(commands, 'get_api', return_value=_api()):
+        commands.list_instances(cloud_name=['nope'])
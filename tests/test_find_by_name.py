@@ -1,5 +1,11 @@
 import mock
-from rightscale.util import find_by_name
+from rightscale.util import (
+        find_by_name,
+        find_by_names,
+        get_name_index,
+        MAX_NAME_FILTERS,
+        NameIndex,
+        )
 
 
 def test_not_exact_return_all():
@@ -47,3 +53,101 @@ def test_return_exact_of_multiple():
     col.index.return_value = [notme, exact, notme]
     ret = find_by_name(col, exp_name)
     assert exact == ret
+
+
+def _named(*names):
+    found = []
+    for name in names:
+        res = mock.MagicMock()
+        res.soul = {'name': name}
+        found.append(res)
+    return found
+
+
+def test_name_index_lookups():
+    """
+    NameIndex should answer exact, prefix and substring lookups.
+    """
+    a, b, c, d = _named('web-1', 'web-2', 'db-1', 'web-1')
+    index = NameIndex([a, b, c, d])
+    assert a is index.get('web-1')
+    assert [a, d] == index.all('web-1')
+    assert index.get('web') is None
+    assert [a, d, b] == index.prefix('web-')
+    assert [c, a, d] == index.containing('-1')
+
+
+def test_find_by_names_common_prefix():
+    """
+    Names sharing a prefix should be looked up with one filtered call.
+    """
+    col = mock.MagicMock()
+    col.index.return_value = _named('web-1', 'web-2', 'web-10')
+    found = find_by_names(col, ['web-1', 'web-2', 'web-3'])
+    col.index.assert_called_once_with(params={'filter[]': ['name==web-']})
+    assert 'web-1' == found['web-1'].soul['name']
+    assert found['web-3'] is None
+
+
+def test_find_by_names_per_name():
+    """
+    A few unrelated names should get one filtered call each.
+    """
+    col = mock.MagicMock()
+    col.index.return_value = _named('alpha', 'beta')
+    found = find_by_names(col, ['alpha', 'beta'])
+    assert 2 == col.index.call_count
+    assert 'beta' == found['beta'].soul['name']
+
+
+def test_find_by_names_overlapping():
+    """
+    A resource matched by several names' filters should only be listed once.
+    """
+    ab, xab = _named('ab', 'xab')
+    ab.href = '/api/deployments/1'
+    xab.href = '/api/deployments/2'
+
+    def index(params):
+        name = params['filter[]'][0].split('==', 1)[1]
+        return [r for r in (ab, xab) if name in r.soul['name']]
+
+    col = mock.MagicMock()
+    col.index.side_effect = index
+    found = find_by_names(col, ['ab', 'xab'], exact=False)
+    assert 2 == col.index.call_count
+    assert [ab, xab] == found['ab']
+    assert [xab] == found['xab']
+
+
+def test_find_by_names_full_listing_cached():
+    """
+    Many names should list the collection once, and a ttl should reuse it.
+    """
+    col = mock.MagicMock()
+    col.path = '/api/servers/test_find_by_names_full_listing_cached'
+    names = ['srv%d' % i for i in range(MAX_NAME_FILTERS + 1)]
+    col.index.return_value = _named(*names)
+    found = find_by_names(col, names, ttl=60)
+    col.index.assert_called_once_with()
+    assert all(found[n].soul['name'] == n for n in names)
+    find_by_names(col, ['srv1'], ttl=60, exact=False)
+    assert 1 == col.index.call_count
+
+
+def test_name_index_per_client():
+    """
+    Clients should never share an index, even for the same collection path.
+    """
+    first = mock.MagicMock()
+    first.path = '/api/servers'
+    first.index.return_value = _named('east')
+    second = mock.MagicMock()
+    second.path = '/api/servers'
+    second.index.return_value = _named('west')
+
+    assert get_name_index(first, ttl=60).get('east')
+    assert get_name_index(second, ttl=60).get('west')
+    assert get_name_index(second, ttl=60).get('east') is None
+    assert 1 == first.index.call_count
+    assert 1 == second.index.call_count
@@ -0,0 +1,234 @@
+from StringIO import StringIO
+
+import mock
+from nose.tools import raises
+
+from rightscale import commands
+from rightscale.tasks import (
+        format_summaries,
+        instance_of_task,
+        TaskSummary,
+        TaskWatcher,
+        )
+
+
+CLOUD1 = '/api/clouds/1'
+CLOUD2 = '/api/clouds/2'
+
+
+def _task(instance, n):
+    return '%s/live/tasks/ae-%d' % (instance, n)
+
+
+def _res(name, href, **links):
+    res = mock.MagicMock()
+    res.soul = {'name': name}
+    res.href = href
+    res.links = links
+    return res
+
+
+class FakeClient(object):
+    """
+    Posts hand out one task per instance in the target cloud; every task
+    completes on its first poll except those on instances named ``bad``.
+    Instances are named after the last part of their href.
+    """
+    def __init__(self, instances):
+        self.instances = instances
+        self.posts = []
+
+    def post(self, path, data=None):
+        self.posts.append((path, data))
+        if path.endswith('/run_executable'):
+            hrefs = [path[:-len('/run_executable')]]
+        else:
+            cloud = path.split('/instances/')[0]
+            hrefs = [h for h in self.instances if h.startswith(cloud + '/')]
+        tasks = [_task(h, i) for i, h in enumerate(hrefs)]
+        response = mock.MagicMock()
+        response.headers = {'location': ','.join(tasks)}
+        return response
+
+    def get(self, location):
+        if '/live/tasks/' not in location:
+            name = location.rsplit('/', 1)[1]
+            return mock.MagicMock(**{'json.return_value': {'name': name}})
+        if '/bad/' in location:
+            summary = 'failed: boom'
+        else:
+            summary = 'completed: push'
+        return mock.MagicMock(**{'json.return_value': {'summary': summary}})
+
+
+def _api(client):
+    api = mock.MagicMock()
+    api.client = client
+    return api
+
+
+def _run(api, **kwargs):
+    watcher = TaskWatcher(api.client, min_interval=0.01)
+    script = _res('push', '/api/right_scripts/9')
+    by_name = {'push': script}
+    by_name.update(kwargs.pop('by_name', {}))
+    try:
+        with mock.patch.object(commands, 'get_api', return_value=api):
+            with mock.patch.object(commands, '_watcher', watcher):
+                with mock.patch.object(
+                        commands, 'find_by_name',
+                        side_effect=lambda coll, name: by_name[name]):
+                    return commands.run_script_on_fleet('push', **kwargs)
+    finally:
+        watcher.close()
+
+
+def test_instance_of_task():
+    assert CLOUD1 + '/instances/AB' == instance_of_task(
+            _task(CLOUD1 + '/instances/AB', 3))
+    assert instance_of_task('/api/server_arrays/1') is None
+
+
+def test_deployment_one_call_per_cloud():
+    """
+    A deployment spread over two clouds should take two dispatch calls.
+    """
+    instances = [
+            CLOUD1 + '/instances/a1',
+            CLOUD1 + '/instances/bad',
+            CLOUD2 + '/instances/b1',
+            ]
+    client = FakeClient(instances)
+    deploy = _res('prod', '/api/deployments/5')
+    deploy.servers.index.return_value = [
+            _res('web-%d' % i, '/api/servers/%d' % i, current_instance=h)
+            for i, h in enumerate(instances)
+            ] + [_res('stopped', '/api/servers/99')]
+    deploy.server_arrays.index.return_value = []
+    rows = _run(
+            _api(client),
+            deployment_name='prod',
+            by_name={'prod': deploy},
+            )
+
+    paths = sorted(p for p, _ in client.posts)
+    assert [
+            CLOUD1 + '/instances/multi_run_executable',
+            CLOUD2 + '/instances/multi_run_executable',
+            ] == paths
+    data = client.posts[0][1]
+    assert ['deployment_href==/api/deployments/5'] == data['filter[]']
+    assert '/api/right_scripts/9' == data['right_script_href']
+
+    by_instance = dict((r.instance, r) for r in rows)
+    assert set(instances) == set(by_instance)
+    assert 'completed' == by_instance[instances[0]].state
+    assert 'web-0' == by_instance[instances[0]].name
+    assert 'failed' == by_instance[instances[1]].state
+
+
+def test_tags_run_each_instance():
+    """
+    Tagged instances should each get a run_executable.
+    """
+    instances = [CLOUD1 + '/instances/a1', CLOUD2 + '/instances/b1']
+    client = FakeClient(instances)
+    api = _api(client)
+    tagged = []
+    for h in instances:
+        t = mock.MagicMock()
+        t.soul = {'links': [{'rel': 'resource', 'href': h}]}
+        tagged.append(t)
+    api.tags.by_tag.return_value = tagged
+    rows = _run(api, tags=['role:web=true'], cloud_name='c2',
+                by_name={'c2': _res('c2', CLOUD2)})
+    assert [(instances[1] + '/run_executable')] == [p for p, _ in client.posts]
+    assert [instances[1]] == [r.instance for r in rows]
+    assert ['b1'] == [r.name for r in rows]
+    assert ['completed'] == [r.state for r in rows]
+
+
+def test_deployment_server_arrays_expanded():
+    """
+    Instances of a deployment's server arrays should be run on too.
+    """
+    instance = CLOUD2 + '/instances/b1'
+    client = FakeClient([instance])
+    deploy = _res('prod', '/api/deployments/5')
+    deploy.servers.index.return_value = []
+    array = _res('app', '/api/server_arrays/3')
+    array.current_instances.index.return_value = [_res('app-1', instance)]
+    deploy.server_arrays.index.return_value = [array]
+    rows = _run(
+            _api(client),
+            deployment_name='prod',
+            by_name={'prod': deploy},
+            )
+    assert [CLOUD2 + '/instances/multi_run_executable'] == [
+            p for p, _ in client.posts]
+    assert [(instance, 'app-1')] == [(r.instance, r.name) for r in rows]
+
+
+def test_server_array_and_filter_names():
+    """
+    Rows for server arrays and filters should carry instance names.
+    """
+    instance = CLOUD1 + '/instances/a1'
+    array = _res('app', '/api/server_arrays/3')
+    array.current_instances.index.return_value = [_res('app-1', instance)]
+    client = FakeClient([])
+    client.post = mock.MagicMock(return_value=mock.MagicMock(
+            headers={'location': _task(instance, 1)}))
+    rows = _run(_api(client), server_array_name='app', filters=['state==x'],
+                by_name={'app': array})
+    array.current_instances.index.assert_called_once_with(
+            params={'filter[]': ['state==x']})
+    assert ['app-1'] == [r.name for r in rows]
+
+    cloud = _res('c1', CLOUD1)
+    cloud.instances.index.return_value = [_res('web-1', instance)]
+    rows = _run(_api(client), cloud_name='c1', filters=['name==web'],
+                by_name={'c1': cloud})
+    assert ['web-1'] == [r.name for r in rows]
+
+
+@raises(ValueError)
+def test_no_instances_raises():
+    """
+    A target without running instances should fail instead of doing nothing.
+    """
+    client = FakeClient([])
+    deploy = _res('prod', '/api/deployments/5')
+    deploy.servers.index.return_value = [_res('stopped', '/api/servers/99')]
+    deploy.server_arrays.index.return_value = []
+    try:
+        _run(_api(client), deployment_name='prod', by_name={'prod': deploy})
+    finally:
+        assert [] == client.posts
+
+
+def test_dispatch_errors_are_reported():
+    """
+    A failed dispatch should show up as an error row.
+    """
+    api = _api(mock.MagicMock())
+    api.client.post.side_effect = IOError('nope')
+    array = _res('app', '/api/server_arrays/3')
+    array.current_instances.index.return_value = [
+            _res('app-1', CLOUD1 + '/instances/a1')]
+    rows = _run(api, server_array_name='app', by_name={'app': array})
+    assert 1 == len(rows)
+    assert 'error' == rows[0].state
+    assert '/api/server_arrays/3/multi_run_executable' == rows[0].task
+
+
+def test_format_summaries():
+    out = StringIO()
+    out.write(format_summaries([
+            TaskSummary('/i/1', 'web', '/t/1', 'completed', 'completed: x'),
+            TaskSummary(None, None, '/t/2', 'timeout', ''),
+            ]))
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith('INSTANCE')
+    assert 3 == len(lines)
+    assert lines[2].startswith('/t/2')
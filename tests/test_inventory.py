@@ -0,0 +1,281 @@
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+from requests import HTTPError
+
+from rightscale.audit import format_audit_date
+from rightscale.inventory import (
+        crawl,
+        Inventory,
+        parse_audit_date,
+        resource_type,
+        sync,
+        )
+from rightscale.rightscale import RightScale
+
+from http_fixtures import fake_response, raw_response
+
+
+CT = 'application/vnd.rightscale.%s+json'
+
+
+def _links(href, **rels):
+    links = [{'rel': 'self', 'href': href}]
+    links.extend({'rel': k, 'href': v} for k, v in sorted(rels.items()))
+    return links
+
+
+def _response(kind, body, collection=False):
+    content_type = CT % kind
+    if collection:
+        content_type += ';type=collection'
+    return fake_response(200, body, content_type)
+
+
+SESSION = {'links': [
+        {'rel': 'clouds', 'href': '/api/clouds'},
+        {'rel': 'deployments', 'href': '/api/deployments'},
+        ]}
+
+CLOUDS = [
+        {'name': 'east', 'links': _links(
+            '/api/clouds/1', instances='/api/clouds/1/instances')},
+        {'name': 'west', 'links': _links(
+            '/api/clouds/2', instances='/api/clouds/2/instances')},
+        ]
+
+INSTANCES = {
+        '/api/clouds/1/instances': [
+            {'name': 'web-1', 'links': _links(
+                '/api/clouds/1/instances/A',
+                deployment='/api/deployments/7')},
+            ],
+        '/api/clouds/2/instances': [],
+        }
+
+DEPLOYMENTS = [
+        {'name': 'prod', 'links': _links(
+            '/api/deployments/7',
+            servers='/api/deployments/7/servers',
+            server_arrays='/api/deployments/7/server_arrays')},
+        ]
+
+SERVERS = [
+        {'name': 'web', 'links': _links(
+            '/api/servers/3', current_instance='/api/clouds/1/instances/A')},
+        ]
+
+
+class FakeClient(object):
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.calls = []
+
+    def get(self, path, **kwargs):
+        return self.request('get', path, **kwargs)
+
+    def request(self, method, path, **kwargs):
+        self.calls.append((method, path))
+        if path in self.fail:
+            raise IOError(path)
+        if path == '/api/sessions':
+            return _response('session', SESSION)
+        if path == '/api/clouds':
+            return _response('cloud', CLOUDS, True)
+        if path in INSTANCES:
+            return _response('instance', INSTANCES[path], True)
+        if path == '/api/deployments':
+            return _response('deployment', DEPLOYMENTS, True)
+        if path == '/api/deployments/7/servers':
+            return _response('server', SERVERS, True)
+        if path == '/api/deployments/7/server_arrays':
+            return _response('server_array', [], True)
+        if path == '/api/tags/by_resource':
+            hrefs = kwargs['data']['resource_hrefs[]']
+            return _response('tag', [
+                {'tags': [{'name': 'role:web=true'}],
+                 'links': [{'rel': 'resource', 'href': h}]}
+                for h in hrefs if '/instances/' in h
+                ], True)
+        raise AssertionError(path)
+
+
+class TestInventory(object):
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'inv.db')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp)
+
+    def _crawl(self, **kwargs):
+        api = RightScale(refresh_token='x', api_endpoint='http://nowhere')
+        api.client = FakeClient(**kwargs)
+        return api, crawl(api, self.path)
+
+    def test_crawl(self):
+        """
+        Every resource should be stored with its type, parent and tags.
+        """
+        api, inv = self._crawl()
+        assert 5 == inv.count()
+        assert 2 == inv.count('cloud')
+        assert ['/api/clouds/1/instances/A'] == [
+                i['links'][0]['href'] for i in inv.find(type='instance')]
+        assert ['web'] == [
+                s['name'] for s in inv.children('/api/deployments/7')]
+        assert 'east' == inv.get('/api/clouds/1')['name']
+        assert ['role:web=true'] == inv.tags('/api/clouds/1/instances/A')
+        assert ['web-1'] == [
+                i['name'] for i in inv.find(tag='role:web=true')]
+        assert ['web-1'] == [i['name'] for i in inv.find(name='web-%')]
+        assert ['/api/servers/3'] == inv.linked_to(
+                '/api/clouds/1/instances/A', rel='current_instance')
+        assert inv.get_meta('crawled_at')
+        assert not inv.crawl_errors
+        assert [self.path] == [
+                os.path.join(self.tmp, f) for f in os.listdir(self.tmp)]
+
+    def test_failed_collection(self):
+        """
+        A collection that can't be listed should be skipped and reported.
+        """
+        api, inv = self._crawl(fail=('/api/clouds/2/instances',))
+        assert 1 == len(inv.crawl_errors)
+        assert 2 == inv.count('cloud')
+        assert 1 == inv.count('instance')
+
+    def test_resource_type(self):
+        assert 'server_array' == resource_type(CT % 'server_array')
+        assert 'text/plain' == resource_type('text/plain')
+
+
+def _entry(href, minutes_ago):
+    entry = mock.MagicMock()
+    when = datetime.utcnow() - timedelta(minutes=minutes_ago)
+    entry.href = '/api/audit_entries/%s' % href.replace('/', '_')
+    entry.soul = {
+            'updated_at': format_audit_date(when),
+            'links': [{'rel': 'auditee', 'href': href}],
+            }
+    return entry
+
+
+class TestSync(object):
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.inv = Inventory(os.path.join(self.tmp, 'inv.db'))
+        self.inv.put('/api/deployments/7', 'deployment', {
+                'name': 'prod', 'updated_at': 'd1',
+                'links': _links('/api/deployments/7')})
+        self.inv.put('/api/servers/3', 'server', {
+                'name': 'web', 'updated_at': 's1',
+                'links': _links('/api/servers/3', current_instance='A')},
+                '/api/deployments/7')
+        for i in ('A', 'B'):
+            href = '/api/clouds/1/instances/' + i
+            self.inv.put(href, 'instance', {
+                    'name': i, 'links': _links(href)}, '/api/clouds/1')
+        self.inv.set_meta('crawled_at', time.time() - 3600)
+        self.inv.commit()
+
+        self.api = mock.MagicMock()
+        self.api.tags.by_resource.return_value = []
+        self.bodies = {
+                '/api/deployments/7': ('deployment', {
+                    'name': 'prod', 'updated_at': 'd1',
+                    'links': _links('/api/deployments/7')}),
+                '/api/servers/3': ('server', {
+                    'name': 'web', 'updated_at': 's2',
+                    'links': _links(
+                        '/api/servers/3',
+                        deployment='/api/deployments/7',
+                        current_instance='/api/clouds/1/instances/C')}),
+                '/api/clouds/1/instances/C': ('instance', {
+                    'name': 'C', 'links': _links(
+                        '/api/clouds/1/instances/C', cloud='/api/clouds/1')}),
+                '/api/server_templates/4': ('server_template', {
+                    'name': 'base', 'links': _links(
+                        '/api/server_templates/4')}),
+                }
+        self.api.client.get.side_effect = self._get
+
+    def teardown(self):
+        self.inv.close()
+        shutil.rmtree(self.tmp)
+
+    def _get(self, href):
+        if href not in self.bodies:
+            raise HTTPError(response=raw_response(404))
+        kind, body = self.bodies[href]
+        return _response(kind, body)
+
+    def test_sync_changes_only(self):
+        """
+        Only audited hrefs (and new current instances) should be fetched.
+        """
+        self.api.audit_entries.index.return_value = [
+                _entry('/api/servers/3', 10),
+                _entry('/api/clouds/1/instances/B', 5),
+                _entry('/api/deployments/7', 20),
+                ]
+        stats = sync(self.api, self.inv)
+        assert 3 == stats.changed
+        assert 2 == stats.updated
+        assert 1 == stats.deleted
+        assert not stats.errors
+
+        fetched = sorted(c[0][0] for c in self.api.client.get.call_args_list)
+        assert [
+                '/api/clouds/1/instances/B',
+                '/api/clouds/1/instances/C',
+                '/api/deployments/7',
+                '/api/servers/3',
+                ] == fetched
+        assert 's2' == self.inv.get('/api/servers/3')['updated_at']
+        assert self.inv.get('/api/clouds/1/instances/B') is None
+        assert ['/api/clouds/1/instances/A', '/api/clouds/1/instances/C'] == [
+                i['links'][0]['href']
+                for i in self.inv.find(parent='/api/clouds/1')]
+
+        cursor = parse_audit_date(self.inv.get_meta('sync_cursor'))
+        newest = datetime.utcnow() - timedelta(minutes=5)
+        assert abs(newest - cursor) < timedelta(seconds=5)
+
+    def test_uncrawled_types_skipped(self):
+        """
+        Auditees of types crawl() doesn't collect should not be added.
+        """
+        self.api.audit_entries.index.return_value = [
+                _entry('/api/server_templates/4', 10),
+                _entry('/api/deployments/7', 5),
+                ]
+        self.bodies['/api/deployments/7'][1]['updated_at'] = 'd2'
+        stats = sync(self.api, self.inv)
+        assert 1 == stats.updated
+        assert self.inv.get('/api/server_templates/4') is None
+        assert 'd2' == self.inv.get('/api/deployments/7')['updated_at']
+        assert self.inv.parent('/api/deployments/7') is None
+
+    def test_nothing_changed(self):
+        """
+        With no audit entries, nothing should be fetched but the cursor
+        should move.
+        """
+        self.api.audit_entries.index.return_value = []
+        stats = sync(self.api, self.inv)
+        assert 0 == stats.changed
+        assert not self.api.client.get.called
+        assert self.inv.get_meta('sync_cursor')
+
+    def test_failed_fetch_keeps_cursor(self):
+        self.api.audit_entries.index.return_value = [
+                _entry('/api/servers/3', 10)]
+        self.api.client.get.side_effect = IOError('down')
+        stats = sync(self.api, self.inv)
+        assert 1 == len(stats.errors)
+        assert self.inv.get_meta('sync_cursor') is None
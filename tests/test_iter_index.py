@@ -0,0 +1,84 @@
+import json
+
+import mock
+from nose.tools import raises
+
+from rightscale.actions import RS_DEFAULT_ACTIONS
+from rightscale.rightscale import Resource, ResourceCollection
+from rightscale.util import iter_json_array
+
+
+def _chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_iter_json_array_any_chunking():
+    """
+    iter_json_array() should not care where the chunk boundaries fall.
+    """
+    exp = [
+            {'name': u'caf\xe9', 'links': [{'rel': 'self', 'href': '/a/1'}]},
+            12345,
+            'a string, with [brackets]',
+            None,
+            [1, 2],
+            ]
+    text = json.dumps(exp, indent=2)
+    for size in (1, 2, 3, 7, len(text)):
+        assert exp == list(iter_json_array(_chunked(text, size)))
+
+
+def test_iter_json_array_split_scalars():
+    """
+    Numbers and literals cut at a chunk boundary should be read whole.
+    """
+    assert [1500.0] == list(iter_json_array(['[1.', '5e', '3]']))
+    assert [1234] == list(iter_json_array(['[12', '34]']))
+    assert [True, 1.5, None] == list(
+            iter_json_array(['[tru', 'e, 1', '.5, nu', 'll]']))
+    assert [-7] == list(iter_json_array(['[-', '7', ']']))
+
+
+def test_iter_json_array_big_element_small_chunks():
+    """
+    An element split into many small chunks should not be re-parsed once per
+    chunk.
+    """
+    text = json.dumps([{'description': 'x' * 5000}])
+    orig = json.JSONDecoder.raw_decode
+    with mock.patch.object(json.JSONDecoder, 'raw_decode', autospec=True,
+                           side_effect=orig) as raw_decode:
+        assert 1 == len(list(iter_json_array(_chunked(text, 1))))
+    assert raw_decode.call_count < 30
+
+
+def test_iter_json_array_empty():
+    assert [] == list(iter_json_array([' [', ' ]']))
+
+
+@raises(ValueError)
+def test_iter_json_array_not_array():
+    list(iter_json_array(['{"a": 1}']))
+
+
+@raises(ValueError)
+def test_iter_json_array_truncated():
+    list(iter_json_array(['[{"a": 1}, {"b"']))
+
+
+def test_iter_index_streams_resources():
+    """
+    iter_index() should request a streamed response and yield resources.
+    """
+    response = mock.MagicMock()
+    response.iter_content.return_value = _chunked('[{"a": 1}, {"b": 2}]', 4)
+    client = mock.MagicMock()
+    client.request.return_value = response
+    col = ResourceCollection('/api/clouds', client, RS_DEFAULT_ACTIONS)
+    found = list(col.iter_index(params={'view': 'tiny'}))
+
+    client.request.assert_called_once_with(
+            'get', '/api/clouds', stream=True, params={'view': 'tiny'})
+    assert all(isinstance(r, Resource) for r in found)
+    assert [{'a': 1}, {'b': 2}] == [r.soul for r in found]
+    assert response.close.called
@@ -0,0 +1,106 @@
+import json
+
+from requests.models import PreparedRequest
+
+from rightscale.metrics import Metrics, path_template
+
+from http_fixtures import fake_session_client, raw_response
+
+
+def _raw(status, body, request_body=None):
+    raw = raw_response(status, body, 'application/json')
+    raw.request = PreparedRequest()
+    raw.request.body = request_body
+    return raw
+
+
+def _client(*responses, **kwargs):
+    return fake_session_client(
+            *responses, endpoint='https://rs.example.com',
+            oauth_path='/api/oauth2', refresh_token='x', backoff_base=0,
+            **kwargs)
+
+
+def test_path_template():
+    assert '/api/clouds/:id/instances/:id' == path_template(
+            'https://h/api/clouds/1/instances/ABC12?view=full')
+    assert '/api/clouds/:id/instances/multi_run_executable' == path_template(
+            '/api/clouds/6/instances/multi_run_executable')
+    assert '/api/clouds/:id/instances/:id/live/tasks/:id' == path_template(
+            '/api/clouds/6/instances/XYZ/live/tasks/ae-123')
+    assert '/api/sessions' == path_template('/api/sessions')
+    assert '/api/oauth2' == path_template('/api/oauth2')
+    assert '/api/health-check' == path_template('/api/health-check')
+
+
+def test_collects_per_endpoint():
+    """
+    Logins, statuses, retries and bytes should be counted per template.
+    """
+    metrics = Metrics()
+    client = _client(
+            _raw(200, {'access_token': 't', 'expires_in': 7200},
+                 'grant_type=refresh_token'),
+            _raw(503, {}),
+            _raw(200, [{'name': 'a'}]),
+            _raw(200, {'name': 'b'}),
+            metrics=metrics,
+            max_retries=1,
+            )
+    client.get('/api/clouds/1/instances')
+    client.get('/api/clouds/2/instances/ABC')
+
+    snap = metrics.snapshot()
+    assert 1 == snap['logins']
+    login = snap['endpoints'][('POST', '/api/oauth2')]
+    assert len('grant_type=refresh_token') == login['bytes_out']
+    index = snap['endpoints'][('GET', '/api/clouds/:id/instances')]
+    assert 2 == index['count']
+    assert {200: 1, 503: 1} == index['statuses']
+    assert 1 == index['retries']
+    assert len(json.dumps([{'name': 'a'}])) + 2 == index['bytes_in']
+    assert 2 == index['buckets'][10.0]
+    show = snap['endpoints'][('GET', '/api/clouds/:id/instances/:id')]
+    assert 1 == show['count']
+
+    text = metrics.prometheus()
+    assert 'rightscale_logins_total 1\n' in text
+    assert ('rightscale_requests_total{endpoint="/api/clouds/:id/instances",'
+            'method="GET",status="503"} 1') in text
+    assert ('rightscale_request_duration_seconds_count{endpoint='
+            '"/api/clouds/:id/instances/:id",method="GET"} 1') in text
+    assert '# TYPE rightscale_request_duration_seconds histogram' in text
+
+
+def test_errors_and_broken_hooks():
+    """
+    Failed requests should be recorded, and a failing hook should not break
+    requests.
+    """
+    metrics = Metrics()
+    client = _client(
+            _raw(200, {'access_token': 't', 'expires_in': 7200}),
+            IOError('down'),
+            _raw(200, {}),
+            metrics=metrics,
+            )
+    client.pre_request_hooks.append(lambda event: 1 / 0)
+    try:
+        client.get('/api/clouds')
+    except IOError:
+        pass
+    client.get('/api/clouds')
+    statuses = metrics.snapshot()['endpoints'][('GET', '/api/clouds')]
+    assert {'error': 1, 200: 1} == statuses['statuses']
+
+
+def test_pre_hooks_can_add_headers():
+    client = _client(_raw(200, {}))
+    client.auth_expires_at = float('inf')
+
+    def add_header(event):
+        event.kwargs['headers'] = {'X-Trace': '1'}
+
+    client.pre_request_hooks.append(add_header)
+    client.get('/api/clouds')
+    assert {'X-Trace': '1'} == client.s.request.call_args[1]['headers']
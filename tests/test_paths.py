@@ -0,0 +1,162 @@
+import threading
+import time
+
+import mock
+
+from rightscale import commands
+from rightscale.paths import PathResolver
+from rightscale.util import fan_out
+
+
+def _res(name, **links):
+    res = mock.MagicMock()
+    res.soul = {'name': name}
+    for rel, target in links.items():
+        setattr(res, rel, target)
+    return res
+
+
+class FakeCollection(object):
+    """
+    Collection whose index() applies name== filters as substring matches.
+    """
+    def __init__(self, *resources):
+        self.resources = resources
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def index(self, params=None):
+        with self._lock:
+            self.calls.append(params)
+        if not params:
+            return list(self.resources)
+        name = params['filter[]'][0].split('==', 1)[1]
+        return [r for r in self.resources if name in r.soul['name']]
+
+
+def _fake_api():
+    web = _res('web')
+    db = _res('db')
+    prod = _res('prod-east', servers=FakeCollection(web, db))
+    prod_west = _res('prod-west', servers=FakeCollection(_res('web')))
+    staging = _res('staging', servers=FakeCollection())
+    api = mock.MagicMock()
+    api.deployments = FakeCollection(prod, prod_west, staging)
+    return api, web, db
+
+
+def test_shared_prefixes_resolved_once():
+    """
+    Paths sharing a prefix should only look the prefix up once.
+    """
+    api, web, db = _fake_api()
+    resolver = PathResolver(api)
+    found = resolver.resolve_many([
+        'deployments:prod-east:servers:web',
+        'deployments:prod-east:servers:db',
+        'deployments:nope:servers',
+        ])
+    assert [web] == found['deployments:prod-east:servers:web'].result
+    assert [db] == found['deployments:prod-east:servers:db'].result
+    assert [] == found['deployments:nope:servers'].result
+    assert 2 == len(api.deployments.calls)
+
+
+def test_hops_cached_between_calls():
+    api, web, db = _fake_api()
+    resolver = PathResolver(api)
+    resolver.resolve('deployments:prod-east:servers:web')
+    resolver.resolve('deployments:prod-east:servers:db')
+    assert 1 == len(api.deployments.calls)
+    resolver.clear()
+    resolver.resolve('deployments:prod-east:servers:db')
+    assert 2 == len(api.deployments.calls)
+
+
+def test_per_call_ttl():
+    """
+    A ttl passed to resolve_many() should apply to that call only.
+    """
+    api, web, db = _fake_api()
+    resolver = PathResolver(api)
+    path = 'deployments:prod-east:servers:web'
+    resolver.resolve_many([path], ttl=60)
+    resolver.resolve_many([path], ttl=60)
+    assert 1 == len(api.deployments.calls)
+    resolver.resolve_many([path], ttl=-1)
+    assert 2 == len(api.deployments.calls)
+    assert resolver.ttl is None
+
+
+def test_globs_expand():
+    """
+    Glob parts should follow every matching resource.
+    """
+    api, web, db = _fake_api()
+    resolver = PathResolver(api)
+    nodes = resolver.resolve('deployments:prod-*:servers:web')
+    assert 2 == len(nodes)
+    assert web in nodes
+    assert [{'filter[]': ['name==prod-']}] == api.deployments.calls
+
+
+def test_failures_are_per_path():
+    api, web, db = _fake_api()
+    api.broken = mock.MagicMock(spec=['index'])
+    api.broken.index.side_effect = ValueError('boom')
+    resolver = PathResolver(api)
+    found = resolver.resolve_many([
+        'broken:thing:servers',
+        'deployments:staging',
+        ])
+    assert isinstance(found['broken:thing:servers'].error, ValueError)
+    assert found['deployments:staging'].ok
+
+
+def test_expired_hops_pruned():
+    """
+    Hops older than the ttl should be dropped, not just ignored.
+    """
+    api, web, db = _fake_api()
+    resolver = PathResolver(api, ttl=60)
+    resolver.resolve('deployments:prod-east:servers:web')
+    assert resolver._hops
+    with mock.patch('rightscale.paths.time') as clock:
+        clock.time.return_value = time.time() + 120
+        resolver.resolve_many(['deployments'])
+    assert [('deployments',)] == resolver._hops.keys()
+
+
+def test_get_by_paths_one_pool():
+    """
+    The final lookups of every path should go through a single fan_out().
+    """
+    api, web, db = _fake_api()
+    with mock.patch.object(commands, 'get_api', return_value=api):
+        with mock.patch.object(
+                commands, 'fan_out', wraps=fan_out) as pooled:
+            found = commands.get_by_paths([
+                'deployments:prod-east:servers',
+                'deployments:prod-*:servers',
+                'deployments:nope:servers',
+                ])
+    assert 1 == pooled.call_count
+    assert [web, db] == found['deployments:prod-east:servers'].result
+    assert 2 == len(found['deployments:prod-*:servers'].result)
+    assert found['deployments:nope:servers'].result is None
+
+
+def test_get_by_paths_resolver_per_client():
+    """
+    Remembered hops should not leak from one client's api to another's.
+    """
+    path = 'deployments:prod-east:servers'
+    api, web, db = _fake_api()
+    other, other_web, other_db = _fake_api()
+    with mock.patch.object(commands, 'get_api', return_value=api):
+        found = commands.get_by_paths([path], ttl=60)
+    assert [web, db] == found[path].result
+    with mock.patch.object(commands, 'get_api', return_value=other):
+        found = commands.get_by_paths([path], ttl=60)
+    assert [other_web, other_db] == found[path].result
+    assert 1 == len(other.deployments.calls)
@@ -0,0 +1,125 @@
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+
+import mock
+
+from rightscale.httpclient import HTTPClient
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = '{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _serve():
+    server = ThreadingServer(('127.0.0.1', 0), KeepAliveHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
+def test_default_closes_connections():
+    """
+    Without keepalive, every request should ask the server to close.
+    """
+    client = HTTPClient()
+    assert 'close' == client.s.headers['Connection']
+    assert client.pool_stats is None
+
+
+def test_keepalive_reuses_connections():
+    """
+    Pooled client should count a miss for the first request and hits after.
+    """
+    server, endpoint = _serve()
+    try:
+        client = HTTPClient(endpoint, keepalive=True)
+        assert 'close' != client.s.headers['Connection']
+        for _ in range(3):
+            client._request('get', '/')
+        stats = client.pool_stats.as_dict()
+        assert 1 == stats['misses']
+        assert 2 == stats['hits']
+    finally:
+        server.shutdown()
+
+
+def test_keepalive_max_age():
+    """
+    Connections older than the max age should be re-opened.
+    """
+    server, endpoint = _serve()
+    try:
+        client = HTTPClient(endpoint, keepalive=True, pool_max_age=-1)
+        client._request('get', '/')
+        client._request('get', '/')
+        stats = client.pool_stats.as_dict()
+        assert 0 == stats['hits']
+        assert 2 == stats['misses']
+        assert 1 == stats['expired']
+    finally:
+        server.shutdown()
+
+
+def test_keepalive_idle_time():
+    """
+    max_age should limit how long a connection sat idle, not its total age.
+    """
+    server, endpoint = _serve()
+    clock = mock.MagicMock()
+    try:
+        with mock.patch('rightscale.pool.time', clock):
+            client = HTTPClient(endpoint, keepalive=True, pool_max_age=10)
+            # in use for 14s in all, but never idle for more than 9s
+            for now in (0, 5, 14):
+                clock.time.return_value = now
+                client._request('get', '/')
+            stats = client.pool_stats.as_dict()
+            assert 1 == stats['misses']
+            assert 2 == stats['hits']
+
+            clock.time.return_value = 30
+            client._request('get', '/')
+            stats = client.pool_stats.as_dict()
+            assert 2 == stats['misses']
+            assert 1 == stats['expired']
+    finally:
+        server.shutdown()
+
+
+def test_keepalive_stale():
+    """
+    A pooled connection the server closed should count as stale.
+    """
+    server, endpoint = _serve()
+    try:
+        client = HTTPClient(endpoint, keepalive=True)
+        client._request('get', '/close')
+        # give the server a moment to hang up
+        time.sleep(0.05)
+        client._request('get', '/')
+        stats = client.pool_stats.as_dict()
+        assert 2 == stats['misses']
+        assert 1 == stats['stale']
+    finally:
+        server.shutdown()
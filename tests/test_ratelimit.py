@@ -0,0 +1,103 @@
+import time
+
+import mock
+from nose.tools import raises
+from requests import HTTPError
+
+from rightscale.ratelimit import parse_retry_after, RateLimiter
+
+from http_fixtures import fake_session_client, raw_response
+
+
+def _raw(status, **headers):
+    return raw_response(status, {}, **headers)
+
+
+def test_parse_retry_after():
+    assert 3 == parse_retry_after('3')
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    date = time.strftime(
+            '%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 100))
+    assert 90 < parse_retry_after(date) <= 100
+
+
+def test_limiter_slow_rate():
+    """
+    A rate below one request per second should still let requests through.
+    """
+    with mock.patch('rightscale.ratelimit.time') as clock:
+        clock.time.return_value = 100.0
+        limiter = RateLimiter(rate=0.5)
+        limiter.acquire()
+        assert not clock.sleep.called
+        # the next token takes two seconds
+        clock.time.side_effect = [100.0, 102.0]
+        limiter.acquire()
+        clock.sleep.assert_called_once_with(2.0)
+
+
+def test_limiter_paces_requests():
+    """
+    Once the burst is used up, acquire() should wait for new tokens.
+    """
+    limiter = RateLimiter(rate=50, burst=1, max_rate=50)
+    start = time.time()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.time() - start >= 0.09
+
+
+def test_limiter_aimd():
+    limiter = RateLimiter(rate=10, min_rate=1)
+    limiter.on_throttle()
+    assert 5 == limiter.rate
+    limiter.on_success()
+    assert 5 < limiter.rate < 6
+    for _ in range(10):
+        limiter.on_throttle()
+    assert 1 == limiter.rate
+    assert 11 == limiter.throttled
+
+
+@mock.patch('rightscale.httpclient.time.sleep')
+def test_retries_idempotent_requests(sleep):
+    """
+    GETs should be retried after a 429, waiting at least Retry-After.
+    """
+    client = fake_session_client(
+            _raw(429, **{'Retry-After': '2'}),
+            _raw(503),
+            _raw(200),
+            max_retries=3,
+            )
+    assert 200 == client._request('get', '/api/clouds').status_code
+    assert 3 == client.s.request.call_count
+    assert sleep.call_args_list[0][0][0] >= 2
+
+
+@raises(HTTPError)
+@mock.patch('rightscale.httpclient.time.sleep')
+def test_no_retry_for_post(sleep):
+    client = fake_session_client(_raw(429), _raw(200), max_retries=3)
+    try:
+        client._request('post', '/api/servers/1/launch')
+    finally:
+        assert 1 == client.s.request.call_count
+
+
+@mock.patch('rightscale.httpclient.time.sleep')
+def test_throttling_slows_limiter(sleep):
+    """
+    A 429 should be reported to the limiter, which then honours Retry-After.
+    """
+    limiter = RateLimiter(rate=100)
+    client = fake_session_client(
+            _raw(429, **{'Retry-After': '0.05'}),
+            _raw(200),
+            rate_limiter=limiter,
+            max_retries=1,
+            )
+    client._request('get', '/api/clouds')
+    assert 1 == limiter.throttled
+    assert limiter.rate < 100
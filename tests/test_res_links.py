@@ -1,5 +1,6 @@
 from nose.tools import raises
 from rightscale.rightscale import Resource
+from rightscale.util import index_by_href
 
 
 def test_empty_linky_thing():
@@ -89,3 +90,40 @@ def test_bogus_resource_attr():
     fakey = {'foo': '/foo', 'bar': '/path/to/bar'}
     res = Resource()
     res.fubar
+
+
+def test_href_and_id():
+    """
+    href and id should come from the self link.
+    """
+    res = Resource({'links': [{'rel': 'self', 'href': '/api/clouds/1/x/AB3'}]})
+    assert '/api/clouds/1/x/AB3' == res.href
+    assert 'AB3' == res.id
+    assert '' == Resource().id
+
+
+def test_links_parsed_once():
+    """
+    Repeated href lookups should not re-parse the soul's links.
+    """
+    res = Resource({'links': [{'rel': 'self', 'href': '/a/1'}]})
+    res.href
+    res.soul['links'] = []
+    assert '/a/1' == res.href
+
+
+def test_new_soul_resets_links():
+    """
+    Replacing the soul should drop the cached links.
+    """
+    res = Resource({'links': [{'rel': 'self', 'href': '/a/1'}]})
+    assert '/a/1' == res.links['self']
+    res.soul = {'links': [{'rel': 'self', 'href': '/a/2'}]}
+    assert '/a/2' == res.href
+    assert '/a/2' == res.links['self']
+
+
+def test_index_by_href():
+    a = Resource({'links': [{'rel': 'self', 'href': '/a/1'}]})
+    b = Resource({'links': [{'rel': 'self', 'href': '/a/2'}]})
+    assert {'/a/1': a, '/a/2': b} == index_by_href([a, b, Resource()])
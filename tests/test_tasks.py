@@ -0,0 +1,188 @@
+from StringIO import StringIO
+import threading
+
+import mock
+from nose.tools import raises
+
+from rightscale import commands
+from rightscale.tasks import TaskTimeout, TaskWatcher, WatcherClosed
+
+
+class FakeTasks(object):
+    """
+    Stands in for the client.  Each task goes through its list of summaries,
+    one per poll, and then stays at the last one.
+    """
+    def __init__(self, **summaries):
+        self.summaries = summaries
+        self.polls = dict((k, 0) for k in summaries)
+        self.lock = threading.Lock()
+
+    def get(self, location):
+        with self.lock:
+            n = self.polls[location]
+            self.polls[location] += 1
+        steps = self.summaries[location]
+        summary = steps[min(n, len(steps) - 1)]
+        return mock.MagicMock(**{'json.return_value': {'summary': summary}})
+
+
+def _watcher(client, **kwargs):
+    kwargs.setdefault('min_interval', 0.01)
+    kwargs.setdefault('max_interval', 0.05)
+    return TaskWatcher(client, **kwargs)
+
+
+def test_watches_many_tasks():
+    """
+    Every task should be polled until done and its future resolved.
+    """
+    client = FakeTasks(**dict(
+            ('t%d' % i, ['queued'] * (i % 4) + ['completed: t%d' % i])
+            for i in range(40)
+            ))
+    watcher = _watcher(client)
+    futures = [watcher.watch('t%d' % i, timeout=5) for i in range(40)]
+    for i, f in enumerate(futures):
+        assert 'completed: t%d' % i == f.result(5)['summary']
+        assert i % 4 + 1 == client.polls['t%d' % i]
+    watcher.close()
+
+
+def test_callbacks_and_status():
+    """
+    on_status should see every status and done callbacks should fire once.
+    """
+    client = FakeTasks(a=['queued', 'running', 'failed: oops'])
+    seen = []
+    done = []
+    watcher = _watcher(client)
+    f = watcher.watch('a', on_status=lambda loc, s: seen.append(s['summary']))
+    f.add_done_callback(done.append)
+    f.result(5)
+    assert ['queued', 'running', 'failed: oops'] == seen
+    assert [f] == done
+
+    late = []
+    f.add_done_callback(late.append)
+    assert [f] == late
+    watcher.close()
+
+
+def test_backs_off():
+    """
+    The interval between polls should grow up to max_interval.
+    """
+    client = FakeTasks(slow=['running'])
+    watcher = _watcher(client, min_interval=0.01, max_interval=0.04)
+    f = watcher.watch('slow', timeout=0.3)
+    try:
+        f.result(5)
+    except TaskTimeout:
+        pass
+    watcher.close()
+    # a fixed 0.01s interval would have meant ~30 polls
+    assert 5 < client.polls['slow'] < 15
+
+
+@raises(TaskTimeout)
+def test_timeout():
+    """
+    A task still running at its deadline should fail with TaskTimeout.
+    """
+    watcher = _watcher(FakeTasks(slow=['running']))
+    watcher.watch('slow', timeout=0.05).result(5)
+
+
+def test_poll_errors_are_retried():
+    """
+    A failed poll should not end the watch.
+    """
+    client = mock.MagicMock()
+    ok = mock.MagicMock(**{'json.return_value': {'summary': 'completed'}})
+    client.get.side_effect = [IOError('blip'), ok]
+    watcher = _watcher(client)
+    assert 'completed' == watcher.watch('a', timeout=5).result(5)['summary']
+    watcher.close()
+
+
+def test_run_script_timeout_zero():
+    """
+    run_script_on_server(timeout_s=0) should not poll at all.
+    """
+    api = mock.MagicMock()
+    api.client.post.return_value.headers = {'location': '/api/tasks/1'}
+    out = StringIO()
+    with mock.patch.object(commands, 'get_api', return_value=api):
+        with mock.patch.object(commands, 'find_by_name'):
+            commands.run_script_on_server('s', 'srv', timeout_s=0, output=out)
+    assert not api.client.get.called
+    assert 'Done waiting. Poll /api/tasks/1 for status.\n' == out.getvalue()
+
+
+def test_run_script_prints_statuses():
+    """
+    run_script_on_server should print each status until completion.
+    """
+    api = mock.MagicMock()
+    api.client = FakeTasks(**{'/api/tasks/1': ['queued', 'completed: x']})
+    api.client.post = mock.MagicMock()
+    api.client.post.return_value.headers = {'location': '/api/tasks/1'}
+    out = StringIO()
+    watcher = _watcher(api.client)
+    with mock.patch.object(commands, 'get_api', return_value=api):
+        with mock.patch.object(commands, '_watcher', watcher):
+            with mock.patch.object(commands, 'find_by_name'):
+                commands.run_script_on_server('s', 'srv', output=out)
+    watcher.close()
+    assert 'status: queued\nstatus: completed: x\n' == out.getvalue()
+
+
+@raises(IOError)
+def test_repeated_poll_errors_fail():
+    """
+    A task that can't be polled max_failures times in a row should fail
+    with the last error.
+    """
+    client = mock.MagicMock()
+    client.get.side_effect = IOError('down')
+    watcher = _watcher(client, max_failures=2)
+    try:
+        watcher.watch('a').result(5)
+    finally:
+        assert 2 == client.get.call_count
+        watcher.close()
+
+
+def test_bad_status_fails_only_its_task():
+    """
+    A status the watcher can't make sense of should fail that task, not the
+    watcher's thread.
+    """
+    client = FakeTasks(good=['running', 'completed'])
+    bad = mock.MagicMock(**{'json.return_value': ['not', 'a', 'dict']})
+    get = client.get
+    client.get = lambda loc: bad if loc == 'bad' else get(loc)
+    watcher = _watcher(client)
+    broken = watcher.watch('bad')
+    fine = watcher.watch('good')
+    assert 'completed' == fine.result(5)['summary']
+    try:
+        broken.result(5)
+    except AttributeError:
+        pass
+    else:
+        assert False, 'expected the bad status to fail its future'
+    watcher.close()
+
+
+@raises(WatcherClosed)
+def test_close_fails_pending():
+    """
+    Closing the watcher should fail the futures it was still watching
+    instead of leaving their callers blocked.
+    """
+    watcher = _watcher(FakeTasks(slow=['running']))
+    f = watcher.watch('slow')
+    watcher.close()
+    f.result(5)
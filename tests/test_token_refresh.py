@@ -0,0 +1,71 @@
+import threading
+import time
+
+import mock
+
+from rightscale.httpclient import HTTPClient
+
+
+def _slow_login(client, calls, expires_in=3600):
+    def login(min_ttl=0):
+        calls.append(1)
+        time.sleep(0.05)
+        client.auth_expires_at = time.time() + expires_in
+    return login
+
+
+def test_single_flight_login():
+    """
+    Threads that all see an expired token should share one login.
+    """
+    client = HTTPClient('http://nowhere')
+    calls = []
+    client.login = _slow_login(client, calls)
+    hits = []
+    # list.append is atomic; MagicMock's call counting is not thread-safe
+    client._request = lambda *args, **kwargs: hits.append(1)
+
+    threads = [
+            threading.Thread(target=client.get, args=('/api/clouds',))
+            for _ in range(10)
+            ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert 1 == len(calls)
+    assert 10 == len(hits)
+
+
+@mock.patch('rightscale.httpclient.MIN_RENEW_INTERVAL', 0.05)
+def test_background_renewer():
+    """
+    The renewer should log in ahead of expiry without any requests.
+    """
+    client = HTTPClient('http://nowhere')
+    calls = []
+    client.login = _slow_login(client, calls, expires_in=0.2)
+    client.start_renewer(margin=0.1)
+    try:
+        time.sleep(0.6)
+    finally:
+        client.stop_renewer()
+    # one login at start, then one every ~0.15s (0.1s wait + 0.05s login)
+    assert 3 <= len(calls) <= 6
+
+
+@mock.patch('rightscale.httpclient.MIN_RENEW_INTERVAL', 0.2)
+def test_renewer_short_lived_tokens():
+    """
+    Tokens that expire within the margin should not be renewed back to back.
+    """
+    client = HTTPClient('http://nowhere')
+    calls = []
+    client.login = _slow_login(client, calls, expires_in=0.01)
+    client.start_renewer(margin=1)
+    try:
+        time.sleep(0.6)
+    finally:
+        client.stop_renewer()
+    # one login every 0.2s at most
+    assert 2 <= len(calls) <= 4
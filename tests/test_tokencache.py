@@ -0,0 +1,78 @@
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+import mock
+
+from rightscale.httpclient import HTTPClient
+from rightscale.tokencache import TokenCache
+
+
+class TestTokenCache(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = TokenCache(os.path.join(self.tmpdir, 'tokens'))
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _client(self):
+        client = HTTPClient(
+                'http://nowhere',
+                oauth_path='/api/oauth2',
+                refresh_token='refreshing',
+                token_cache=self.cache,
+                )
+        client._request = mock.MagicMock()
+        client._request.return_value.json.return_value = {
+                'access_token': 'the token',
+                'expires_in': 7200,
+                }
+        return client
+
+    def test_second_client_reuses_token(self):
+        """
+        A client sharing the cache should not have to log in again.
+        """
+        first = self._client()
+        first.login()
+        second = self._client()
+        second.login()
+        assert 1 == first._request.call_count
+        assert 0 == second._request.call_count
+        assert 'Bearer the token' == second.s.headers['Authorization']
+        assert abs(first.auth_expires_at - second.auth_expires_at) < 1
+
+    def test_unusable_cache_ignored(self):
+        """
+        A cache in a missing directory should not stop clients logging in.
+        """
+        self.cache = TokenCache(os.path.join(self.tmpdir, 'nope', 'tokens'))
+        client = self._client()
+        client.login()
+        assert 1 == client._request.call_count
+        assert 'Bearer the token' == client.s.headers['Authorization']
+
+    def test_cache_file_is_private(self):
+        self._client().login()
+        mode = stat.S_IMODE(os.stat(self.cache.path).st_mode)
+        assert 0600 == mode
+        with open(self.cache.path) as f:
+            assert 'refreshing' not in f.read()
+
+    def test_nearly_expired_token_not_reused(self):
+        """
+        Tokens that won't last the requested time should be refreshed.
+        """
+        key = TokenCache.key('http://nowhere', 'refreshing')
+        with self.cache.lock():
+            self.cache.put(key, 'old token', time.time() + 90)
+        client = self._client()
+        client.login()
+        assert 0 == client._request.call_count
+        client.login(min_ttl=60)
+        assert 1 == client._request.call_count
+        assert 'Bearer the token' == client.s.headers['Authorization']
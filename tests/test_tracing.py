@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+
+from nose.tools import raises
+
+from rightscale import tracing
+from rightscale.rightscale import RightScale
+from rightscale.tracing import NPlusOneWarning, Tracer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from fakeapi import FakeRightScale
+
+
+class TestTracer(object):
+    def setup(self):
+        self.fake = FakeRightScale(deployments=6, servers=2).start()
+        self.api = RightScale(
+                refresh_token='x', api_endpoint=self.fake.url,
+                token_cache=None)
+        self.tmp = tempfile.mkdtemp()
+
+    def teardown(self):
+        self.api.client.s.close()
+        self.fake.stop()
+        shutil.rmtree(self.tmp)
+        tracing.active = None
+
+    def _traverse(self, tracer):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            with tracer:
+                for deploy in self.api.deployments.index():
+                    deploy.servers.index()
+        return caught
+
+    def test_span_tree(self):
+        """
+        Action spans should record how they were reached and contain their
+        HTTP requests.
+        """
+        tracer = Tracer(self.api)
+        self._traverse(tracer)
+        assert tracing.active is None
+        assert not self.api.client.pre_request_hooks
+
+        kinds = [(s.kind, s.name) for s in tracer.roots]
+        # the first request for the session links logs in first
+        assert ('http', 'POST /api/oauth2') == kinds[0]
+        assert ('http', 'GET /api/sessions') == kinds[1]
+        assert ('action', 'index /api/deployments') == kinds[2]
+        assert 9 == len(tracer.roots)
+
+        servers = tracer.roots[3]
+        assert 'index /api/deployments/:id/servers' == servers.name
+        assert {
+                'collection': '/api/deployments/1/servers',
+                'action': 'index',
+                'rel': 'servers',
+                'parent': '/api/deployments/1',
+                } == servers.attrs
+        assert ['GET /api/deployments/:id/servers'] == [
+                c.name for c in servers.children]
+        assert 200 == servers.children[0].attrs['status']
+        assert servers.duration >= servers.children[0].duration
+
+    def test_n_plus_one(self):
+        """
+        Running the same action for many items should be reported once.
+        """
+        caught = self._traverse(Tracer(self.api, threshold=3))
+        assert 1 == len(caught)
+        assert issubclass(caught[0].category, NPlusOneWarning)
+        assert __file__.rstrip('c') == caught[0].filename
+        assert 'servers of items of /api/deployments' in str(
+                caught[0].message)
+
+        tracer = Tracer(self.api)
+        self._traverse(tracer)
+        [finding] = tracer.findings
+        assert ('/api/deployments', 'servers', 'index') == finding[:3]
+        assert 5 == finding.count
+
+    def test_show_and_refresh(self):
+        tracer = Tracer(self.api, threshold=2)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            with tracer:
+                clouds = [self.api.clouds.show(res_id=i) for i in (1, 2)]
+                for cloud in clouds:
+                    cloud.refresh()
+                # the same item again is not N+1
+                self.api.deployments.show(res_id=1)
+                self.api.deployments.show(res_id=1)
+        assert 2 == len(caught)
+        assert [
+                ('/api/clouds', None, 'show'),
+                ('/api/clouds', 'self', 'refresh'),
+                ] == [f[:3] for f in tracer.findings]
+
+    def test_export(self):
+        tracer = Tracer(self.api)
+        self._traverse(tracer)
+
+        path = os.path.join(self.tmp, 'trace.json')
+        tracer.save(path)
+        with open(path) as f:
+            data = json.load(f)
+        assert 9 == len(data['spans'])
+        assert 1 == len(data['findings'])
+        assert data['spans'][3]['children'][0]['attrs']['status'] == 200
+
+        path = os.path.join(self.tmp, 'chrome.json')
+        tracer.save(path, format='chrome')
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        assert len(list(tracer.spans())) == len(events)
+        assert set(['action', 'http']) == set(e['cat'] for e in events)
+        assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+
+    @raises(RuntimeError)
+    def test_one_at_a_time(self):
+        with Tracer(self.api):
+            Tracer(self.api).start()
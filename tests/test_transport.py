@@ -0,0 +1,121 @@
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import mock
+from nose.tools import raises
+
+from rightscale.rightscale import RightScale
+from rightscale.transport import (
+        load_trace,
+        normalize_url,
+        RecordingAdapter,
+        ReplayAdapter,
+        ReplayMiss,
+        )
+from rightscale.util import find_by_name
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from fakeapi import FakeRightScale
+
+
+def _api(**kwargs):
+    return RightScale(
+            refresh_token='very-secret',
+            api_endpoint=kwargs.pop('endpoint', 'http://nowhere.invalid'),
+            token_cache=None,
+            **kwargs
+            )
+
+
+def _workload(api):
+    deploy = find_by_name(api.deployments, 'deployment-2')
+    servers = deploy.servers.index()
+    instances = list(api.clouds.show(res_id=1).instances.iter_index())
+    return deploy.soul['name'], len(servers), len(instances)
+
+
+class TestRecordReplay(object):
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'trace.jsonl.gz')
+        fake = FakeRightScale(clouds=1, instances=20, deployments=3).start()
+        try:
+            recorder = RecordingAdapter(self.path)
+            api = _api(endpoint=fake.url, transport=recorder, keepalive=True)
+            self.recorded = _workload(api)
+            recorder.close()
+        finally:
+            fake.stop()
+
+    def teardown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_replay_matches_recording(self):
+        """
+        Replaying should give the same results without a server.
+        """
+        replay = ReplayAdapter(self.path)
+        assert self.recorded == _workload(_api(transport=replay))
+        assert len(load_trace(self.path)) == replay.served
+
+    def test_secrets_are_redacted(self):
+        with gzip.open(self.path, 'rb') as f:
+            text = f.read()
+        assert 'very-secret' not in text
+        assert 'Bearer' not in text
+        entries = load_trace(self.path)
+        login = [e for e in entries if e['url'] == '/api/oauth2'][0]
+        assert 'REDACTED' in login['request_body']
+        assert 'REDACTED' in login['body']
+        assert all(e['elapsed'] >= 0 for e in entries)
+
+    @raises(ReplayMiss)
+    def test_unknown_request(self):
+        _api(transport=ReplayAdapter(self.path)).servers.index()
+
+    @raises(ReplayMiss)
+    def test_no_cycle(self):
+        api = _api(transport=ReplayAdapter(self.path, cycle=False))
+        _workload(api)
+        _workload(api)
+
+    def test_cycle(self):
+        api = _api(transport=ReplayAdapter(self.path))
+        _workload(api)
+        assert self.recorded == _workload(api)
+
+
+def test_normalize_url():
+    assert '/api/x?a=1&b=2' == normalize_url('https://h/api/x?b=2&a=1')
+    assert '/api/x' == normalize_url('http://h:1/api/x')
+
+
+def test_replay_speed_follows_timeline():
+    """
+    Responses should wait for their recorded offset, scaled by speed, and
+    then take their recorded latency.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'trace.jsonl')
+        with open(path, 'w') as f:
+            for t, elapsed, url in ((1.0, 0.1, '/a'), (3.0, 0.2, '/b')):
+                f.write(json.dumps({
+                        't': t, 'elapsed': elapsed, 'method': 'GET',
+                        'url': url, 'status': 200, 'reason': 'OK',
+                        'headers': {}, 'body': '{}', 'base64': False,
+                        }) + '\n')
+        replay = ReplayAdapter(path, speed=2.0)
+        with mock.patch('rightscale.transport.time') as clock:
+            clock.time.side_effect = [100.0, 100.5]
+            replay.send(mock.Mock(method='GET', url='http://h/a'))
+            replay.send(mock.Mock(method='GET', url='http://h/b'))
+        delays = [c[0][0] for c in clock.sleep.call_args_list]
+        assert [0.05, 0.6] == [round(d, 6) for d in delays]
+    finally:
+        shutil.rmtree(tmp)